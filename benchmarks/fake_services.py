@@ -0,0 +1,210 @@
+"""
+Local stand-ins for the services the project talks to, for benchmarking without the network or real accounts:
+
+- FakeRedditServer serves Reddit's OAuth token endpoint, subreddit search listings and Google's OAuth token endpoint
+- FakeSmtpServer accepts SMTP sessions with XOAUTH2 authentication and counts the messages it's sent, discarding them
+
+PRAW is pointed at FakeRedditServer with the oauth_url and reddit_url PRAW settings, and EmailTools with its
+GOOGLE_ACCOUNTS_BASE_URL.
+"""
+import json
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Reddit returns at most this many submissions per listing page
+LISTING_PAGE_SIZE = 100
+
+
+# Serves Reddit's OAuth token and search endpoints, and Google's OAuth token endpoint, over HTTP on localhost. Every
+# search returns the same number of results, ending with the newest generation of submissions. Calling
+# advance_generation makes every search return a fresh set of submissions newer than the last
+class FakeRedditServer:
+
+    # Returns the listing page dict for the search query, starting after the given fullname
+    def get_listing_page(self, subreddits, query, after):
+        with self._lock:
+            generation = self._generation
+        query_id = zlib.crc32("{}|{}".format(subreddits, query).encode("utf-8"))
+        submission_list = []
+        for result_index in range(self._results_per_search):
+            submission_id = "g{}q{}r{}".format(generation, query_id, result_index)
+            submission_list.append({"kind": "t3", "data": {
+                "id": submission_id, "name": "t3_" + submission_id,
+                "title": "{} result {} of generation {}".format(query, result_index, generation),
+                "selftext": "", "permalink": "/r/{}/comments/{}/".format(subreddits.split("+")[0], submission_id),
+                "url": "https://example.com/{}".format(submission_id), "subreddit": subreddits.split("+")[0],
+                "created_utc": self._generation_start_utc + generation * 60 * 60 - result_index}})
+
+        start_index = 0
+        if after is not None:
+            start_index = next((index + 1 for index, submission in enumerate(submission_list)
+                                if submission["data"]["name"] == after), len(submission_list))
+        page_list = submission_list[start_index:start_index + LISTING_PAGE_SIZE]
+        next_after = None
+        if start_index + LISTING_PAGE_SIZE < len(submission_list):
+            next_after = page_list[-1]["data"]["name"]
+        return {"kind": "Listing", "data": {"after": next_after, "before": None, "children": page_list}}
+
+    # Make every search return a new set of submissions, as if they were all posted since the last cycle
+    def advance_generation(self):
+        with self._lock:
+            self._generation += 1
+
+    # Returns a dict of endpoint names to the number of requests made to them
+    def get_request_counts(self):
+        with self._lock:
+            return dict(self._request_count_dict)
+
+    # Count a request to the endpoint
+    def record_request(self, endpoint_name):
+        with self._lock:
+            self._request_count_dict[endpoint_name] = self._request_count_dict.get(endpoint_name, 0) + 1
+
+    # Returns the base URL of the server
+    def get_url(self):
+        return "http://127.0.0.1:{}".format(self._http_server.server_port)
+
+    def shutdown(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+
+    # Constructor to pass in the number of results each search returns and the latency added to every request
+    def __init__(self, results_per_search, latency_seconds=0):
+        self._results_per_search = results_per_search
+        self._latency_seconds = latency_seconds
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._generation_start_utc = time.time() - 60 * 60
+        self._request_count_dict = {}
+        fake_server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def __send_json(self, status_code, body_dict, extra_headers=None):
+                body = json.dumps(body_dict).encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for header_name, header_value in (extra_headers or {}).items():
+                    self.send_header(header_name, header_value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                time.sleep(fake_server._latency_seconds)
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.startswith("/api/v1/access_token"):
+                    fake_server.record_request("reddit_token")
+                    self.__send_json(200, {"access_token": "fake-reddit-token", "token_type": "bearer",
+                                           "expires_in": 86400, "scope": "*"})
+                elif self.path.startswith("/o/oauth2/token"):
+                    fake_server.record_request("google_token")
+                    self.__send_json(200, {"access_token": "fake-google-token", "expires_in": 3600})
+                else:
+                    self.__send_json(404, {"error": 404})
+
+            def do_GET(self):
+                time.sleep(fake_server._latency_seconds)
+                parsed_url = urllib.parse.urlparse(self.path)
+                search_match = re.match(r"^/r/([^/]+)/search/?$", parsed_url.path)
+                if search_match is None:
+                    self.__send_json(404, {"error": 404})
+                    return
+                fake_server.record_request("reddit_search")
+                params = urllib.parse.parse_qs(parsed_url.query)
+                listing = fake_server.get_listing_page(urllib.parse.unquote(search_match.group(1)),
+                                                       params.get("q", [""])[0], params.get("after", [None])[0])
+                # A budget large enough that PRAW never waits on it
+                self.__send_json(200, listing, {"x-ratelimit-remaining": "10000", "x-ratelimit-used": "1",
+                                                "x-ratelimit-reset": "600"})
+
+        self._http_server = ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+        self._http_server.daemon_threads = True
+        threading.Thread(target=self._http_server.serve_forever, daemon=True).start()
+
+
+# Accepts SMTP sessions on localhost, answering the commands EmailTools sends (including AUTH XOAUTH2 and NOOP) and
+# counting the messages it receives without storing them
+class FakeSmtpServer:
+
+    # Returns a dict with the number of sessions opened, messages received and message bytes received
+    def get_counts(self):
+        with self._lock:
+            return {"smtp_sessions": self._session_count, "smtp_messages": self._message_count,
+                    "smtp_bytes": self._byte_count}
+
+    # Count a new SMTP session
+    def record_session(self):
+        with self._lock:
+            self._session_count += 1
+
+    # Count a received message of the given size
+    def record_message(self, byte_count):
+        with self._lock:
+            self._message_count += 1
+            self._byte_count += byte_count
+
+    def get_port(self):
+        return self._tcp_server.server_address[1]
+
+    def shutdown(self):
+        self._tcp_server.shutdown()
+        self._tcp_server.server_close()
+
+    # Constructor to pass in the latency added to every message
+    def __init__(self, latency_seconds=0):
+        self._latency_seconds = latency_seconds
+        self._lock = threading.Lock()
+        self._session_count = 0
+        self._message_count = 0
+        self._byte_count = 0
+        fake_server = self
+
+        class SmtpHandler(socketserver.StreamRequestHandler):
+
+            def __reply(self, line):
+                self.wfile.write((line + "\r\n").encode("ascii"))
+
+            def handle(self):
+                fake_server.record_session()
+                self.__reply("220 localhost fake SMTP ready")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode("utf-8", "replace").strip().split(" ")[0].upper()
+                    if command in ["EHLO", "HELO"]:
+                        self.__reply("250-localhost")
+                        self.__reply("250 AUTH XOAUTH2")
+                    elif command == "AUTH":
+                        self.__reply("235 2.7.0 Accepted")
+                    elif command in ["MAIL", "RCPT", "RSET", "NOOP"]:
+                        self.__reply("250 OK")
+                    elif command == "DATA":
+                        self.__reply("354 End data with <CR><LF>.<CR><LF>")
+                        byte_count = 0
+                        while True:
+                            data_line = self.rfile.readline()
+                            if not data_line or data_line == b".\r\n":
+                                break
+                            byte_count += len(data_line)
+                        time.sleep(fake_server._latency_seconds)
+                        fake_server.record_message(byte_count)
+                        self.__reply("250 OK queued")
+                    elif command == "QUIT":
+                        self.__reply("221 Bye")
+                        return
+                    else:
+                        self.__reply("502 Command not implemented")
+
+        self._tcp_server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SmtpHandler)
+        self._tcp_server.daemon_threads = True
+        threading.Thread(target=self._tcp_server.serve_forever, daemon=True).start()
@@ -0,0 +1,237 @@
+"""
+End to end benchmark running SearchAndEmailExecutor through full search, dedupe, render and send cycles against the
+local stand-ins for Reddit, Google and SMTP in benchmarks.fake_services, with a synthetic config of N searches, each
+sent to M recipients and returning K results per cycle. Every cycle finds a fresh set of results, so each one is
+deduped, rendered and sent in full. The dedupe store can be filled with a history of previously seen IDs first.
+
+Results are written as JSON so runs can be compared across commits.
+
+Run from the project directory with: python3 -m benchmarks.pipeline_benchmark --searches 50 --recipients 10 --results 25
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_services import FakeRedditServer, FakeSmtpServer
+from search_runner import SearchAndEmailExecutor
+from util import metrics
+from util.dedupe_store import create_dedupe_store
+from util.email_tools import EmailTools
+from util.json_config_parser import JsonConfig
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Number of IDs added to the dedupe history per transaction when filling it
+HISTORY_CHUNK_SIZE = 100000
+
+
+# Wraps an object, adding the wall time of every call to the named methods to a shared dict of stage timings. Time
+# observed by the excluded histogram during a call, like rendering done inside it, is left out of the call's time
+class TimedProxy:
+
+    def __getattr__(self, attribute):
+        wrapped_attribute = getattr(self._wrapped_object, attribute)
+        if attribute not in self._method_stage_dict:
+            return wrapped_attribute
+        stage_name = self._method_stage_dict[attribute]
+
+        def timed_call(*args, **kwargs):
+            excluded_seconds_before = self.__get_excluded_seconds()
+            start_time = time.perf_counter()
+            try:
+                return wrapped_attribute(*args, **kwargs)
+            finally:
+                self._stage_seconds_dict[stage_name] = self._stage_seconds_dict.get(stage_name, 0) + \
+                    time.perf_counter() - start_time - (self.__get_excluded_seconds() - excluded_seconds_before)
+        return timed_call
+
+    # Returns the total seconds observed by the excluded histogram so far
+    def __get_excluded_seconds(self):
+        return self._excluded_histogram.get_totals()[1] if self._excluded_histogram is not None else 0
+
+    # Constructor to pass in the object to wrap, a dict of method names to the stage they're timed under, the dict the
+    # timings are added to, and optionally a histogram of time to leave out of them
+    def __init__(self, wrapped_object, method_stage_dict, stage_seconds_dict, excluded_histogram=None):
+        self._wrapped_object = wrapped_object
+        self._method_stage_dict = method_stage_dict
+        self._stage_seconds_dict = stage_seconds_dict
+        self._excluded_histogram = excluded_histogram
+
+
+# Write a config with the synthetic searches and the fake services' addresses to the work directory, returning its path
+def write_benchmark_config(work_directory, args, reddit_url, smtp_port):
+    # Each recipient gets their own copy of every search, so each is sent their own email. Copies share a query, which
+    # is only sent to Reddit once per cycle
+    recipient_list = ["recipient{}@example.com".format(recipient_index) for recipient_index in range(args.recipients)]
+    search_list = [{"search_name": "Benchmark search {}".format(search_index),
+                    "subreddits": "benchsub{}".format(search_index % args.subreddits),
+                    "search_params": "title:term{}".format(search_index),
+                    "email_recipient": email_recipient}
+                   for search_index in range(args.searches) for email_recipient in recipient_list]
+    config_dict = {
+        "searches": search_list,
+        "search_concurrency": args.concurrency,
+        "search_batching": args.batching,
+        "praw_client_id": "benchmark",
+        "praw_client_secret": "benchmark",
+        "praw_settings": [{"oauth_url": reddit_url, "reddit_url": reddit_url}],
+        "logging": [{"console_log_level": "WARNING", "file_log_level": "WARNING", "file_log_absolute_path": ""}],
+        "dedupe_settings": [{"backend": args.backend}],
+        "email_spool_settings": [{"mode": args.delivery}],
+        "email_settings": [{"email_format": args.emailformat, "email_sender": "sender@example.com",
+                            "default_email_recipient": recipient_list[0], "google_api_client_id": "benchmark",
+                            "google_api_client_secret": "benchmark", "google_refresh_token": "benchmark",
+                            "smtp_host": "127.0.0.1", "smtp_port": smtp_port, "smtp_security": "none"}]
+    }
+    config_path = os.path.join(work_directory, "benchmark_config.json")
+    with open(config_path, 'w') as opened_file:
+        json.dump(config_dict, opened_file, indent=4)
+    return config_path
+
+
+# Fill the dedupe store in the work directory with the given number of previously seen IDs
+def fill_dedupe_history(work_directory, backend, history_count):
+    dedupe_store = create_dedupe_store(backend, work_directory, None, "WARNING")
+    for chunk_start in range(0, history_count, HISTORY_CHUNK_SIZE):
+        dedupe_store.add(["history{}".format(history_index) for history_index in
+                          range(chunk_start, min(history_count, chunk_start + HISTORY_CHUNK_SIZE))])
+    dedupe_store.close()
+
+
+# Returns the short hash of the checked out commit, or None if it can't be found
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIRECTORY,
+                                       stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Run the benchmark described by the parsed arguments and return its results as a dict
+def run_benchmark(args):
+    work_directory = tempfile.mkdtemp(prefix="search_benchmark_")
+    reddit_server = FakeRedditServer(args.results, args.redditlatencyms / 1000)
+    smtp_server = FakeSmtpServer(args.smtplatencyms / 1000)
+    try:
+        # Point EmailTools at the fake Google token endpoint. PRAW is pointed at the fake Reddit through the config
+        EmailTools.GOOGLE_ACCOUNTS_BASE_URL = reddit_server.get_url()
+
+        config_path = write_benchmark_config(work_directory, args, reddit_server.get_url(), smtp_server.get_port())
+        history_start_time = time.perf_counter()
+        fill_dedupe_history(work_directory, args.backend, args.history)
+        history_seconds = time.perf_counter() - history_start_time
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        start_time = time.perf_counter()
+        configuration = JsonConfig([config_path, os.path.join(PROJECT_DIRECTORY, "default_base_config.json")])
+        cli_args = argparse.Namespace(config=config_path, skipdedupe=False, onerun=True, stream=False,
+                                      profile=None, shard=None, dryrun=False)
+        executor = SearchAndEmailExecutor(cli_args, configuration, work_directory)
+        executor.initialize_praw()
+        executor.initialize_email()
+        startup_seconds = time.perf_counter() - start_time
+
+        # Time the dedupe store and the SMTP sends separately from the stages that call them. When emails are spooled,
+        # they're rendered inside the claim, which is counted as render time rather than dedupe time
+        stage_seconds_dict = {}
+        executor._dedupe_store = TimedProxy(executor._dedupe_store, {"filter_new": "dedupe", "add": "dedupe",
+                                                                     "claim": "dedupe", "evict_expired": "dedupe"},
+                                            stage_seconds_dict, metrics.EMAIL_RENDER_DURATION_SECONDS)
+        executor._email_tools = TimedProxy(executor._email_tools, {"send_mail": "send"}, stage_seconds_dict)
+
+        cycle_list = []
+        for cycle_index in range(args.cycles):
+            if cycle_index > 0:
+                reddit_server.advance_generation()
+            stage_seconds_dict.clear()
+            request_counts_before = reddit_server.get_request_counts()
+
+            # Rendering happens during the searches' dedupe when emails are spooled, so it's timed by its metric
+            render_seconds_before = metrics.EMAIL_RENDER_DURATION_SECONDS.get_totals()[1]
+            cycle_start_time = time.perf_counter()
+            recipient_count = executor.execute_searches()
+            searched_time = time.perf_counter()
+            search_render_seconds = metrics.EMAIL_RENDER_DURATION_SECONDS.get_totals()[1] - render_seconds_before
+            if recipient_count > 0:
+                executor.generate_and_send_emails()
+                executor.flush_email_spool()
+            cycle_end_time = time.perf_counter()
+            render_seconds = metrics.EMAIL_RENDER_DURATION_SECONDS.get_totals()[1] - render_seconds_before
+
+            request_counts_after = reddit_server.get_request_counts()
+            cycle_list.append({
+                "wall_seconds": cycle_end_time - cycle_start_time,
+                "search_seconds": searched_time - cycle_start_time - stage_seconds_dict.get("dedupe", 0) -
+                search_render_seconds,
+                "dedupe_seconds": stage_seconds_dict.get("dedupe", 0),
+                "render_seconds": render_seconds,
+                "send_seconds": stage_seconds_dict.get("send", 0),
+                "recipients_with_results": recipient_count,
+                "api_calls": {endpoint_name: request_count - request_counts_before.get(endpoint_name, 0)
+                              for endpoint_name, request_count in request_counts_after.items()}})
+        total_seconds = time.perf_counter() - start_time
+
+        result_dict = {
+            "commit": get_git_commit(),
+            "python_version": platform.python_version(),
+            "parameters": vars(args),
+            "history_fill_seconds": history_seconds,
+            "startup_seconds": startup_seconds,
+            "wall_seconds": total_seconds,
+            "cycles": cycle_list,
+            "api_calls": reddit_server.get_request_counts(),
+            "smtp": smtp_server.get_counts(),
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin"
+                                                                                  else 1)}
+        if args.tracemalloc:
+            result_dict["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        executor._email_tools.close()
+        return result_dict
+    finally:
+        reddit_server.shutdown()
+        smtp_server.shutdown()
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark full search and email cycles against local fake services')
+    parser.add_argument('--searches', help="Number of searches (N)", type=int, default=20)
+    parser.add_argument('--recipients', help="Number of recipients of each search (M)", type=int, default=5)
+    parser.add_argument('--results', help="Number of new results per search per cycle (K). PRAW stops searches at 100",
+                        type=int, default=25)
+    parser.add_argument('--subreddits', help="Number of distinct subreddits the searches are spread over", type=int,
+                        default=5)
+    parser.add_argument('--cycles', help="Number of search and email cycles to run", type=int, default=3)
+    parser.add_argument('--history', help="Number of previously seen IDs in the dedupe store", type=int, default=0)
+    parser.add_argument('--backend', help="Dedupe store backend", choices=["sqlite", "csv"], default="sqlite")
+    parser.add_argument('--concurrency', help="Value of search_concurrency", type=int, default=4)
+    parser.add_argument('--batching', help="Value of search_batching", choices=["none", "or"], default="none")
+    parser.add_argument('--emailformat', help="Value of email_settings.email_format", choices=["markdown", "html"],
+                        default="markdown")
+    parser.add_argument('--delivery', help="Value of email_spool_settings.mode", choices=["spool", "inline"],
+                        default="spool")
+    parser.add_argument('--redditlatencyms', help="Latency added to every fake Reddit request", type=float,
+                        default=0)
+    parser.add_argument('--smtplatencyms', help="Latency added to every fake SMTP message", type=float, default=0)
+    parser.add_argument('--tracemalloc', help="Also report the peak traced Python memory, which slows the run",
+                        action='store_true')
+    parser.add_argument('--output', '-o', help="File to write the JSON results to instead of stdout", type=str)
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    if args.output is None:
+        print(json.dumps(results, indent=4))
+    else:
+        with open(args.output, 'w') as opened_file:
+            json.dump(results, opened_file, indent=4)
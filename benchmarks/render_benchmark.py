@@ -0,0 +1,79 @@
+"""
+Micro-benchmark comparing rendering every recipient's email from scratch against sharing each search's rendered
+fragment between recipients with EmailRenderer.
+
+Run from the project directory with: python3 -m benchmarks.render_benchmark --recipients 200
+"""
+import argparse
+import time
+
+import markdown
+
+from util.email_render import EmailRenderer, construct_email_markdown
+from util.submission_record import SubmissionRecord
+
+
+# Returns a dict of recipient emails to dicts of search names to dicts of submissions, where each recipient is
+# subscribed to a rotating subset of the searches
+def generate_results(recipient_count, search_count, searches_per_recipient, results_per_search):
+    search_dict = {}
+    for search_index in range(search_count):
+        search_dict["Search {}".format(search_index)] = {
+            "s{}r{}".format(search_index, result_index): SubmissionRecord(
+                "s{}r{}".format(search_index, result_index), "Result {} of search {} [with] *markdown*".format(
+                    result_index, search_index), "/r/test/comments/s{}r{}/".format(search_index, result_index),
+                0, "test", "https://example.com") for result_index in range(results_per_search)}
+
+    search_name_list = list(search_dict.keys())
+    result_dict = {}
+    for recipient_index in range(recipient_count):
+        result_dict["recipient{}@example.com".format(recipient_index)] = {
+            search_name_list[(recipient_index + offset) % search_count]:
+                search_dict[search_name_list[(recipient_index + offset) % search_count]]
+            for offset in range(searches_per_recipient)}
+    return result_dict
+
+
+# Render every recipient's email the way it was done before fragments were shared
+def render_per_recipient(result_dict):
+    for dict_of_searches_and_submissions in result_dict.values():
+        email_body_markdown = construct_email_markdown(dict_of_searches_and_submissions)
+        markdown.markdown(email_body_markdown)
+
+
+# Render every recipient's email with a single EmailRenderer so fragments are shared
+def render_shared(result_dict, use_markdown):
+    email_renderer = EmailRenderer(use_markdown)
+    for dict_of_searches_and_submissions in result_dict.values():
+        email_renderer.render_email(dict_of_searches_and_submissions)
+
+
+# Returns the best wall time in seconds of the given number of calls to the function
+def time_best_of(repeat_count, function, *args):
+    best_seconds = None
+    for _ in range(repeat_count):
+        start_time = time.perf_counter()
+        function(*args)
+        elapsed_seconds = time.perf_counter() - start_time
+        best_seconds = elapsed_seconds if best_seconds is None else min(best_seconds, elapsed_seconds)
+    return best_seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark email rendering')
+    parser.add_argument('--recipients', help="Number of email recipients", type=int, default=100)
+    parser.add_argument('--searches', help="Number of distinct searches", type=int, default=20)
+    parser.add_argument('--searchesperrecipient', help="Searches each recipient subscribes to", type=int, default=5)
+    parser.add_argument('--results', help="Results per search", type=int, default=25)
+    parser.add_argument('--repeat', help="Number of timed repetitions, the best is reported", type=int, default=5)
+    args = parser.parse_args()
+
+    results = generate_results(args.recipients, args.searches, args.searchesperrecipient, args.results)
+    per_recipient_seconds = time_best_of(args.repeat, render_per_recipient, results)
+    shared_seconds = time_best_of(args.repeat, render_shared, results, True)
+    direct_html_seconds = time_best_of(args.repeat, render_shared, results, False)
+
+    print("Per recipient Markdown:   {:8.4f}s".format(per_recipient_seconds))
+    print("Shared Markdown fragments:{:8.4f}s ({:.1f}x)".format(shared_seconds, per_recipient_seconds / shared_seconds))
+    print("Shared direct HTML:       {:8.4f}s ({:.1f}x)".format(direct_html_seconds,
+                                                              per_recipient_seconds / direct_html_seconds))
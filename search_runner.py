@@ -1,222 +1,1007 @@
-# Reddit API
-import praw
+# Used for catching Reddit API errors raised by PRAW
+import prawcore
 # Used for checking file existence and type
 from os import path
-# Used for running a function on an interval
-import schedule
 # Used for sleeping the thread
 import time
-# Used for formatting markdown to HTML
-import markdown
 # Used for getting more easily defined CLI args
 import argparse
 # Used for getting the list of arguments with which the program was called
 import sys
 # Used for getting the directory path of this script
 import os
+# Used for checking the log level before building per-submission log messages
+import logging
+# Used for running searches concurrently on a bounded pool of worker threads
+from concurrent.futures import ThreadPoolExecutor, as_completed
+# Used for guarding state shared between search worker threads
+import threading
 
-from util.email_tools import EmailTools, create_mime_email
+from contextlib import nullcontext
+
+from util.dedupe_store import create_dedupe_store
+from util.digest_buffer import DigestBuffer, DigestPolicy
+from util.email_render import EmailRenderer
+from util.email_spool import EmailSpool, EmailSpoolWorker
 from util.json_config_parser import JsonConfig
 from util.log_setup import get_logger_with_name
+from util import metrics
+from util.reddit_clients import NoRedditCredentialsError, RedditClientPool
+from util.search_planner import get_batched_queries, get_search_groups, get_shard_queries, get_unbatched_queries, \
+    plan_searches
+from util.search_query import match_search_query, normalize_text
+from util.search_rates import SearchRateStore
+from util.search_scheduler import SearchScheduler
+from util.search_state import SearchStateStore, get_search_state_key
+from util.stream_matcher import SearchMatcher
+from util.submission_record import SearchResultIndex, create_submission_record
+
+# Seconds to wait before reconnecting after the submission stream fails
+STREAM_RECONNECT_SECONDS = 30
+
+# Settings only read when the script starts, so a config reload can't apply changes to them
+RESTART_REQUIRED_KEYS = ["logging", "email_spool_settings", "metrics_settings", "control_settings",
+                         "profile_settings", "search_jitter_seconds", "stream_flush_seconds"]
+
+# Settings the Reddit clients are created from, so a config reload changing them recreates the clients
+REDDIT_CLIENT_KEYS = ["praw_client_id", "praw_client_secret", "praw_credentials", "praw_settings",
+                      "http_cache_settings"]
+
+# Maximum seconds the scheduler sleeps before checking the config files for changes
+CONFIG_RELOAD_SECONDS = 60
+
+
+# Raise an exception if the configuration can't be used to run searches. Used to reject modified config files
+def validate_configuration(configuration):
+    search_list = configuration.get_config_value("searches", simplify_singleton=False)
+    for search_params in search_list:
+        if not isinstance(search_params, dict):
+            raise ValueError("Search [{}] is not an object".format(search_params))
+        for search_key in ["search_name", "subreddits", "search_params"]:
+            if not isinstance(search_params.get(search_key), str) or search_params.get(search_key) == "":
+                raise ValueError("Search [{}] is missing a value for [{}]".format(search_params, search_key))
+    get_search_intervals(configuration)
+    get_adaptive_interval_settings(configuration)
+    get_digest_policy(configuration)
+    get_dedupe_max_age_days(configuration)
+    http_cache_mode = configuration.get_config_value("http_cache_settings.mode", fail_quietly=True) or "off"
+    if http_cache_mode != "off":
+        from util.http_cache import HTTP_CACHE_MODES
+        if http_cache_mode not in HTTP_CACHE_MODES:
+            raise ValueError("http_cache_settings.mode [{}] is not one of {}".format(http_cache_mode,
+                                                                                     HTTP_CACHE_MODES))
+
+
+# Returns the (min_interval_seconds, max_interval_seconds, target_results_per_run, half_life_seconds) settings for
+# adaptive polling intervals, using the defaults for any that aren't set. Raises an exception if any are invalid
+def get_adaptive_interval_settings(configuration):
+    setting_list = []
+    for setting_name, default_value, multiplier in [("min_interval_minutes", 5, 60), ("max_interval_minutes", 1440, 60),
+                                                    ("target_results_per_run", 1, 1),
+                                                    ("history_half_life_hours", 168, 60 * 60)]:
+        setting_value = configuration.get_config_value("adaptive_interval_settings." + setting_name,
+                                                       fail_quietly=True) or default_value
+        if isinstance(setting_value, bool) or not isinstance(setting_value, (int, float)) or setting_value <= 0:
+            raise ValueError("adaptive_interval_settings.{} [{}] is not a positive number".format(setting_name,
+                                                                                                  setting_value))
+        setting_list.append(setting_value * multiplier)
+    if setting_list[0] > setting_list[1]:
+        raise ValueError("adaptive_interval_settings.min_interval_minutes is greater than max_interval_minutes")
+    return tuple(setting_list)
+
+
+# Returns a dict of each search name to its interval in seconds. A search's own search_interval_minutes is used if
+# set. Otherwise the global search_interval_minutes is used, or in the adaptive search_interval_mode, an interval
+# learned from the search's result rate if a SearchRateStore is passed in. Raises an exception if any setting is invalid
+def get_search_intervals(configuration, search_rates=None):
+    default_interval_minutes = configuration.get_config_value("search_interval_minutes")
+    if isinstance(default_interval_minutes, bool) or not isinstance(default_interval_minutes, (int, float)) or \
+            default_interval_minutes <= 0:
+        raise ValueError("search_interval_minutes [{}] is not a positive number".format(default_interval_minutes))
+    adaptive_interval_settings = None
+    if configuration.get_config_value("search_interval_mode", fail_quietly=True) == "adaptive":
+        adaptive_interval_settings = get_adaptive_interval_settings(configuration)
+
+    search_interval_dict = {}
+    for search_params in configuration.get_config_value("searches", simplify_singleton=False):
+        search_name = search_params.get("search_name")
+        interval_minutes = search_params.get("search_interval_minutes", default_interval_minutes)
+        if isinstance(interval_minutes, bool) or not isinstance(interval_minutes, (int, float)) or \
+                interval_minutes <= 0:
+            raise ValueError("search_interval_minutes [{}] for search [{}] is not a positive number".format(
+                interval_minutes, search_name))
+        interval_seconds = interval_minutes * 60
+        if adaptive_interval_settings is not None and search_rates is not None and \
+                "search_interval_minutes" not in search_params:
+            interval_seconds = search_rates.get_interval(search_name, interval_seconds, *adaptive_interval_settings[:3])
+        # Searches sharing a name share a schedule, running on the shortest of their intervals
+        search_interval_dict[search_name] = min(interval_seconds,
+                                                search_interval_dict.get(search_name, interval_seconds))
+    return search_interval_dict
+
+
+# Returns the digest setting as a number of seconds after multiplying it, raising an exception if it isn't a
+# non-negative number
+def get_digest_setting(setting_name, setting_value, multiplier=1):
+    if isinstance(setting_value, bool) or not isinstance(setting_value, (int, float)) or setting_value < 0:
+        raise ValueError("{} [{}] is not a non-negative number".format(setting_name, setting_value))
+    return setting_value * multiplier
 
 
-# Returns a string of markdown formatted text
-def construct_email_markdown(dict_of_searches_and_submissions):
-    email_body_lines = []
-    email_body_lines.append("## New Search Results Found!")
-    for dict_entry_tuple in dict_of_searches_and_submissions.items():
-        # Add the search name from the JSON
-        email_body_lines.append('### {}'.format(dict_entry_tuple[0]))
-        # Add all the separate submissions as their titles with hyperlinks to the post
-        for submission in dict_entry_tuple[1].values():
-            email_body_lines.append('- [{}](https://reddit.com{})'.format(submission.title, submission.permalink))
-    # Aggregate the lines of markdown into a single string and return
-    return "\n".join(email_body_lines)
+# Returns the dedupe_settings.max_age_days setting, or None to keep submission IDs forever. Config lookups treat 0 and
+# null as unset and fall back to the default, so an explicit 0 or null is looked for in the settings themselves first.
+# Raises an exception if it isn't a non-negative number
+def get_dedupe_max_age_days(configuration):
+    max_age_days = configuration.get_config_value("dedupe_settings.max_age_days", fail_quietly=True)
+    for dedupe_params in configuration.get_config_value("dedupe_settings", simplify_singleton=False,
+                                                        fail_quietly=True) or []:
+        if isinstance(dedupe_params, dict) and "max_age_days" in dedupe_params:
+            max_age_days = dedupe_params["max_age_days"]
+            break
+    if isinstance(max_age_days, bool) or not isinstance(max_age_days, (int, float, type(None))) or \
+            (max_age_days is not None and max_age_days < 0):
+        raise ValueError("dedupe_settings.max_age_days [{}] is not a non-negative number".format(max_age_days))
+    return max_age_days or None
+
+
+# Returns the DigestPolicy deciding how often each recipient is emailed. digest_settings holds the defaults, which a
+# recipient listed under digest_recipients and a search with its own digest_interval_minutes override. Raises an
+# exception if any setting is invalid
+def get_digest_policy(configuration):
+    default_interval_seconds = get_digest_setting(
+        "digest_settings.digest_interval_minutes",
+        configuration.get_config_value("digest_settings.digest_interval_minutes", fail_quietly=True) or 0, 60)
+    default_max_emails_per_hour = get_digest_setting(
+        "digest_settings.max_emails_per_hour",
+        configuration.get_config_value("digest_settings.max_emails_per_hour", fail_quietly=True) or 0)
+
+    recipient_dict = {}
+    for recipient_params in configuration.get_config_value("digest_recipients", simplify_singleton=False,
+                                                           fail_quietly=True) or []:
+        if not isinstance(recipient_params, dict) or not recipient_params.get("email_recipient"):
+            raise ValueError("Digest recipient [{}] is missing a value for [email_recipient]".format(recipient_params))
+        recipient_policy = {}
+        if "digest_interval_minutes" in recipient_params:
+            recipient_policy["interval_seconds"] = get_digest_setting(
+                "digest_interval_minutes", recipient_params["digest_interval_minutes"], 60)
+        if "max_emails_per_hour" in recipient_params:
+            recipient_policy["max_emails_per_hour"] = get_digest_setting(
+                "max_emails_per_hour", recipient_params["max_emails_per_hour"])
+        recipient_dict[recipient_params["email_recipient"]] = recipient_policy
+
+    search_interval_dict = {}
+    for search_params in configuration.get_config_value("searches", simplify_singleton=False):
+        if "digest_interval_minutes" in search_params:
+            interval_seconds = get_digest_setting("digest_interval_minutes", search_params["digest_interval_minutes"],
+                                                  60)
+            # Searches sharing a name share a digest interval, using the shortest of theirs
+            search_interval_dict[search_params.get("search_name")] = min(
+                interval_seconds, search_interval_dict.get(search_params.get("search_name"), interval_seconds))
+    return DigestPolicy(default_interval_seconds, default_max_emails_per_hour, recipient_dict, search_interval_dict)
+
+
+# Parse a --shard value of the form "i/N", for the i-th of N shards counting from 1, into a 0-based (shard_index,
+# shard_count) tuple
+def parse_shard(shard_text):
+    try:
+        shard_number, shard_count = [int(part) for part in shard_text.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("[{}] is not of the form i/N, like 1/3".format(shard_text))
+    if shard_count < 1 or not 1 <= shard_number <= shard_count:
+        raise argparse.ArgumentTypeError("[{}] is not one of shards 1 to N of N".format(shard_text))
+    return shard_number - 1, shard_count
+
+
+# Returns the email settings that EmailTools is created with, to compare across config reloads
+def get_email_settings_snapshot(configuration):
+    return [configuration.get_config_value("email_settings." + setting_name, fail_quietly=True) for setting_name in
+            ["email_sender", "google_api_client_id", "google_api_client_secret", "google_refresh_token", "smtp_host",
+             "smtp_port", "smtp_security", "max_smtp_connections"]]
 
 
 # Class with internal fields for storing Email and Reddit instances along with all the necessary logging information
 class SearchAndEmailExecutor:
 
-    # Method to populate a list with MIME object emails and then use the instantiated Gmail class to send them
+    # Method to populate a list with MIME object emails and then use the instantiated Gmail class to send them. With the
+    # email spool, the emails were already spooled along with the dedupe commit, so the senders are just woken up
     def generate_and_send_emails(self):
+        if self._email_spool_worker is not None:
+            self._email_spool_worker.wake()
+            return
+
+        # Send the MIME mail using the email_tools configuration, having already been authenticated
+        self.__get_email_tools().send_mail(self.__render_emails())
+
+    # Returns the EmailTools, creating them on first use
+    def __get_email_tools(self):
+        with self._email_tools_lock:
+            if self._email_tools is None:
+                self.initialize_email()
+            return self._email_tools
+
+    # Returns a list of MIME emails, one for each recipient of the current search results, or of the given results
+    # grouped like SearchResultIndex.get_results_by_recipient
+    def __render_emails(self, results_by_recipient=None):
+        # The email modules are only loaded once there's something to send, keeping runs without results light
+        from util.email_tools import create_mime_email
+
         mime_email_list = []
+        # Each search's results are rendered once and shared by every recipient of that search. The HTML is rendered
+        # from Markdown unless configured to be emitted directly
+        email_renderer = EmailRenderer(self._configuration.get_config_value("email_settings.email_format",
+                                                                            fail_quietly=True) != "html")
+        # TODO change the subject to be more useful?
+        email_subject_text = self._configuration.get_config_value("email_settings.email_subject_text")
         # Iterate through the search results, which at the top level are partitioned by email address recipient
-        for email_tuple in self._search_result_dict.items():
-            self._logger_instance.debug("Creating email Markdown and HTML for recipient: %s", email_tuple[0])
-            email_body_markdown = construct_email_markdown(email_tuple[1])
-            email_body_html = markdown.markdown(email_body_markdown)
-            mime_email_list.append(create_mime_email(email_body_markdown, email_body_html,
-                                                     # TODO change the subject to be more useful?
-                                                     email_subject_text=self._configuration.get_config_value(
-                                                         "email_settings.email_subject_text"),
-                                                     email_sender=self._email_sender,
-                                                     email_recipient=email_tuple[0]))
+        with metrics.EMAIL_RENDER_DURATION_SECONDS.time():
+            if results_by_recipient is None:
+                results_by_recipient = self._search_result_index.get_results_by_recipient()
+            for email_tuple in results_by_recipient.items():
+                self._logger_instance.debug("Creating email Markdown and HTML for recipient: %s", email_tuple[0])
+                email_body_markdown, email_body_html = email_renderer.render_email(email_tuple[1])
+                mime_email_list.append(create_mime_email(email_body_markdown, email_body_html,
+                                                         email_subject_text=email_subject_text,
+                                                         email_sender=self._email_sender,
+                                                         email_recipient=email_tuple[0]))
 
-        # Send the MIME mail using the email_tools configuration, having already been authenticated
-        self._email_tools.send_mail(mime_email_list)
-
-    # Given a file path to a list of old submission IDs, remove any repeats from the search dict and add new submissions
-    # to the CSV file. Then clean up the dict by removing empty dicts
-    def __dedupe_and_write_search_results(self, path_to_old_results):
-        # A HashSet to store all the values in the CSV file
-        old_results_set = set()
-
-        # Only run if the CSV file exists
-        if (path.exists(path_to_old_results) or path.isfile(path_to_old_results)):
-
-            # Open old results file and store its contents in a searchable Set
-            with open(path_to_old_results, 'r') as opened_file:
-                for string in opened_file:
-                    # Use rstrip() to get rid of the trailing whitespace and newline. Then add to the Set
-                    old_results_set.add(string.rstrip())
-                self._logger_instance.info("Existing results file found at %s, %d unique values found",
-                                           path_to_old_results, len(old_results_set))
-
-        num_items_removed = 0
-        new_results_to_write = set()
-
-        # https://docs.python.org/3/library/stdtypes.html#dictionary-view-objects
-        # Check each email address tuple in the search dict for individual searches going to that email
-        for email_dict_tuple in list(self._search_result_dict.items()):
-            for search_name_tuple in list(email_dict_tuple[1].items()):
-                # Check each submission under each search name
-                for submission_id in list(search_name_tuple[1].keys()):
-                    log_message = "SubmissionID {} is ".format(submission_id)
-
-                    if submission_id in old_results_set:
-                        log_message += "already in the CSV file. Removing from result dictionary"
-                        # If the submission was previously sent, remove it from the dict.
-                        search_name_tuple[1].pop(submission_id)
-                        # Increment the counter tracking the number of items removed
-                        num_items_removed += 1
-                    else:
-                        log_message += "a not-seen before NEW result! Adding to the CSV file"
-                        # Otherwise leave the dict untouched AND add it to the list of items to write
-                        new_results_to_write.add(submission_id + '\n')
-                    self._logger_instance.debug(log_message)
-
-                # Remove the parent search dict from the search results if it's now empty after dedupe
-                if len(search_name_tuple[1]) == 0:
-                    email_dict_tuple[1].pop(search_name_tuple[0])
-
-            # Remove the parent email dict from the search results if it's now empty after dedupe
-            if len(email_dict_tuple[1]) == 0:
-                self._search_result_dict.pop(email_dict_tuple[0])
+        self._logger_instance.debug("Rendered %d search fragments for %d emails", email_renderer.get_fragment_count(),
+                                    len(mime_email_list))
+        return mime_email_list
+
+    # Send a single email taken from the spool
+    def __send_spooled_email(self, mime_message):
+        self.__get_email_tools().send_mail([mime_message])
+
+    # Send every spooled email that's due before returning, on as many threads as the background senders would use
+    def flush_email_spool(self):
+        if self._email_spool_worker is not None:
+            sent_count = self._email_spool_worker.flush(self._email_spool_threads)
+            self._logger_instance.info("Sent %d spooled emails, %d still waiting to be sent", sent_count,
+                                       self._email_spool.get_pending_count())
+
+    # Spool one email for each recipient whose digest is due, made from every result buffered for them, in the same
+    # transaction that takes the results out of the buffer. Returns the number of emails spooled
+    def flush_digests(self):
+        if self._digest_buffer is None:
+            return 0
+        mime_email_list = []
+        with self._digest_buffer.take_due(get_digest_policy(self._configuration)) as (results_by_recipient,
+                                                                                      connection):
+            if len(results_by_recipient) > 0:
+                mime_email_list = self.__render_emails(results_by_recipient)
+                self._email_spool.enqueue(mime_email_list, connection)
+        metrics.DIGEST_BUFFER_PENDING.set(len(self._digest_buffer))
+        if len(mime_email_list) > 0:
+            metrics.EMAIL_SPOOL_PENDING.set(self._email_spool.get_pending_count())
+            self._logger_instance.info("Spooled %d digest emails, %d results still buffered", len(mime_email_list),
+                                       len(self._digest_buffer))
+            self._email_spool_worker.wake()
+        return len(mime_email_list)
+
+    # Start the background threads sending spooled emails
+    def start_email_spool(self):
+        if self._email_spool_worker is not None:
+            self._email_spool_worker.start(self._email_spool_threads)
+
+    # Remove any previously seen submissions from the search results and record the new submissions in the dedupe store
+    def __dedupe_and_write_search_results(self):
+        # Check every submission ID in the results against the store in one batch
+        all_submission_ids = self._search_result_index.get_submission_ids()
+        new_submission_ids = self._dedupe_store.filter_new(all_submission_ids)
+        old_submission_ids = all_submission_ids - new_submission_ids
+
+        # If the submission was previously sent, remove it from the results
+        self._search_result_index.remove(old_submission_ids)
+        if self._logger_instance.isEnabledFor(logging.DEBUG):
+            for submission_id in old_submission_ids:
+                self._logger_instance.debug("SubmissionID %s is already in the dedupe store. Removing from results",
+                                            submission_id)
+            for submission_id in new_submission_ids:
+                self._logger_instance.debug("SubmissionID %s is a not-seen before NEW result! Adding to the dedupe "
+                                            "store", submission_id)
 
         self._logger_instance.info("After dedupe there were %d submissions removed with %d NEW submissions",
-                                       num_items_removed, len(new_results_to_write))
+                                       len(old_submission_ids), len(new_submission_ids))
+        metrics.DEDUPE_SUBMISSIONS_TOTAL.inc(len(old_submission_ids), result="hit")
+        metrics.DEDUPE_SUBMISSIONS_TOTAL.inc(len(new_submission_ids), result="miss")
 
-        # Open the CSV file (1 column schema [submission_id] no header) in append mode (creating if it didn't exist)
-        with open(path_to_old_results, 'a+') as opened_file:
-            opened_file.writelines(list(new_results_to_write))
+        # Record the new submissions in a single batch, then drop IDs too old to show up in search results again
+        if len(new_submission_ids) > 0:
+            self._dedupe_store.claim(new_submission_ids, self.__write_new_results)
+            if self._email_spool is not None:
+                metrics.EMAIL_SPOOL_PENDING.set(self._email_spool.get_pending_count())
+        self._dedupe_store.evict_expired()
 
-    # Run a single PRAW search and put the results into the class search_result_dict
-    def __run_search(self, email_recipient, search_name, subreddits, search_string):
-        self._logger_instance.info("Running search: %s",search_name)
-        # Define a temporary multireddit and perform a search as documented on https://praw.readthedocs.io/en/latest/code_overview/reddit/subreddits.html
-        searchListingGenerator = self._reddit.subreddit(subreddits).search(search_string, sort='new', time_filter='week')
+    # Called with the new submission IDs once they're claimed in the dedupe store, along with the store's connection
+    # when the spool and the digest buffer can write in the same transaction. With the email spool, the emails are
+    # rendered now and spooled along with the claim, so a crash or a failed send can't leave submissions marked as seen
+    # that were never emailed. With digests, the results are buffered instead and only rendered once due
+    def __write_new_results(self, claimed_submission_ids, connection):
+        # Another shard sharing the dedupe store may have claimed some of the submissions since they were checked, in
+        # which case they're its to send
+        lost_submission_ids = self._search_result_index.get_submission_ids() - claimed_submission_ids
+        if len(lost_submission_ids) > 0:
+            self._search_result_index.remove(lost_submission_ids)
+            self._logger_instance.info("%d NEW submissions were claimed by another worker first. Removing from results",
+                                       len(lost_submission_ids))
+        if self._email_spool is None or len(claimed_submission_ids) == 0:
+            return
 
-        # https://www.w3schools.com/python/python_dictionaries.asp
-        # Add all returned search result submissions to the search_result_dict
-        for submission in searchListingGenerator:
-            # Make the search dict under the email if it didn't already exist
-            if not (email_recipient in self._search_result_dict):
-                self._search_result_dict[email_recipient] = {}
+        if get_digest_policy(self._configuration).is_enabled():
+            self._digest_buffer.add(self._search_result_index.get_results_by_recipient(), connection)
+            self._logger_instance.info("Buffered %d results for digests", len(claimed_submission_ids))
+        else:
+            mime_email_list = self.__render_emails()
+            self._email_spool.enqueue(mime_email_list, connection)
+            self._logger_instance.info("Spooled %d emails", len(mime_email_list))
+
+    # Remove previously seen submissions from the search results without recording the new ones, and render the emails
+    # the rest would be sent in without sending them, adding what was found and how long it took to the dry run report
+    def __preview_search_results(self):
+        fetched_ids_by_search = self._search_result_index.get_submission_ids_by_search()
+        dedupe_start_time = time.perf_counter()
+        if not self._cli_args.skipdedupe:
+            all_submission_ids = self._search_result_index.get_submission_ids()
+            self._search_result_index.remove(all_submission_ids - self._dedupe_store.filter_new(all_submission_ids))
+        self._dry_run_report.record_stage("dedupe", time.perf_counter() - dedupe_start_time)
+        self._dry_run_report.record_results(fetched_ids_by_search,
+                                            self._search_result_index.get_submission_ids_by_search())
+
+        render_start_time = time.perf_counter()
+        mime_email_list = []
+        if len(self._search_result_index) > 0:
+            mime_email_list = self.__render_emails()
+        self._dry_run_report.record_stage("render", time.perf_counter() - render_start_time)
+        # Digests only apply to spooled emails
+        digest_policy = None
+        if not self._cli_args.skipdedupe and self._configuration.get_config_value("email_spool_settings.mode",
+                                                                                  fail_quietly=True) == "spool":
+            digest_policy = get_digest_policy(self._configuration)
+        self._dry_run_report.record_emails(mime_email_list, digest_policy)
 
-            # make sure a nested submission dict exists in the value of the search dict
-            # https://www.programiz.com/python-programming/nested-dictionary
-            if not (search_name in self._search_result_dict[email_recipient]):
-                self._search_result_dict[email_recipient][search_name] = {}
+    # Returns the dry run's cost report as text
+    def get_dry_run_report(self):
+        return self._dry_run_report.format_report()
 
-            # Add the submission to the dict under the proper email and search name and submission ID
-            self._search_result_dict[email_recipient][search_name][submission.id] = submission
+    # Record how many new results each of the searches that ran without failing found, so adaptive polling intervals
+    # can follow how often each search finds something
+    def __record_search_rates(self, search_names, run_started_utc):
+        half_life_seconds = get_adaptive_interval_settings(self._configuration)[3]
+        submission_ids_by_search = self._search_result_index.get_submission_ids_by_search()
+        recorded_search_names = sorted(search_name for search_name in search_names
+                                       if search_name not in self._failed_searches)
+        for search_name in recorded_search_names:
+            self._search_rates.record_run(search_name, len(submission_ids_by_search.get(search_name, ())),
+                                          run_started_utc, half_life_seconds)
+
+        search_interval_dict = self.get_polling_intervals()
+        for search_name in recorded_search_names:
+            daily_rate = self._search_rates.get_daily_rate(search_name)
+            self._logger_instance.info("Search [%s] found %d new results, averaging %s a day, polling every %.1f "
+                                       "minutes", search_name, len(submission_ids_by_search.get(search_name, ())),
+                                       "unknown" if daily_rate is None else "{:.2f}".format(daily_rate),
+                                       search_interval_dict[search_name] / 60)
+        self._search_rates.remove_other_searches(search_interval_dict.keys())
+        self._search_rates.save()
+
+    # Returns a dict of each search name to the interval in seconds it should be polled at
+    def get_polling_intervals(self):
+        return get_search_intervals(self._configuration, self._search_rates)
+
+    # Like get_polling_intervals, but only for the searches with a query run by this shard. Without --shard, that's
+    # every search
+    def get_scheduled_intervals(self):
+        search_interval_dict = self.get_polling_intervals()
+        if self._shard is None:
+            return search_interval_dict
+        shard_search_names = set(search_name for search_targets in self.__plan_searches().values()
+                                 for email_recipient, search_name in search_targets)
+        return {search_name: interval_seconds for search_name, interval_seconds in search_interval_dict.items()
+                if search_name in shard_search_names}
+
+    # Returns the configured searches grouped by the Reddit query they make, as from plan_searches, leaving out the
+    # queries other shards run when --shard was passed
+    def __plan_searches(self):
+        query_dict = plan_searches(self._configuration.get_config_value("searches", simplify_singleton=False),
+                                   self._configuration.get_config_value("email_settings.default_email_recipient"))
+        if self._shard is not None:
+            query_dict = get_shard_queries(query_dict, *self._shard)
+        return query_dict
+
+    # Returns the planned queries as batches that are each one Reddit query, as from get_unbatched_queries. Optionally
+    # queries on the same subreddits are combined with OR, matching results back to searches locally
+    def __get_batches(self, query_dict):
+        if self._configuration.get_config_value("search_batching", fail_quietly=True) == "or":
+            return get_batched_queries(query_dict)
+        return get_unbatched_queries(query_dict)
+
+    # Returns the searches this process runs that have to run together, as they share a Reddit query or a batch, as
+    # from get_search_groups
+    def get_search_groups(self):
+        return get_search_groups(self.__get_batches(self.__plan_searches()))
+
+    # Returns the search state keys of every Reddit query the configured searches make. With --shard, that's the
+    # queries of every shard, as they share the state file and each shard batches its own queries
+    def __get_planned_state_keys(self):
+        query_dict = plan_searches(self._configuration.get_config_value("searches", simplify_singleton=False),
+                                   self._configuration.get_config_value("email_settings.default_email_recipient"))
+        shard_query_dict_list = [query_dict]
+        if self._shard is not None:
+            shard_query_dict_list = [get_shard_queries(query_dict, shard_index, self._shard[1])
+                                     for shard_index in range(self._shard[1])]
+        return set(get_search_state_key(subreddits, search_string) for shard_query_dict in shard_query_dict_list
+                   for subreddits, search_string, search_members in self.__get_batches(shard_query_dict))
+
+    # Add a dict of submission IDs to submissions to the search results under every (email_recipient, search_name)
+    def __add_search_results(self, search_targets, search_results):
+        # Keep only the fields needed later, rather than the full PRAW objects
+        submission_records = [create_submission_record(submission) for submission in search_results.values()]
+        with self._search_result_lock:
+            for submission_record in submission_records:
+                self._search_result_index.add(search_targets, submission_record)
+
+    # Page through a PRAW search with the given Reddit instance, returning a dict of submission IDs to the submissions
+    # posted since the previous run along with the newest of them (or None if there were none)
+    def __fetch_search_results(self, reddit, subreddits, search_string, state_key, time_filter, search_name):
+        # Define a temporary multireddit and perform a search as documented on https://praw.readthedocs.io/en/latest/code_overview/reddit/subreddits.html
+        searchListingGenerator = reddit.subreddit(subreddits).search(search_string, sort='new',
+                                                                     time_filter=time_filter)
+
+        # Collect the results locally first, so the shared dict is only locked once per search
+        search_results = {}
+        newest_submission = None
+        for submission in searchListingGenerator:
+            # Results are sorted newest first, so stop paging as soon as the previous run's high-water mark is reached
+            if self._search_state is not None and self._search_state.is_already_seen(state_key,
+                                                                                     submission.created_utc):
+                self._logger_instance.debug("Reached previously seen SubmissionID %s, stopping search [%s]",
+                                            submission.id, search_name)
+                break
+            search_results[submission.id] = submission
+            if newest_submission is None or submission.created_utc > newest_submission.created_utc:
+                newest_submission = submission
             self._logger_instance.debug('https://reddit.com%s', submission.permalink)
             # useful submission fields: title, created_utc, permalink, url (linked url or permalink) found on
             # https://praw.readthedocs.io/en/latest/code_overview/models/submission.html
+        return search_results, newest_submission
+
+    # Run a single PRAW search and put the results into the class search_result_index under every (email_recipient,
+    # search_name) tuple in the search targets of each member, as searches with identical queries are run once and
+    # share results. If a member has a query node, only the results matching it locally are added for its targets
+    def __run_search(self, subreddits, search_string, search_members):
+        search_name_list = sorted(set(search_target[1] for query_node, search_targets in search_members
+                                      for search_target in search_targets))
+        search_name = ", ".join(search_name_list)
+        self._logger_instance.info("Running search: %s",search_name)
 
-        self._logger_instance.info('Result count is %d in subreddit [%s] using search [%s]',
-                                   len(self._search_result_dict[email_recipient][search_name])
-                                   if email_recipient in self._search_result_dict and
-                                      search_name in self._search_result_dict[email_recipient] else 0,
-                                   subreddits, search_string)
-
-    # Run and dedupe the searches according to the CLI arguments and configuration
-    def execute_searches(self):
-        # Define the results dictionary, resetting every time this runs
-        self._search_result_dict = {}  # could also say = dict()
-
-        # Get all the configured searches from the configuration and run them, adding results to the dict
-        # Searches are partitioned first by recipient email, then by search title, then by submission ID
-        for search_params in self._configuration.get_config_value("searches"):
-            # Use optional configuration for email recipient alongside each search, otherwise default to the fallback
-            if "email_recipient" in search_params:
-                email_recipient = search_params.get("email_recipient")
+        # Only look back as far as the last successful run, unless every result is wanted because dedupe is skipped
+        state_key = get_search_state_key(subreddits, search_string)
+        run_started_utc = time.time()
+        time_filter = 'week'
+        if self._search_state is not None:
+            time_filter = self._search_state.get_time_filter(state_key, run_started_utc)
+
+        # Run the search with the least loaded Reddit credential, failing over to the next one if it's throttled or
+        # rejected. Each credential is tried at most once
+        attempt_count = max(1, self._reddit_clients.get_usable_count())
+        search_start_time = time.perf_counter()
+        if self._request_counter is not None:
+            request_counts_before = self._request_counter.get_thread_counts()
+        for attempt_number in range(1, attempt_count + 1):
+            slot_index = self._reddit_clients.acquire()
+            try:
+                search_results, newest_submission = self.__fetch_search_results(
+                    self._reddit_clients.get_reddit(slot_index), subreddits, search_string, state_key, time_filter,
+                    search_name)
+            except Exception as exception:
+                self._reddit_clients.release(slot_index, exception)
+                if attempt_number == attempt_count or not self._reddit_clients.should_fail_over(exception):
+                    for member_search_name in search_name_list:
+                        metrics.SEARCH_FAILURES_TOTAL.inc(search=member_search_name)
+                    raise
+                self._logger_instance.warning("Search [%s] failed with one Reddit credential, retrying with another: "
+                                              "%r", search_name, exception)
+                continue
+            self._reddit_clients.release(slot_index)
+            break
+        # Metrics are labeled with each search's own name, so a search keeps one series however it's coalesced or
+        # batched with others
+        for member_search_name in search_name_list:
+            metrics.SEARCH_DURATION_SECONDS.observe(time.perf_counter() - search_start_time, search=member_search_name)
+        if self._dry_run_report is not None:
+            request_count, page_count = [count_after - count_before for count_after, count_before in
+                                         zip(self._request_counter.get_thread_counts(), request_counts_before)]
+            self._dry_run_report.record_query(subreddits, search_string, search_name_list, time_filter,
+                                              request_count, page_count, len(search_results),
+                                              time.perf_counter() - search_start_time)
+
+        if self._search_state is not None:
+            if newest_submission is None:
+                self._search_state.record_success(state_key, run_started_utc)
             else:
-                email_recipient = self._configuration.get_config_value("email_settings.default_email_recipient")
+                self._search_state.record_success(state_key, run_started_utc, newest_submission.id,
+                                                  newest_submission.created_utc)
+
+        # Add all returned search result submissions to the search_result_index
+        result_ids_by_search_name = {member_search_name: set() for member_search_name in search_name_list}
+        for query_node, search_targets in search_members:
+            member_results = search_results
+            if query_node is not None:
+                # Attribute the results of a combined query back to the searches it was combined from
+                member_results = {submission_id: submission for submission_id, submission in search_results.items()
+                                  if match_search_query(query_node, normalize_text(submission.title),
+                                                        normalize_text(submission.selftext))}
+            if len(member_results) > 0:
+                self.__add_search_results(search_targets, member_results)
+            for email_recipient, member_search_name in search_targets:
+                result_ids_by_search_name[member_search_name].update(member_results.keys())
+        for member_search_name, result_id_set in result_ids_by_search_name.items():
+            metrics.SEARCH_RESULTS_TOTAL.inc(len(result_id_set), search=member_search_name)
+
+        self._logger_instance.info('Result count is %d in subreddit [%s] using search [%s] over the last %s',
+                                   len(search_results), subreddits, search_string, time_filter)
+
+    # Run and dedupe the searches according to the CLI arguments and configuration. If a collection of search names is
+    # passed in, only the queries of those searches are run
+    def execute_searches(self, search_names=None):
+        # Define the results index, resetting every time this runs
+        self._search_result_index = SearchResultIndex()
+        self._failed_searches = {}
+        run_started_utc = time.time()
+
+        # Get all the configured searches from the configuration and run them, adding results to the index
+        # Each submission ID is indexed with the set of recipient emails and search titles it was found for
+        # Searches making the same Reddit query are coalesced, so each unique query is only run once per cycle
+        search_list = self._configuration.get_config_value("searches", simplify_singleton=False)
+        query_dict = self.__plan_searches()
+        # Batches are made from every planned query before picking the due ones, so a query is always batched the same
+        # way and keeps its search state
+        batch_list = self.__get_batches(query_dict)
+        if search_names is not None:
+            # Keep every target of a due batch, as a query shared with a search that isn't due yet still moves the
+            # query's high-water mark forward and those results would otherwise never reach the other search. The
+            # scheduler runs the searches sharing a batch together, so this is rarely more than was due
+            batch_list = [batch for batch in batch_list
+                          if any(search_name in search_names for query_node, search_targets in batch[2]
+                                 for email_recipient, search_name in search_targets)]
+        ran_search_names = set(search_name for subreddits, search_string, search_members in batch_list
+                               for query_node, search_targets in search_members
+                               for email_recipient, search_name in search_targets)
+        self._logger_instance.info("Planned %d Reddit queries for %d configured searches", len(batch_list),
+                                   len(search_list))
+        if self._dry_run_report is not None:
+            self._dry_run_report.set_plan(query_dict, batch_list, self.get_polling_intervals())
+
+        # Each query runs on a bounded pool of worker threads so a cycle isn't the sum of every query's round trips
+        future_to_search_targets = {}
+        searches_start_time = time.perf_counter()
+        search_function = self.__run_search
+        if self._cycle_profiler is not None:
+            search_function = self._cycle_profiler.wrap_worker(search_function)
+        for subreddits, search_string, search_members in batch_list:
+            future = self._search_pool.submit(search_function, subreddits, search_string, search_members)
+            future_to_search_targets[future] = [search_target for query_node, search_targets in search_members
+                                                for search_target in search_targets]
 
-            self.__run_search(email_recipient, search_params.get("search_name"),search_params.get("subreddits"),
-                              search_params.get("search_params"))
+        # A failing search is reported but doesn't abort the rest of the cycle
+        for future in as_completed(future_to_search_targets):
+            try:
+                future.result()
+            except Exception as exception:
+                for email_recipient, search_name in future_to_search_targets[future]:
+                    self._failed_searches[search_name] = exception
+                    self._logger_instance.error("Search [%s] failed: %r", search_name, exception)
+                    if self._dry_run_report is not None:
+                        self._dry_run_report.record_failure(search_name, exception)
 
+        if len(self._failed_searches) > 0:
+            self._logger_instance.warning("%d of %d searches failed this cycle: %s", len(self._failed_searches),
+                                          len(search_list), ", ".join(self._failed_searches.keys()))
+
+        # A dry run only previews the dedupe and the emails, leaving the stores as they were
+        if self._dry_run_report is not None:
+            self._dry_run_report.record_stage("search", time.perf_counter() - searches_start_time)
+            self.__preview_search_results()
         # Dedupe the search results with the stored previous results if the skip argument is false (not passed in)
-        if not self._cli_args.skipdedupe:
-            old_results_path = os.path.abspath(os.path.dirname(sys.argv[0])) + "/old_results.csv"
-            self.__dedupe_and_write_search_results(old_results_path)
+        elif not self._cli_args.skipdedupe:
+            with metrics.DEDUPE_DURATION_SECONDS.time():
+                self.__dedupe_and_write_search_results()
+            self.__record_search_rates(ran_search_names, run_started_utc)
+            # Only move the high-water marks forward once the results they cover have been recorded as seen
+            self._search_state.remove_other_keys(self.__get_planned_state_keys())
+            self._search_state.save()
+            # Results buffered by earlier cycles may be due now even if this one found nothing new
+            self.flush_digests()
+
+        # Return the number of recipients with results. If 0 are returned there are no results (after dedupe)
+        return len(self._search_result_index.get_email_recipients())
+
+    # Consume new submissions from every configured subreddit as they're posted, matching them against the searches
+    # locally. Every flush interval, the matches are deduped and the number of recipients with results is yielded
+    # so the caller can send emails before streaming continues
+    def stream_searches(self, flush_interval_seconds):
+        matcher = SearchMatcher(self.__plan_searches())
+        for (subreddits, search_string), exception in matcher.get_skipped_queries().items():
+            self._logger_instance.warning("Search [%s] in [%s] can't be matched locally and won't be streamed: %s",
+                                          search_string, subreddits, exception)
+        subreddits = matcher.get_subreddits()
+        self._logger_instance.info("Streaming new submissions from [%s]", subreddits)
 
-        # Return the number of populated top level dicts. If 0 are returned there are no results (after dedupe)
-        return len(self._search_result_dict)
+        self._search_result_index = SearchResultIndex()
+        last_flush_time = time.time()
+        while True:
+            # The stream holds on to the least loaded credential, moving to another one when it reconnects. The clients
+            # are recreated when a config reload changes them, so the credential is released to the clients it came from
+            reddit_clients = self._reddit_clients
+            try:
+                slot_index = reddit_clients.acquire()
+            except NoRedditCredentialsError as exception:
+                self._logger_instance.error("No Reddit credential can stream, retrying in %d seconds: %r",
+                                            STREAM_RECONNECT_SECONDS, exception)
+                time.sleep(STREAM_RECONNECT_SECONDS)
+                # Keep flushing on schedule, which also lets the caller reload a config with working credentials
+                if time.time() - last_flush_time >= flush_interval_seconds:
+                    last_flush_time = time.time()
+                    yield self.__flush_stream_results()
+                    self._search_result_index = SearchResultIndex()
+                continue
+            try:
+                # pause_after=0 yields None whenever a poll finds nothing new, so flushes happen on quiet subreddits.
+                # Existing submissions are only skipped without dedupe, otherwise a reconnect can't miss any
+                # https://praw.readthedocs.io/en/latest/code_overview/other/subredditstream.html
+                submission_stream = reddit_clients.get_reddit(slot_index).subreddit(
+                    subreddits).stream.submissions(pause_after=0, skip_existing=self._cli_args.skipdedupe)
+                for submission in submission_stream:
+                    if submission is not None:
+                        search_targets = matcher.match(submission.subreddit.display_name, submission.title,
+                                                       submission.selftext)
+                        if len(search_targets) > 0:
+                            self._logger_instance.debug('Streamed match https://reddit.com%s', submission.permalink)
+                            self.__add_search_results(search_targets, {submission.id: submission})
+
+                    if time.time() - last_flush_time >= flush_interval_seconds:
+                        last_flush_time = time.time()
+                        yield self.__flush_stream_results()
+                        self._search_result_index = SearchResultIndex()
+            except prawcore.exceptions.PrawcoreException as exception:
+                reddit_clients.release(slot_index, exception)
+                slot_index = None
+                self._logger_instance.error("Submission stream failed, reconnecting in %d seconds: %r",
+                                            STREAM_RECONNECT_SECONDS, exception)
+                time.sleep(STREAM_RECONNECT_SECONDS)
+            finally:
+                if slot_index is not None:
+                    reddit_clients.release(slot_index)
+
+    # Dedupe the streamed matches collected since the last flush, returning the number of recipients with results
+    def __flush_stream_results(self):
+        if not self._cli_args.skipdedupe:
+            self.__dedupe_and_write_search_results()
+            self.flush_digests()
+        return len(self._search_result_index.get_email_recipients())
 
     # Initialize the Gmail Oauth2 EmailTools class, which may prompt for user input if a refresh token isn't defined
     def initialize_email(self):
+        from util.email_tools import EmailTools
+        # The SMTP server settings are optional, defaulting to Gmail
+        smtp_settings = {}
+        for setting_name in ["smtp_host", "smtp_port", "max_smtp_connections"]:
+            setting_value = self._configuration.get_config_value("email_settings." + setting_name, fail_quietly=True)
+            if setting_value is not None:
+                smtp_settings[setting_name] = setting_value
+        # A string rather than a boolean, as the config parser treats false values as unset
+        smtp_security = self._configuration.get_config_value("email_settings.smtp_security", fail_quietly=True)
+        if smtp_security is not None:
+            smtp_settings["smtp_use_tls"] = smtp_security != "none"
+
+        # Remember the settings used so a config reload can tell whether the EmailTools need to be recreated
+        self._email_settings_snapshot = get_email_settings_snapshot(self._configuration)
+        self._email_sender = self._configuration.get_config_value("email_settings.email_sender")
         self._email_tools = EmailTools(self._email_sender,self._configuration.get_config_value(
             "email_settings.google_api_client_id"), self._configuration.get_config_value(
             "email_settings.google_api_client_secret"), self._configuration.get_config_value(
             "email_settings.google_refresh_token"), self._console_log_level, self._file_log_filepath,
-                                       self._file_log_level)
+                                       self._file_log_level, **smtp_settings)
 
     def initialize_praw(self):
         # https://github.com/praw-dev/praw
+        # Several credential sets can be listed under praw_credentials to spread searches over their rate limits,
+        # otherwise the single praw_client_id and praw_client_secret pair is used
+        credential_list = [(credential.get("client_id", ""), credential.get("client_secret", "")) for credential in
+                           self._configuration.get_config_value("praw_credentials", simplify_singleton=False,
+                                                                fail_quietly=True) or []]
+        if len(credential_list) == 0:
+            credential_list = [(self._configuration.get_config_value("praw_client_id"),
+                                self._configuration.get_config_value("praw_client_secret"))]
+
         # Do prechecks to confirm the PRAW auth info isn't default
-        praw_client_id = self._configuration.get_config_value("praw_client_id")
-        praw_client_secret = self._configuration.get_config_value("praw_client_secret")
-        if (praw_client_id == "" or praw_client_secret == ""):
+        if any(client_id == "" or client_secret == "" for client_id, client_secret in credential_list):
             self._logger_instance.error("Reddit PRAW client ID and/or secret have not been set in the config!")
             self._logger_instance.error("Go to https://www.reddit.com/prefs/apps/ while logged in to generate auth info")
 
+        # Optionally put an on-disk HTTP cache under PRAW, which can also record responses and replay them offline
+        requestor_class = None
+        requestor_kwargs = None
+        http_cache_mode = self._configuration.get_config_value("http_cache_settings.mode", fail_quietly=True) or "off"
+        if http_cache_mode != "off":
+            # The cache is only loaded when it's turned on, as most runs go straight to Reddit
+            from util.http_cache import CachingRequestor
+            cache_directory = self._configuration.get_config_value("http_cache_settings.directory",
+                                                                   fail_quietly=True) or "http_cache"
+            requestor_class = CachingRequestor
+            requestor_kwargs = {"cache_directory": os.path.join(self._state_directory, cache_directory),
+                                "mode": http_cache_mode,
+                                "ttl_seconds": self._configuration.get_config_value("http_cache_settings.ttl_seconds",
+                                                                                    fail_quietly=True) or 0,
+                                # A dry run uses what's stored, but leaves the cache as it was
+                                "read_only": self._cli_args.dryrun}
+            self._logger_instance.info("Reddit HTTP cache is in %s mode, using %s", http_cache_mode,
+                                       requestor_kwargs["cache_directory"])
+
+        # A dry run counts the requests each search makes
+        if self._request_counter is not None:
+            requestor_class = self._request_counter.create_requestor_class(requestor_class)
+
         # Start up PRAW
         self._logger_instance.info('Initializing PRAW instance...')
-        self._reddit = praw.Reddit(client_id=praw_client_id,
-                                   client_secret=praw_client_secret,
-                                   user_agent='reddit-search-and-email')
+        # A new pool drops the per-thread instances so they're recreated with the current credentials
+        self._reddit_clients = RedditClientPool(credential_list, 'reddit-search-and-email', self._console_log_level,
+                                                self._file_log_filepath, self._file_log_level, requestor_class,
+                                                requestor_kwargs, self._configuration.get_config_value(
+                                                    "praw_settings", fail_quietly=True))
         self._logger_instance.info('PRAW Initialized')
 
-    def __init__(self, cli_args, configuration):
+    # Returns the executor's stats served by the control API: how long the last cycle took and when it ended, and how
+    # much the dedupe store, the email spool and the digest buffer hold
+    def get_stats(self):
+        return {"last_cycle_seconds": metrics.LAST_CYCLE_DURATION_SECONDS.get(),
+                "last_cycle_end_utc": metrics.LAST_CYCLE_END_TIMESTAMP.get(),
+                "dedupe_store_size": None if self._dedupe_store is None else len(self._dedupe_store),
+                "email_spool_pending": None if self._email_spool is None else self._email_spool.get_pending_count(),
+                "digest_buffer_pending": None if self._digest_buffer is None else len(self._digest_buffer)}
+
+    # Returns a context manager profiling the cycle run in its block if --profile was passed, and doing nothing otherwise
+    def profile_cycle(self):
+        if self._cycle_profiler is None:
+            return nullcontext()
+        return self._cycle_profiler.profile_cycle()
+
+    # Open the dedupe store for the configured backend, stored alongside this script
+    def __initialize_dedupe_store(self):
+        self._dedupe_store = create_dedupe_store(
+            self._configuration.get_config_value("dedupe_settings.backend", fail_quietly=True) or "sqlite",
+            self._state_directory, get_dedupe_max_age_days(self._configuration), self._console_log_level,
+            self._file_log_filepath, self._file_log_level, self._cli_args.dryrun)
+
+    # Check the config files for changes and apply them between runs. Searches are read from the config on every run,
+    # so only the clients and resources built from changed settings are recreated. Returns the set of changed keys
+    def reload_configuration(self):
+        old_search_names = set(search_params.get("search_name") for search_params in
+                               self._configuration.get_config_value("searches", simplify_singleton=False))
+        changed_key_set = self._configuration.reload_if_changed(validate_configuration)
+        if len(changed_key_set) == 0:
+            return changed_key_set
+
+        if "searches" in changed_key_set:
+            new_search_names = set(search_params.get("search_name") for search_params in
+                                   self._configuration.get_config_value("searches", simplify_singleton=False))
+            self._logger_instance.info("Searches added: [%s], removed: [%s]",
+                                       ", ".join(sorted(new_search_names - old_search_names)),
+                                       ", ".join(sorted(old_search_names - new_search_names)))
+
+        if len(changed_key_set & set(REDDIT_CLIENT_KEYS)) > 0:
+            self._logger_instance.info("Reddit credentials or HTTP cache settings changed, reinitializing PRAW")
+            self.initialize_praw()
+
+        # EmailTools that haven't been created yet will pick up the new settings when they are
+        if "email_settings" in changed_key_set and self._email_tools is not None and \
+                get_email_settings_snapshot(self._configuration) != self._email_settings_snapshot:
+            self._logger_instance.info("Email credentials or server changed, reinitializing EmailTools")
+            with self._email_tools_lock:
+                self._email_tools.close()
+                self.initialize_email()
+
+        if "search_concurrency" in changed_key_set:
+            self._search_concurrency = max(1, self._configuration.get_config_value("search_concurrency",
+                                                                                   fail_quietly=True) or 1)
+            self._search_pool.shutdown()
+            self._search_pool = ThreadPoolExecutor(max_workers=self._search_concurrency,
+                                                   thread_name_prefix="search")
+
+        if "dedupe_settings" in changed_key_set and self._dedupe_store is not None:
+            self._dedupe_store.close()
+            self.__initialize_dedupe_store()
+
+        restart_key_list = [key for key in RESTART_REQUIRED_KEYS if key in changed_key_set]
+        if len(restart_key_list) > 0:
+            self._logger_instance.warning("Changes to [%s] only take effect after a restart",
+                                          ", ".join(restart_key_list))
+        return changed_key_set
+
+    # Constructor to pass in the CLI arguments, the JSON configuration and optionally the directory to keep the dedupe
+    # store and search state in, which defaults to the directory of this script
+    def __init__(self, cli_args, configuration, state_directory=None):
         # Define and initialize class fields using the CLI arguments and JSON configuration
-        self._search_result_dict = {}
+        self._search_result_index = SearchResultIndex()
+        self._failed_searches = {}
         self._configuration = configuration
         self._cli_args = cli_args
+        # The 0-based (shard_index, shard_count) of the queries this process runs, or None to run all of them
+        self._shard = cli_args.shard
+        # With --dryrun, what a cycle costs is collected for a report, and nothing is written or sent
+        self._dry_run_report = None
+        self._request_counter = None
+        if cli_args.dryrun:
+            from util.dry_run_report import DryRunReport
+            from util.request_counter import RequestCounter
+            self._dry_run_report = DryRunReport()
+            self._request_counter = RequestCounter()
         self._email_sender = configuration.get_config_value("email_settings.email_sender")
         self._console_log_level = configuration.get_config_value("logging.console_log_level")
         self._file_log_filepath = configuration.get_config_value("logging.file_log_absolute_path")
         self._file_log_level = configuration.get_config_value("logging.file_log_level")
 
+        # Number of searches allowed to be in flight at once. Defaults to 4 in default_base_config.json, which a value
+        # of 0 also falls back to
+        self._search_concurrency = max(1, configuration.get_config_value("search_concurrency", fail_quietly=True) or 1)
+        # The pool's threads live as long as the executor, so their Reddit instances are reused between cycles
+        self._search_pool = ThreadPoolExecutor(max_workers=self._search_concurrency, thread_name_prefix="search")
+        self._search_result_lock = threading.Lock()
+        self._reddit_clients = None
+        # Created by initialize_email, or on the first send if it wasn't called
+        self._email_tools = None
+        self._email_tools_lock = threading.RLock()
+
         self._logger_instance = get_logger_with_name("Executor", self._console_log_level, self._file_log_filepath,
                                                      self._file_log_level)
+
+        # Previously seen results and per-search high-water marks are stored alongside this script by default
+        self._state_directory = os.path.abspath(state_directory or os.path.dirname(sys.argv[0]))
+        # Searches are incremental unless dedupe is skipped, in which case the full week of results is wanted.
+        # The dedupe store is opened once and stays resident between scheduled runs
+        self._search_state = None
+        self._search_rates = None
+        self._dedupe_store = None
+        if not cli_args.skipdedupe:
+            self.__initialize_dedupe_store()
+            self._search_state = SearchStateStore(self._state_directory + "/search_state.json",
+                                                  self._console_log_level, self._file_log_filepath,
+                                                  self._file_log_level)
+            # Each search's rate of new results only means something when they're deduped
+            self._search_rates = SearchRateStore(self._state_directory + "/search_rates.json",
+                                                 self._console_log_level, self._file_log_filepath,
+                                                 self._file_log_level)
+
+        # Rendered emails are spooled in the dedupe database and sent by separate threads, unless they're configured
+        # to be sent inline. The spool needs the dedupe commit, so emails are always sent inline with --skipdedupe
+        self._email_spool = None
+        self._email_spool_worker = None
+        self._digest_buffer = None
+        self._email_spool_threads = configuration.get_config_value("email_spool_settings.sender_threads",
+                                                                   fail_quietly=True) or 1
+        if not cli_args.skipdedupe and not cli_args.dryrun and \
+                configuration.get_config_value("email_spool_settings.mode", fail_quietly=True) == "spool":
+            self._email_spool = EmailSpool(self._state_directory + "/old_results.sqlite3", self._console_log_level,
+                                           self._file_log_filepath, self._file_log_level)
+            self._email_spool_worker = EmailSpoolWorker(
+                self._email_spool, self.__send_spooled_email,
+                configuration.get_config_value("email_spool_settings.retry_base_seconds", fail_quietly=True) or 60,
+                configuration.get_config_value("email_spool_settings.retry_max_seconds", fail_quietly=True) or 3600,
+                configuration.get_config_value("email_spool_settings.max_attempts", fail_quietly=True) or 10,
+                self._console_log_level, self._file_log_filepath, self._file_log_level)
+            # Digests are built on the spool. The buffer is kept whenever the spool is, so digests can be turned on
+            # and off by reloading the config, and results buffered before they were turned off still get sent
+            self._digest_buffer = DigestBuffer(self._state_directory + "/old_results.sqlite3", self._console_log_level,
+                                               self._file_log_filepath, self._file_log_level)
+
+        # With --profile, each cycle's profile is written to a profiles folder next to the log file
+        self._cycle_profiler = None
+        if cli_args.profile is not None:
+            from util.cycle_profiler import CycleProfiler
+            self._cycle_profiler = CycleProfiler(
+                path.join(path.dirname(path.abspath(self._file_log_filepath or "./")), "profiles"),
+                cli_args.profile == "memory",
+                configuration.get_config_value("profile_settings.keep_cycles", fail_quietly=True) or 10,
+                configuration.get_config_value("profile_settings.top_count", fail_quietly=True) or 25,
+                self._console_log_level, self._file_log_filepath, self._file_log_level)
         self._logger_instance.info("Executor Initialized")
 
 
-# Method that repeatedly runs every interval, skipping over client and logger initialization
-def run_loop(executor, logger_instance):
-    # Get the number of results and populate the search_result_dict
-    number_of_results = executor.execute_searches()
+# Method that repeatedly runs every interval, skipping over client and logger initialization. If a collection of search
+# names is passed in, only those searches are run
+def run_loop(executor, logger_instance, search_names=None):
+    with executor.profile_cycle():
+        run_cycle(executor, logger_instance, search_names)
 
-    # Exit early if there are no results in the search dict
-    if number_of_results == 0:
-        logger_instance.info("No new search results found.")
-        return
 
-    # Consolidate the search results into emails and send them
-    executor.generate_and_send_emails()
-    logger_instance.info("Scheduled run finished. Waiting until next run...")
+# Run a single cycle of searching, deduping and emailing, recording how long it took in the metrics
+def run_cycle(executor, logger_instance, search_names=None):
+    cycle_start_time = time.perf_counter()
+    try:
+        # Get the number of results and populate the search_result_index
+        number_of_results = executor.execute_searches(search_names)
+
+        # Exit early if there are no results in the search dict
+        if number_of_results == 0:
+            logger_instance.info("No new search results found.")
+            return
+
+        # Consolidate the search results into emails and send them
+        executor.generate_and_send_emails()
+        logger_instance.info("Scheduled run finished. Waiting until next run...")
+    finally:
+        # Record the cycle next to the search intervals, so a cycle time approaching an interval can be alerted on
+        cycle_seconds = time.perf_counter() - cycle_start_time
+        metrics.CYCLE_DURATION_SECONDS.observe(cycle_seconds)
+        metrics.LAST_CYCLE_DURATION_SECONDS.set(cycle_seconds)
+        metrics.LAST_CYCLE_END_TIMESTAMP.set(time.time())
+        for search_name, interval_seconds in executor.get_scheduled_intervals().items():
+            metrics.SEARCH_INTERVAL_SECONDS.set(interval_seconds, search=search_name)
+
+
+# Method that runs each search whenever its interval comes due, sleeping until the next search is due in between and
+# picking up modified config files at least every CONFIG_RELOAD_SECONDS
+def schedule_loop(executor, logger_instance, configuration):
+    scheduler = SearchScheduler(configuration.get_config_value("search_jitter_seconds", fail_quietly=True) or 0,
+                                configuration.get_config_value("logging.console_log_level"),
+                                configuration.get_config_value("logging.file_log_absolute_path"),
+                                configuration.get_config_value("logging.file_log_level"))
+    # Every search is due immediately, so they all run on startup
+    scheduler.update_searches(executor.get_scheduled_intervals(), executor.get_search_groups())
+
+    # Serve the control API for running, pausing and resuming searches without waiting for the schedule
+    control_port = configuration.get_config_value("control_settings.http_port", fail_quietly=True)
+    if control_port:
+        from util.control_server import ControlServer
+        ControlServer(scheduler, executor.get_stats,
+                      configuration.get_config_value("control_settings.http_host", fail_quietly=True) or "127.0.0.1",
+                      control_port, configuration.get_config_value("logging.console_log_level"),
+                      configuration.get_config_value("logging.file_log_absolute_path"),
+                      configuration.get_config_value("logging.file_log_level"))
+    while True:
+        due_search_list = scheduler.wait_for_due_searches(CONFIG_RELOAD_SECONDS)
+
+        # Pick up modified config files between runs, rescheduling searches that were added, removed or changed
+        changed_key_set = executor.reload_configuration()
+        if len(changed_key_set & {"searches", "search_interval_minutes", "search_interval_mode",
+                                  "adaptive_interval_settings", "search_batching"}) > 0:
+            scheduler.update_searches(executor.get_scheduled_intervals(), executor.get_search_groups())
+
+        if len(due_search_list) == 0:
+            logger_instance.debug("No searches due, checking for config changes and due digests")
+            executor.flush_digests()
+            continue
+        started_time = time.time()
+        try:
+            run_loop(executor, logger_instance, due_search_list)
+        finally:
+            # Adaptive intervals may have moved with the results of this run
+            scheduler.update_searches(executor.get_scheduled_intervals(), executor.get_search_groups())
+            scheduler.mark_finished(due_search_list, started_time)
+        if logger_instance.isEnabledFor(logging.DEBUG):
+            for search_name, next_run_time, interval_seconds in scheduler.get_schedule():
+                if next_run_time is not None:
+                    logger_instance.debug("Search [%s] runs next at %s", search_name, time.ctime(next_run_time))
+
+
+# Method that streams new submissions forever, sending an email whenever a flush of the stream found new results
+def stream_loop(executor, logger_instance, flush_interval_seconds):
+    while True:
+        for number_of_results in executor.stream_searches(flush_interval_seconds):
+            if number_of_results > 0:
+                executor.generate_and_send_emails()
+                logger_instance.info("Streamed results sent. Continuing to stream...")
+            else:
+                logger_instance.debug("No new streamed results found.")
+
+            # The stream is compiled from the searches and runs on a Reddit client, so restart it if either changed
+            changed_key_set = executor.reload_configuration()
+            if "searches" in changed_key_set:
+                logger_instance.info("Searches changed, restarting the stream")
+                break
+            if len(changed_key_set & set(REDDIT_CLIENT_KEYS)) > 0:
+                logger_instance.info("Reddit clients changed, restarting the stream")
+                break
 
 
 # https://askubuntu.com/questions/396654/how-to-run-the-python-program-in-the-background-in-ubuntu-machine
@@ -232,8 +1017,31 @@ def main(args):
     parser.add_argument('--skipdedupe', '-s', help="Skip deduping on existing results", action='store_true')
 
     parser.add_argument('--onerun', '-o', help="Run search once and don't schedule further jobs", action='store_true')
+
+    parser.add_argument('--profile', help="Profile every search cycle with cProfile, writing the results to a profiles "
+                                          "folder next to the log file. Pass 'memory' to also trace memory "
+                                          "allocations with tracemalloc, which slows the script down",
+                        nargs='?', const="cpu", choices=["cpu", "memory"])
+
+    parser.add_argument('--shard', help="Only run this worker's share of the searches, for running N workers that "
+                                        "share the dedupe and search state, each passed a different i from 1 to N, "
+                                        "like --shard 2/3", type=parse_shard)
+
+    parser.add_argument('--dryrun', help="Run every search once, dedupe and render the emails, but record nothing as "
+                                         "seen and send nothing. Prints a report of what the run cost and would have "
+                                         "sent instead", action='store_true')
+
+    parser.add_argument('--stream', help="Stream new submissions and match them against the searches locally instead "
+                                         "of running the searches on a schedule", action='store_true')
     args = parser.parse_args()
 
+    if args.stream and args.onerun:
+        parser.error("--stream runs until interrupted and can't be combined with --onerun")
+    if args.stream and args.dryrun:
+        parser.error("--dryrun runs the searches once and can't be combined with --stream")
+    if args.stream and args.profile is not None:
+        parser.error("--profile profiles scheduled search cycles and can't be combined with --stream")
+
     # http://www.blog.pythonlibrary.org/2013/10/29/python-101-how-to-find-the-path-of-a-running-script/
     default_config_absolute_path = os.path.abspath(os.path.dirname(sys.argv[0])) + "/default_base_config.json"
     config_list = [default_config_absolute_path]
@@ -250,33 +1058,66 @@ def main(args):
 
     logger_instance = get_logger_with_name("core", console_log_level, file_log_filepath, file_log_level)
 
+    # Shards claim new submissions through the dedupe database's write lock, which the CSV backend doesn't have
+    if args.shard is not None and not args.skipdedupe and (configuration.get_config_value(
+            "dedupe_settings.backend", fail_quietly=True) or "sqlite") != "sqlite":
+        parser.error("--shard needs the sqlite dedupe backend, so workers can't both send the same submission")
+    if args.shard is not None:
+        logger_instance.info("Running shard %d of %d", args.shard[0] + 1, args.shard[1])
+
     # Initialize the helper class along with its helper classes for Reddit and Gmail integration
     executor = SearchAndEmailExecutor(args,configuration)
     executor.initialize_praw()
-    executor.initialize_email()
+    # A single run only signs in to send email once it has found something to send. Otherwise EmailTools are set up
+    # on startup, so bad credentials are reported right away rather than when the first results come in
+    if not args.onerun and not args.dryrun:
+        executor.initialize_email()
+        executor.start_email_spool()
 
-    # Set the interval to wait between running searches
-    interval = configuration.get_config_value("search_interval_minutes")
-    schedule.every(interval).minutes.do(run_loop, executor, logger_instance)
+    # Serve the metrics while the script keeps running. A single run writes them to a file instead, once it's done
+    metrics_port = configuration.get_config_value("metrics_settings.http_port", fail_quietly=True)
+    if metrics_port and not args.onerun and not args.dryrun:
+        metrics.MetricsServer(metrics.REGISTRY, configuration.get_config_value(
+            "metrics_settings.http_host", fail_quietly=True) or "127.0.0.1", metrics_port)
+        logger_instance.info("Serving metrics on port %d", metrics_port)
 
-    # Run the search immediately
-    run_loop(executor, logger_instance)
+    if args.dryrun:
+        with executor.profile_cycle():
+            executor.execute_searches()
+        print(executor.get_dry_run_report())
+        return
 
-    if not args.onerun:
+    if args.stream:
         try:
-            # Loop forever, sleeping N seconds and then checking if any scheduled jobs need to be run
-            while True:
-                time.sleep(60)
-                schedule.run_pending()
-                logger_instance.debug("Sleeping until the next check for a pending scheduled job")
+            stream_loop(executor, logger_instance,
+                        configuration.get_config_value("stream_flush_seconds", fail_quietly=True) or 60)
         except KeyboardInterrupt:
             message = 'Interrupted by user! Exiting...'
             logger_instance.warning(message)
             print(message)
-    else:
+        return
+
+    if args.onerun:
+        # Run every search immediately and exit, leaving the scheduling to something like cron
+        try:
+            run_loop(executor, logger_instance)
+        finally:
+            # Deliver this run's spooled emails, and any left over from earlier runs that are due for a retry
+            executor.flush_email_spool()
+            metrics_textfile_path = configuration.get_config_value("metrics_settings.textfile_path",
+                                                                   fail_quietly=True)
+            if metrics_textfile_path:
+                metrics.REGISTRY.write_textfile(metrics_textfile_path)
         logger_instance.warning("Script was called with onerun argument and has run once. Exiting...")
         return
 
+    try:
+        schedule_loop(executor, logger_instance, configuration)
+    except KeyboardInterrupt:
+        message = 'Interrupted by user! Exiting...'
+        logger_instance.warning(message)
+        print(message)
+
 # https://stackoverflow.com/questions/419163/what-does-if-name-main-do
 # Call main(sys.argv[1:]) this file is run. Pass the arg array from element 1 onwards to exclude the program name arg
 if __name__ == "__main__": main(sys.argv[1:])
\ No newline at end of file
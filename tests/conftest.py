@@ -0,0 +1,33 @@
+import pytest
+from aiosmtpd.controller import Controller
+
+from tests.smtp_stub import RecordingHandler, get_free_port
+from util.email_tools import EmailTools
+
+
+@pytest.fixture
+def smtp_handler():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname="127.0.0.1", port=get_free_port(), auth_require_tls=False)
+    controller.start()
+    handler.port = controller.port
+    yield handler
+    controller.stop()
+
+
+# Returns EmailTools sending through the local SMTP server, with token refreshes counted instead of calling Google
+@pytest.fixture
+def email_tools(smtp_handler, monkeypatch):
+    refresh_count_list = []
+
+    def refresh_authorization(self):
+        refresh_count_list.append(1)
+        return "access-token-{}".format(len(refresh_count_list)), self.expires_in
+
+    monkeypatch.setattr(EmailTools, "refresh_authorization", refresh_authorization)
+    monkeypatch.setattr(EmailTools, "expires_in", 3600, raising=False)
+    email_tools = EmailTools("sender@example.com", "client-id", "client-secret", "refresh-token", "INFO", "", "INFO",
+                             "127.0.0.1", smtp_handler.port, smtp_use_tls=False, max_smtp_connections=1)
+    email_tools.refresh_count_list = refresh_count_list
+    yield email_tools
+    email_tools.close()
@@ -0,0 +1,37 @@
+import socket
+
+from aiosmtpd.smtp import AuthResult
+
+from util.email_tools import create_mime_email
+
+
+# Accepts AUTH XOAUTH2 and keeps the messages it's sent, counting the sessions that authenticated. The next
+# reject_count messages are refused with a temporary failure instead
+class RecordingHandler:
+
+    async def auth_XOAUTH2(self, server, args):
+        self.auth_count += 1
+        return AuthResult(success=True, handled=False)
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject_count > 0:
+            self.reject_count -= 1
+            return "451 Try again later"
+        self.message_list.append((envelope.rcpt_tos, envelope.content))
+        return "250 OK"
+
+    def __init__(self):
+        self.auth_count = 0
+        self.message_list = []
+        self.reject_count = 0
+
+
+# Returns a free localhost port for the SMTP server to listen on
+def get_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+def create_test_email(email_recipient="recipient@example.com"):
+    return create_mime_email("text", "<p>html</p>", "Results", "sender@example.com", email_recipient)
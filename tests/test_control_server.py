@@ -0,0 +1,93 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from util.control_server import ControlServer, is_loopback_host
+from util.search_scheduler import SearchScheduler
+
+
+@pytest.fixture
+def scheduler():
+    search_scheduler = SearchScheduler(console_log_level="WARNING")
+    search_scheduler.update_searches({"First": 600, "Second": 600, "Third": 600}, [["Second", "Third"]])
+    # Take the startup runs, so nothing is due until asked for
+    search_scheduler.mark_finished(search_scheduler.wait_for_due_searches(0), time.time())
+    return search_scheduler
+
+
+@pytest.fixture
+def control_server(scheduler):
+    server = ControlServer(scheduler, lambda: {"last_cycle_seconds": 1.5}, "127.0.0.1", 0, "WARNING")
+    yield server
+    server.shutdown()
+
+
+# Send a request to the control API, returning the (HTTP status, response dict)
+def call_api(control_server, method, path):
+    request = urllib.request.Request("http://127.0.0.1:{}{}".format(control_server.get_port(), path), method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, None
+
+
+def test_stats(control_server):
+    status, stats_dict = call_api(control_server, "GET", "/stats")
+
+    assert status == 200
+    assert stats_dict["paused"] is False
+    assert stats_dict["queue_depth"] == 0
+    assert stats_dict["last_cycle_seconds"] == 1.5
+    assert sorted(search["search_name"] for search in stats_dict["searches"]) == ["First", "Second", "Third"]
+    assert all(500 < search["next_run_in_seconds"] <= 600 for search in stats_dict["searches"])
+
+
+# Running a search also runs the searches that share its query, and a running search can't be run again
+def test_run_search(control_server, scheduler):
+    assert call_api(control_server, "POST", "/run?search=Second") == (202, {"scheduled": ["Second"]})
+    assert sorted(scheduler.wait_for_due_searches(0)) == ["Second", "Third"]
+
+    assert call_api(control_server, "POST", "/run?search=Third")[0] == 409
+    assert call_api(control_server, "POST", "/run?search=Missing")[0] == 404
+
+
+def test_run_every_search(control_server, scheduler):
+    status, response_dict = call_api(control_server, "POST", "/run")
+
+    assert status == 202
+    assert sorted(response_dict["scheduled"]) == ["First", "Second", "Third"]
+    assert sorted(scheduler.wait_for_due_searches(0)) == ["First", "Second", "Third"]
+
+
+def test_pause_and_resume(control_server, scheduler):
+    assert call_api(control_server, "POST", "/pause?search=First") == (200, {"paused": True})
+    assert scheduler.is_paused("First")
+    assert not scheduler.is_paused("Second")
+    assert call_api(control_server, "POST", "/resume?search=First") == (200, {"paused": False})
+
+    assert call_api(control_server, "POST", "/pause") == (200, {"paused": True})
+    assert call_api(control_server, "GET", "/stats")[1]["paused"] is True
+    assert call_api(control_server, "POST", "/resume") == (200, {"paused": False})
+    assert not scheduler.is_paused()
+
+
+def test_unknown_paths(control_server):
+    assert call_api(control_server, "POST", "/restart")[0] == 404
+    assert call_api(control_server, "GET", "/")[0] == 404
+
+
+@pytest.mark.parametrize("host, is_loopback", [("127.0.0.1", True), ("127.0.0.2", True), ("::1", True),
+                                               ("localhost", True), ("0.0.0.0", False), ("192.168.1.10", False),
+                                               ("example.com", False), ("", False)])
+def test_is_loopback_host(host, is_loopback):
+    assert is_loopback_host(host) == is_loopback
+
+
+# The API has no authentication, so it won't listen where other machines can reach it
+def test_non_loopback_bind_is_refused(scheduler):
+    with pytest.raises(ValueError):
+        ControlServer(scheduler, dict, "0.0.0.0", 0, "WARNING")
@@ -0,0 +1,72 @@
+import pstats
+import threading
+import tracemalloc
+
+from util.cycle_profiler import CycleProfiler
+
+
+# Returns the sorted names of the files in the directory
+def list_files(directory_path):
+    return sorted(file_path.name for file_path in directory_path.iterdir())
+
+
+# Stands in for the work of a search, run in a worker thread
+def search_in_worker():
+    return sum(range(1000))
+
+
+# The first cycle is kept as the baseline, along with the most recent cycles and their diff from it
+def test_cycles_rotate_keeping_the_first(tmp_path):
+    cycle_profiler = CycleProfiler(str(tmp_path), keep_cycles=2, console_log_level="WARNING")
+    for _ in range(4):
+        with cycle_profiler.profile_cycle():
+            search_in_worker()
+
+    assert list_files(tmp_path) == ["cycle_000001.pstats", "cycle_000003.pstats", "cycle_000004.pstats", "diff.txt"]
+    assert (tmp_path / "diff.txt").read_text().startswith("Cycle 1 took ")
+
+
+# Functions run by worker threads are counted in the cycle's profile
+def test_worker_threads_are_profiled(tmp_path):
+    cycle_profiler = CycleProfiler(str(tmp_path), console_log_level="WARNING")
+    with cycle_profiler.profile_cycle():
+        worker_thread = threading.Thread(target=cycle_profiler.wrap_worker(search_in_worker))
+        worker_thread.start()
+        worker_thread.join()
+
+    function_names = [function_key[2] for function_key in
+                      pstats.Stats(str(tmp_path / "cycle_000001.pstats")).stats]
+    assert "search_in_worker" in function_names
+
+
+# With memory tracing, each cycle lists its top allocations and the diff includes the change in traced memory
+def test_memory_summaries(tmp_path):
+    cycle_profiler = CycleProfiler(str(tmp_path), trace_memory=True, console_log_level="WARNING")
+    try:
+        for _ in range(2):
+            with cycle_profiler.profile_cycle():
+                search_in_worker()
+    finally:
+        tracemalloc.stop()
+
+    assert (tmp_path / "cycle_000002.memory.txt").read_text().startswith("Cycle 2 traced memory: ")
+    assert "Traced memory change: " in (tmp_path / "diff.txt").read_text()
+
+
+# Files left by an earlier run are removed, so this run's first cycle is the baseline
+def test_earlier_run_files_are_removed(tmp_path):
+    (tmp_path / "cycle_000007.pstats").write_text("")
+    (tmp_path / "diff.txt").write_text("")
+    (tmp_path / "notes.txt").write_text("")
+    CycleProfiler(str(tmp_path), console_log_level="WARNING")
+
+    assert list_files(tmp_path) == ["notes.txt"]
+
+
+# A profile that can't be written is logged, without failing the cycle
+def test_write_failure_does_not_fail_the_cycle(tmp_path):
+    (tmp_path / "profiles").write_text("")
+    cycle_profiler = CycleProfiler(str(tmp_path / "profiles"), console_log_level="CRITICAL")
+
+    with cycle_profiler.profile_cycle():
+        search_in_worker()
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import sqlite3
+
+import pytest
+
+from util.dedupe_store import CsvDedupeStore, SqliteDedupeStore, create_dedupe_store
+
+DAY_SECONDS = 60 * 60 * 24
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    dedupe_store = SqliteDedupeStore(str(tmp_path / "old_results.sqlite3"), max_age_days=14)
+    yield dedupe_store
+    dedupe_store.close()
+
+
+def test_filter_new_returns_unseen_ids(sqlite_store):
+    sqlite_store.add(["a", "b"])
+
+    assert sqlite_store.filter_new(["a", "b", "c"]) == {"c"}
+    assert len(sqlite_store) == 2
+
+
+# Only the unseen IDs are claimed, and claiming them again claims nothing
+def test_claim_returns_only_unseen_ids(sqlite_store):
+    sqlite_store.add(["a"])
+
+    assert sqlite_store.claim(["a", "b", "c"]) == {"b", "c"}
+    assert sqlite_store.claim(["b", "c"]) == set()
+    assert len(sqlite_store) == 3
+
+
+# The write function sees the claimed IDs and the connection, and what it writes commits along with the claim
+def test_claim_commits_write_function_with_the_ids(sqlite_store):
+    def write_function(claimed_id_set, connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS written (submission_id TEXT)")
+        connection.executemany("INSERT INTO written VALUES (?)", [(submission_id,) for submission_id in
+                                                                 claimed_id_set])
+
+    sqlite_store.claim(["a", "b"], write_function)
+
+    with sqlite3.connect(sqlite_store._file_path) as connection:
+        assert sorted(row[0] for row in connection.execute("SELECT submission_id FROM written")) == ["a", "b"]
+
+
+# A failing write function rolls the claim back, so the submissions are still new on the next run
+def test_claim_rolls_back_when_write_function_fails(sqlite_store):
+    def write_function(claimed_id_set, connection):
+        raise RuntimeError("spool failed")
+
+    with pytest.raises(RuntimeError):
+        sqlite_store.claim(["a", "b"], write_function)
+
+    assert sqlite_store.filter_new(["a", "b"]) == {"a", "b"}
+    assert sqlite_store.claim(["a", "b"]) == {"a", "b"}
+
+
+def test_evict_expired_removes_ids_older_than_max_age(sqlite_store):
+    sqlite_store.add(["old"], seen_utc=1.0)
+    sqlite_store.claim(["recent"])
+
+    assert sqlite_store.evict_expired() == 1
+    assert sqlite_store.filter_new(["old", "recent"]) == {"old"}
+
+
+@pytest.mark.parametrize("max_age_days", [None, 0])
+def test_evict_expired_keeps_ids_forever_without_max_age(tmp_path, max_age_days):
+    dedupe_store = SqliteDedupeStore(str(tmp_path / "old_results.sqlite3"), max_age_days=max_age_days)
+    dedupe_store.add(["old"], seen_utc=1.0)
+
+    assert dedupe_store.evict_expired() == 0
+    assert len(dedupe_store) == 1
+    dedupe_store.close()
+
+
+# A legacy CSV is imported once and renamed
+def test_sqlite_store_migrates_csv(tmp_path):
+    csv_store = CsvDedupeStore(str(tmp_path / "old_results.csv"))
+    csv_store.add(["a", "b"])
+
+    dedupe_store = create_dedupe_store("sqlite", str(tmp_path))
+
+    assert dedupe_store.filter_new(["a", "b", "c"]) == {"c"}
+    assert not os.path.exists(tmp_path / "old_results.csv")
+    assert os.path.exists(tmp_path / "old_results.csv.migrated")
+    dedupe_store.close()
+
+
+# A read only store reads the existing database, and neither creates one nor imports a legacy CSV
+def test_read_only_store_leaves_directory_unchanged(tmp_path):
+    CsvDedupeStore(str(tmp_path / "old_results.csv")).add(["a"])
+
+    dedupe_store = create_dedupe_store("sqlite", str(tmp_path), read_only=True)
+    assert dedupe_store.filter_new(["a", "b"]) == {"a", "b"}
+    dedupe_store.close()
+    assert sorted(os.listdir(tmp_path)) == ["old_results.csv"]
+
+    os.remove(tmp_path / "old_results.csv")
+    writable_store = create_dedupe_store("sqlite", str(tmp_path))
+    writable_store.add(["a"])
+    writable_store.close()
+    read_only_store = create_dedupe_store("sqlite", str(tmp_path), read_only=True)
+    assert read_only_store.filter_new(["a", "b"]) == {"b"}
+    with pytest.raises(sqlite3.OperationalError):
+        read_only_store.add(["b"])
+    read_only_store.close()
+
+
+def test_csv_store_claims_and_persists(tmp_path):
+    file_path = str(tmp_path / "old_results.csv")
+    csv_store = CsvDedupeStore(file_path)
+
+    assert csv_store.claim(["a", "b"]) == {"a", "b"}
+    assert csv_store.claim(["b", "c"]) == {"c"}
+    assert CsvDedupeStore(file_path).filter_new(["a", "b", "c", "d"]) == {"d"}
+    assert csv_store.evict_expired() == 0
+
+
+# Claim every ID in the list, one at a time, from its own connection to the database, and put the claimed IDs on the
+# queue
+def claim_in_process(file_path, submission_id_list, start_barrier, result_queue):
+    dedupe_store = SqliteDedupeStore(file_path, console_log_level="WARNING")
+    start_barrier.wait()
+    claimed_id_list = []
+    for submission_id in submission_id_list:
+        claimed_id_list.extend(dedupe_store.claim([submission_id]))
+    dedupe_store.close()
+    result_queue.put(claimed_id_list)
+
+
+# Processes sharing the database each claim an overlapping range of IDs, and every ID is claimed by exactly one of them
+def test_claim_across_processes_claims_each_id_once(tmp_path):
+    file_path = str(tmp_path / "old_results.sqlite3")
+    SqliteDedupeStore(file_path, console_log_level="WARNING").close()
+    process_count = 4
+    start_barrier = multiprocessing.Barrier(process_count)
+    result_queue = multiprocessing.Queue()
+    process_list = [multiprocessing.Process(target=claim_in_process, args=(
+        file_path, ["id{}".format(id_index) for id_index in range(process_index * 25, process_index * 25 + 100)],
+        start_barrier, result_queue)) for process_index in range(process_count)]
+    for process in process_list:
+        process.start()
+    claimed_id_list = []
+    for _ in process_list:
+        claimed_id_list.extend(result_queue.get(timeout=60))
+    for process in process_list:
+        process.join()
+
+    assert sorted(claimed_id_list) == sorted("id{}".format(id_index) for id_index in range(175))
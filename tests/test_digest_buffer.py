@@ -0,0 +1,164 @@
+import sqlite3
+
+import pytest
+
+from util import digest_buffer
+from util.digest_buffer import SECONDS_PER_HOUR, DigestBuffer, DigestPolicy
+from util.submission_record import SubmissionRecord
+
+
+# Stands in for the time module in util.digest_buffer, so tests decide when each digest is taken
+class FakeClock:
+
+    def time(self):
+        return self.now_utc
+
+    def __init__(self):
+        self.now_utc = 1000000.0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(digest_buffer, "time", fake_clock)
+    return fake_clock
+
+
+@pytest.fixture
+def buffer(tmp_path, clock):
+    digest_buffer_instance = DigestBuffer(str(tmp_path / "old_results.sqlite3"), "WARNING")
+    yield digest_buffer_instance
+    digest_buffer_instance.close()
+
+
+def create_record(submission_id):
+    return SubmissionRecord(submission_id, "Title " + submission_id, "/r/python/" + submission_id, 0, "python",
+                            "https://example.com/" + submission_id)
+
+
+# Returns results grouped like SearchResultIndex.get_results_by_recipient, from (recipient, search, ID) tuples
+def create_results(*result_tuples):
+    results_by_recipient = {}
+    for email_recipient, search_name, submission_id in result_tuples:
+        results_by_recipient.setdefault(email_recipient, {}).setdefault(search_name, {})[submission_id] = \
+            create_record(submission_id)
+    return results_by_recipient
+
+
+# Take the due results, returning them as a dict of recipients to dicts of search names to sorted submission IDs
+def take_due(buffer, digest_policy):
+    with buffer.take_due(digest_policy) as (results_by_recipient, connection):
+        return {email_recipient: {search_name: sorted(submission_dict) for search_name, submission_dict in
+                                  search_dict.items()}
+                for email_recipient, search_dict in results_by_recipient.items()}
+
+
+def test_digest_policy_precedence():
+    digest_policy = DigestPolicy(600, 10, {"slow@example.com": {"interval_seconds": 3600},
+                                           "limited@example.com": {"max_emails_per_hour": 2}}, {"Urgent": 0})
+
+    assert digest_policy.get_interval_seconds("other@example.com", "Search") == 600
+    assert digest_policy.get_interval_seconds("slow@example.com", "Search") == 3600
+    assert digest_policy.get_interval_seconds("slow@example.com", "Urgent") == 0
+    assert digest_policy.get_max_emails_per_hour("other@example.com") == 10
+    assert digest_policy.get_max_emails_per_hour("limited@example.com") == 2
+
+
+def test_digest_policy_is_enabled():
+    assert not DigestPolicy().is_enabled()
+    assert not DigestPolicy(search_interval_dict={"Search": 0}).is_enabled()
+    assert DigestPolicy(600).is_enabled()
+    assert DigestPolicy(0, 5).is_enabled()
+    assert DigestPolicy(recipient_dict={"a@example.com": {"interval_seconds": 60}}).is_enabled()
+    assert DigestPolicy(search_interval_dict={"Search": 60}).is_enabled()
+
+
+# The first results after a quiet period are sent right away. Results found within the interval after that are held,
+# and merged into one digest once the interval has passed
+def test_results_are_held_for_the_interval_and_merged(buffer, clock):
+    digest_policy = DigestPolicy(600)
+    buffer.add(create_results(("a@example.com", "Search", "s1")))
+    assert take_due(buffer, digest_policy) == {"a@example.com": {"Search": ["s1"]}}
+
+    clock.now_utc += 60
+    buffer.add(create_results(("a@example.com", "Search", "s2")))
+    assert take_due(buffer, digest_policy) == {}
+    clock.now_utc += 60
+    buffer.add(create_results(("a@example.com", "Search", "s3"), ("a@example.com", "Other", "s3")))
+    # The same result found again isn't buffered twice
+    buffer.add(create_results(("a@example.com", "Search", "s2")))
+    assert take_due(buffer, digest_policy) == {}
+    assert len(buffer) == 3
+
+    clock.now_utc += 480
+    assert take_due(buffer, digest_policy) == {"a@example.com": {"Search": ["s2", "s3"], "Other": ["s3"]}}
+    assert len(buffer) == 0
+
+
+# Recipients are held on their own schedules
+def test_recipient_interval_override(buffer, clock):
+    digest_policy = DigestPolicy(600, recipient_dict={"fast@example.com": {"interval_seconds": 60}})
+    buffer.add(create_results(("fast@example.com", "Search", "s1"), ("slow@example.com", "Search", "s1")))
+    take_due(buffer, digest_policy)
+
+    clock.now_utc += 120
+    buffer.add(create_results(("fast@example.com", "Search", "s2"), ("slow@example.com", "Search", "s2")))
+    assert take_due(buffer, digest_policy) == {"fast@example.com": {"Search": ["s2"]}}
+
+
+# A result of a search without an interval is sent right away, taking the recipient's held results along with it
+def test_search_interval_override_releases_held_results(buffer, clock):
+    digest_policy = DigestPolicy(600, search_interval_dict={"Urgent": 0})
+    buffer.add(create_results(("a@example.com", "Search", "s1")))
+    take_due(buffer, digest_policy)
+
+    clock.now_utc += 60
+    buffer.add(create_results(("a@example.com", "Search", "s2")))
+    assert take_due(buffer, digest_policy) == {}
+    buffer.add(create_results(("a@example.com", "Urgent", "s3")))
+    assert take_due(buffer, digest_policy) == {"a@example.com": {"Search": ["s2"], "Urgent": ["s3"]}}
+
+
+# Without an interval, a recipient is emailed as results come in, up to their hourly budget
+def test_max_emails_per_hour(buffer, clock):
+    digest_policy = DigestPolicy(0, 2)
+    for submission_id in ["s1", "s2"]:
+        buffer.add(create_results(("a@example.com", "Search", submission_id)))
+        assert take_due(buffer, digest_policy) == {"a@example.com": {"Search": [submission_id]}}
+        clock.now_utc += 60
+
+    buffer.add(create_results(("a@example.com", "Search", "s3")))
+    assert take_due(buffer, digest_policy) == {}
+
+    # The first email of the hour drops out of the window
+    clock.now_utc += SECONDS_PER_HOUR - 120
+    assert take_due(buffer, digest_policy) == {"a@example.com": {"Search": ["s3"]}}
+
+
+# Results taken in a block that raises stay buffered, and don't count as an email sent
+def test_failed_take_keeps_results(buffer, clock):
+    digest_policy = DigestPolicy(600)
+    buffer.add(create_results(("a@example.com", "Search", "s1")))
+
+    with pytest.raises(RuntimeError):
+        with buffer.take_due(digest_policy) as (results_by_recipient, connection):
+            assert "a@example.com" in results_by_recipient
+            raise RuntimeError("Rendering failed")
+
+    assert len(buffer) == 1
+    assert take_due(buffer, digest_policy) == {"a@example.com": {"Search": ["s1"]}}
+
+
+# Results buffered in the caller's transaction, like the dedupe claim's, are only kept if it commits
+def test_add_in_caller_transaction(tmp_path, buffer):
+    connection = sqlite3.connect(str(tmp_path / "old_results.sqlite3"), isolation_level=None)
+    connection.execute("BEGIN IMMEDIATE")
+    buffer.add(create_results(("a@example.com", "Search", "s1")), connection)
+    connection.execute("ROLLBACK")
+    assert len(buffer) == 0
+
+    connection.execute("BEGIN IMMEDIATE")
+    buffer.add(create_results(("a@example.com", "Search", "s1")), connection)
+    connection.execute("COMMIT")
+    connection.close()
+    assert len(buffer) == 1
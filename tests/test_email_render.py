@@ -0,0 +1,46 @@
+import markdown
+import pytest
+
+from util.email_render import EmailRenderer, construct_email_markdown
+from util.submission_record import SubmissionRecord
+
+
+# Returns a record of a submission in r/python with the given title
+def create_record(submission_id, title):
+    return SubmissionRecord(submission_id, title, "/r/python/comments/" + submission_id, 0, "python",
+                            "https://example.com/" + submission_id)
+
+
+SEARCH_DICT = {"First": {"s1": create_record("s1", "Using PRAW"), "s2": create_record("s2", "Python *3.12* is out")},
+               "Second": {"s3": create_record("s3", "An asyncio guide")}}
+
+
+# Emails put together from the cached fragments are the same as rendering each email as a whole
+def test_fragments_match_rendering_the_whole_email():
+    markdown_body, html_body = EmailRenderer().render_email(SEARCH_DICT)
+
+    assert markdown_body == construct_email_markdown(SEARCH_DICT)
+    assert html_body == markdown.markdown(construct_email_markdown(SEARCH_DICT))
+
+
+# A search's fragment is rendered once for every recipient getting the same results, and again when they differ
+@pytest.mark.parametrize("use_markdown", [True, False])
+def test_fragments_are_reused_across_recipients(use_markdown):
+    email_renderer = EmailRenderer(use_markdown)
+    first_email = email_renderer.render_email(SEARCH_DICT)
+
+    assert email_renderer.render_email({"First": SEARCH_DICT["First"]})[0] == \
+        construct_email_markdown({"First": SEARCH_DICT["First"]})
+    assert email_renderer.render_email(SEARCH_DICT) == first_email
+    assert email_renderer.get_fragment_count() == 2
+    email_renderer.render_email({"First": {"s1": SEARCH_DICT["First"]["s1"]}})
+    assert email_renderer.get_fragment_count() == 3
+
+
+# HTML emitted directly escapes what would otherwise be markup
+def test_direct_html_is_escaped():
+    markdown_body, html_body = EmailRenderer(use_markdown=False).render_email(
+        {"<b>Search</b>": {"s1": create_record("s1", 'Python & "C" <3')}})
+
+    assert "<h3>&lt;b&gt;Search&lt;/b&gt;</h3>" in html_body
+    assert '<a href="https://reddit.com/r/python/comments/s1">Python &amp; &quot;C&quot; &lt;3</a>' in html_body
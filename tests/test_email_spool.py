@@ -0,0 +1,139 @@
+import sqlite3
+import time
+
+import pytest
+
+from tests.smtp_stub import create_test_email
+from util import email_spool
+from util.dedupe_store import SqliteDedupeStore
+from util.email_spool import EmailSpool, EmailSpoolWorker, get_retry_delay
+
+
+@pytest.fixture
+def spool_path(tmp_path):
+    return str(tmp_path / "old_results.sqlite3")
+
+
+@pytest.fixture
+def spool(spool_path):
+    email_spool_instance = EmailSpool(spool_path, "WARNING")
+    yield email_spool_instance
+    email_spool_instance.close()
+
+
+# Returns a worker sending the spool's emails through the EmailTools one at a time, retrying after retry_base_seconds
+def create_worker(spool, email_tools, retry_base_seconds=60, max_attempts=10):
+    return EmailSpoolWorker(spool, lambda mime_message: email_tools.send_mail([mime_message]), retry_base_seconds,
+                            3600, max_attempts, "WARNING")
+
+
+# Returns the (attempt_count, failed, last_error) of every email in the spool database
+def get_spool_rows(spool_path):
+    with sqlite3.connect(spool_path) as connection:
+        return connection.execute("SELECT attempt_count, failed, last_error FROM email_spool ORDER BY spool_id") \
+            .fetchall()
+
+
+def test_get_retry_delay_doubles_up_to_the_maximum():
+    assert [get_retry_delay(attempt_count, 60, 300) for attempt_count in range(1, 6)] == [60, 120, 240, 300, 300]
+
+
+def test_spooled_emails_are_sent(spool, email_tools, smtp_handler):
+    spool.enqueue([create_test_email(), create_test_email("other@example.com")])
+
+    assert create_worker(spool, email_tools).flush() == 2
+    assert spool.get_pending_count() == 0
+    assert sorted(rcpt_tos for rcpt_tos, content in smtp_handler.message_list) == [["other@example.com"],
+                                                                                  ["recipient@example.com"]]
+
+
+# A send the SMTP server refuses stays in the spool, and is sent once its retry is due
+def test_failed_send_stays_spooled_and_is_retried(spool, spool_path, email_tools, smtp_handler):
+    spool.enqueue([create_test_email()])
+    smtp_handler.reject_count = 1
+    worker = create_worker(spool, email_tools, retry_base_seconds=0.2)
+
+    assert worker.send_due() == 0
+    assert spool.get_pending_count() == 1
+    assert spool.get_next_attempt_time() > time.time()
+    assert get_spool_rows(spool_path)[0][:2] == (1, 0)
+    assert "451" in get_spool_rows(spool_path)[0][2]
+    # Not due again until the retry delay has passed
+    assert worker.send_due() == 0
+
+    time.sleep(0.3)
+    assert worker.send_due() == 1
+    assert spool.get_pending_count() == 0
+    assert len(smtp_handler.message_list) == 1
+
+
+# Once an email runs out of attempts, it's kept in the spool as failed rather than retried
+def test_email_kept_as_failed_after_max_attempts(spool, spool_path, email_tools, smtp_handler):
+    spool.enqueue([create_test_email()])
+    smtp_handler.reject_count = 5
+    worker = create_worker(spool, email_tools, retry_base_seconds=0, max_attempts=2)
+
+    assert worker.send_due() == 0
+    assert spool.get_pending_count() == 0
+    assert get_spool_rows(spool_path)[0][:2] == (2, 1)
+    assert smtp_handler.message_list == []
+
+
+def test_spooled_email_survives_reopening(spool_path, email_tools, smtp_handler):
+    first_spool = EmailSpool(spool_path, "WARNING")
+    first_spool.enqueue([create_test_email()])
+    first_spool.close()
+
+    reopened_spool = EmailSpool(spool_path, "WARNING")
+    assert reopened_spool.get_pending_count() == 1
+    assert create_worker(reopened_spool, email_tools).flush() == 1
+    reopened_spool.close()
+    assert len(smtp_handler.message_list) == 1
+
+
+# An email claimed by a sender that died mid-send is sent again by the next process once the claim's lease runs out
+def test_email_claimed_before_a_crash_is_sent_again(spool_path, email_tools, smtp_handler, monkeypatch):
+    monkeypatch.setattr(email_spool, "CLAIM_LEASE_SECONDS", 0)
+    crashed_spool = EmailSpool(spool_path, "WARNING")
+    crashed_spool.enqueue([create_test_email()])
+    assert crashed_spool.claim_due_email()[1] == 1
+    crashed_spool.close()
+
+    reopened_spool = EmailSpool(spool_path, "WARNING")
+    assert create_worker(reopened_spool, email_tools).flush() == 1
+    reopened_spool.close()
+    assert get_spool_rows(spool_path) == []
+    assert len(smtp_handler.message_list) == 1
+
+
+# Emails spooled while claiming submissions are committed with the claim, or not at all if it fails
+def test_emails_share_the_dedupe_transaction(spool, spool_path):
+    dedupe_store = SqliteDedupeStore(spool_path, console_log_level="WARNING")
+    dedupe_store.claim(["a"], lambda claimed_id_set, connection: spool.enqueue([create_test_email()], connection))
+
+    def fail_after_spooling(claimed_id_set, connection):
+        spool.enqueue([create_test_email()], connection)
+        raise RuntimeError("Rendering failed")
+
+    with pytest.raises(RuntimeError):
+        dedupe_store.claim(["b"], fail_after_spooling)
+
+    assert dedupe_store.filter_new(["a", "b"]) == {"b"}
+    assert spool.get_pending_count() == 1
+    dedupe_store.close()
+
+
+# Background senders send emails as they're spooled, and stop once their current email is sent
+def test_background_senders_send_spooled_emails(spool, email_tools, smtp_handler):
+    worker = create_worker(spool, email_tools)
+    worker.start(2)
+    spool.enqueue([create_test_email("recipient{}@example.com".format(email_index)) for email_index in range(5)])
+    worker.wake()
+
+    deadline = time.time() + 10
+    while len(smtp_handler.message_list) < 5 and time.time() < deadline:
+        time.sleep(0.05)
+    worker.stop()
+
+    assert len(smtp_handler.message_list) == 5
+    assert spool.get_pending_count() == 0
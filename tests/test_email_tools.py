@@ -0,0 +1,73 @@
+import smtplib
+
+from tests.smtp_stub import create_test_email
+from util.email_tools import ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS
+
+
+# The token checked when EmailTools is created is reused until it's about to expire
+def test_access_token_is_cached_until_expiry(email_tools):
+    assert email_tools.get_access_token() == "access-token-1"
+    assert email_tools.get_access_token() == "access-token-1"
+    assert len(email_tools.refresh_count_list) == 1
+
+    email_tools._access_token_expiry_time = 0
+    assert email_tools.get_access_token() == "access-token-2"
+    assert len(email_tools.refresh_count_list) == 2
+
+
+def test_access_token_refreshed_within_expiry_margin(email_tools):
+    email_tools.expires_in = ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS
+    email_tools._access_token_expiry_time = 0
+
+    email_tools.get_access_token()
+    email_tools.get_access_token()
+
+    assert len(email_tools.refresh_count_list) == 3
+
+
+# Sends reuse the pooled session, so only the first one authenticates
+def test_pooled_session_is_reused(email_tools, smtp_handler):
+    email_tools.send_mail([create_test_email()])
+    email_tools.send_mail([create_test_email(), create_test_email("other@example.com")])
+
+    assert smtp_handler.auth_count == 1
+    assert [rcpt_tos for rcpt_tos, content in smtp_handler.message_list] == [
+        ["recipient@example.com"], ["recipient@example.com"], ["other@example.com"]]
+    assert len(email_tools.refresh_count_list) == 1
+
+
+# A pooled session that fails its NOOP health check is discarded and a new one is opened
+def test_dead_pooled_session_fails_health_check(email_tools, smtp_handler):
+    email_tools.send_mail([create_test_email()])
+    email_tools._idle_smtp_connections[0].close()
+
+    email_tools.send_mail([create_test_email()])
+
+    assert smtp_handler.auth_count == 2
+    assert len(smtp_handler.message_list) == 2
+
+
+# A session dropped after passing its health check is closed, and the send is retried once on a new session
+def test_dropped_session_is_closed_and_reconnected(email_tools, smtp_handler):
+    email_tools.send_mail([create_test_email()])
+    dropped_server = email_tools._idle_smtp_connections[0]
+    close_count_list = []
+    close_function = dropped_server.close
+
+    def sendmail(*args, **kwargs):
+        raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+
+    def close():
+        close_count_list.append(1)
+        close_function()
+
+    dropped_server.sendmail = sendmail
+    dropped_server.close = close
+
+    email_tools.send_mail([create_test_email()])
+
+    assert len(close_count_list) == 1
+    assert dropped_server.sock is None
+    assert smtp_handler.auth_count == 2
+    assert len(smtp_handler.message_list) == 2
+    assert email_tools._idle_smtp_connections[0] is not dropped_server
@@ -0,0 +1,40 @@
+import json
+import multiprocessing
+
+from util.file_lock import merge_json_file
+
+
+# Merge a key per write into the file, each write on its own
+def merge_in_process(file_path, process_index, write_count, start_barrier):
+    start_barrier.wait()
+    for write_index in range(write_count):
+        merge_json_file(file_path, {"{}-{}".format(process_index, write_index): write_index})
+
+
+def test_merge_json_file_keeps_other_keys(tmp_path):
+    file_path = str(tmp_path / "state.json")
+    merge_json_file(file_path, {"a": 1, "b": 2})
+
+    assert merge_json_file(file_path, {"b": 3, "c": 4}, removed_keys=["a"]) == {"b": 3, "c": 4}
+    with open(file_path) as opened_file:
+        assert json.load(opened_file) == {"b": 3, "c": 4}
+
+
+# Processes writing their own keys to the same file at the same time don't lose each other's keys
+def test_merge_json_file_across_processes_keeps_every_key(tmp_path):
+    file_path = str(tmp_path / "state.json")
+    process_count = 4
+    write_count = 25
+    start_barrier = multiprocessing.Barrier(process_count)
+    process_list = [multiprocessing.Process(target=merge_in_process,
+                                            args=(file_path, process_index, write_count, start_barrier))
+                    for process_index in range(process_count)]
+    for process in process_list:
+        process.start()
+    for process in process_list:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in process_list)
+    with open(file_path) as opened_file:
+        assert len(json.load(opened_file)) == process_count * write_count
+    assert not any(tmp_path.glob("*.tmp"))
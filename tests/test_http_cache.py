@@ -0,0 +1,130 @@
+import prawcore
+import pytest
+import requests
+
+from util.http_cache import CachingRequestor, HttpCacheMissError, get_request_key
+
+LISTING_URL = "https://oauth.reddit.com/r/python/search"
+
+
+# Returns a requests Response with the status code, headers and body
+def create_response(status_code, headers=None, body=b""):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = LISTING_URL
+    response.encoding = "utf-8"
+    response.headers.update(headers or {})
+    response._content = body
+    return response
+
+
+# Stands in for the requests session under prawcore, answering with the responses in the list one at a time and
+# recording the requests made. Fails the test if a request is made when no response is left
+class StubSession(requests.Session):
+
+    def request(self, method, url, **kwargs):
+        self.request_list.append((method, url, kwargs))
+        assert len(self.response_list) > 0, "Unexpected request to {}".format(url)
+        return self.response_list.pop(0)
+
+    def __init__(self, response_list=()):
+        super().__init__()
+        self.response_list = list(response_list)
+        self.request_list = []
+
+
+def create_requestor(cache_directory, mode, session, ttl_seconds=300):
+    return CachingRequestor(user_agent="search runner tests", session=session, cache_directory=str(cache_directory),
+                            mode=mode, ttl_seconds=ttl_seconds)
+
+
+# Recorded responses are replayed without any request being sent, leaving out the recorded rate limit headers
+def test_record_then_replay(tmp_path):
+    record_session = StubSession([create_response(200, {"etag": "v1", "set-cookie": "session=1",
+                                                        "x-ratelimit-remaining": "10"}, b'{"data": 1}')])
+    recorded_response = create_requestor(tmp_path, "record", record_session).request(
+        "GET", LISTING_URL, params={"q": "praw", "limit": 100}, headers={"Authorization": "bearer first"})
+    assert recorded_response.content == b'{"data": 1}'
+
+    replay_session = StubSession()
+    requestor = create_requestor(tmp_path, "replay", replay_session)
+    # Parameters in another order, sent with another credential, are the same request
+    replayed_response = requestor.request("GET", LISTING_URL, params={"limit": 100, "q": "praw"},
+                                          headers={"Authorization": "bearer second"})
+
+    assert replay_session.request_list == []
+    assert requestor.cache_hits == 1
+    assert replayed_response.status_code == 200
+    assert replayed_response.content == b'{"data": 1}'
+    assert replayed_response.headers["etag"] == "v1"
+    assert "set-cookie" not in replayed_response.headers
+    assert "x-ratelimit-remaining" not in replayed_response.headers
+
+
+# A request without a recording fails in replay mode rather than going to Reddit
+def test_replay_miss_fails(tmp_path):
+    replay_session = StubSession()
+    requestor = create_requestor(tmp_path, "replay", replay_session)
+
+    with pytest.raises(prawcore.exceptions.RequestException) as exception_info:
+        requestor.request("GET", LISTING_URL, params={"q": "praw"})
+    assert isinstance(exception_info.value.original_exception, HttpCacheMissError)
+    assert replay_session.request_list == []
+    assert requestor.cache_misses == 1
+
+
+def test_request_key_ignores_headers_and_parameter_order():
+    assert get_request_key("get", LISTING_URL, {"q": "praw", "limit": 100}) == \
+        get_request_key("GET", LISTING_URL, [("limit", "100"), ("q", "praw")])
+    assert get_request_key("GET", LISTING_URL, {"q": "praw"}) != get_request_key("GET", LISTING_URL, {"q": "asyncio"})
+    assert get_request_key("GET", LISTING_URL) != get_request_key("POST", LISTING_URL)
+
+
+# In cache mode, a fresh stored response is served from disk, and only GET requests are cached
+def test_cache_serves_fresh_responses_from_disk(tmp_path):
+    session = StubSession([create_response(200, body=b"first"), create_response(200, body=b"post"),
+                           create_response(200, body=b"post")])
+    requestor = create_requestor(tmp_path, "cache", session)
+
+    assert requestor.request("GET", LISTING_URL, params={"q": "praw"}).content == b"first"
+    assert requestor.request("GET", LISTING_URL, params={"q": "praw"}).content == b"first"
+    requestor.request("POST", LISTING_URL, data={"q": "praw"})
+    requestor.request("POST", LISTING_URL, data={"q": "praw"})
+
+    assert len(session.request_list) == 3
+    assert (requestor.cache_hits, requestor.cache_misses) == (1, 1)
+
+
+# A stale stored response is revalidated with its ETag, and a 304 answer serves the stored body
+def test_cache_revalidates_stale_responses(tmp_path):
+    session = StubSession([create_response(200, {"etag": "v1"}, b"stored"),
+                           create_response(304, {"x-ratelimit-remaining": "5"})])
+    requestor = create_requestor(tmp_path, "cache", session, ttl_seconds=0)
+    requestor.request("GET", LISTING_URL)
+    revalidated_response = requestor.request("GET", LISTING_URL)
+
+    assert session.request_list[1][2]["headers"]["If-None-Match"] == "v1"
+    assert revalidated_response.status_code == 200
+    assert revalidated_response.content == b"stored"
+    assert revalidated_response.headers["x-ratelimit-remaining"] == "5"
+    assert requestor.revalidations == 1
+    # No temporary files are left behind
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == [".json"]
+
+
+# A read only cache serves what's stored, but neither stores new responses nor creates its directory
+def test_read_only_cache_writes_nothing(tmp_path):
+    create_requestor(tmp_path, "record", StubSession([create_response(200, body=b"stored")])).request(
+        "GET", LISTING_URL, params={"q": "praw"})
+    stored_file_list = sorted(tmp_path.iterdir())
+
+    session = StubSession([create_response(200, body=b"fetched")])
+    requestor = CachingRequestor(user_agent="search runner tests", session=session, cache_directory=str(tmp_path),
+                                 mode="cache", read_only=True)
+    assert requestor.request("GET", LISTING_URL, params={"q": "praw"}).content == b"stored"
+    assert requestor.request("GET", LISTING_URL, params={"q": "asyncio"}).content == b"fetched"
+    assert sorted(tmp_path.iterdir()) == stored_file_list
+
+    CachingRequestor(user_agent="search runner tests", session=StubSession(),
+                     cache_directory=str(tmp_path / "missing"), mode="record", read_only=True)
+    assert not (tmp_path / "missing").exists()
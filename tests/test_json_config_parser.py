@@ -0,0 +1,107 @@
+import json
+import os
+
+import pytest
+
+from util.json_config_parser import JsonConfig
+
+OVERRIDE_CONFIG = {"top": "override", "zero": 0, "nothing": None, "empty": "", "nested": {"inner": "a", "zero": 0},
+                   "items": [{"name": "x", "value": 1}, {"name": "y"}], "only_override": 5, "falsy_list": [0, None]}
+FALLBACK_CONFIG = {"top": "fallback", "zero": 7, "nothing": "fallback", "empty": "fallback",
+                   "nested": {"inner": "b", "other": "c", "zero": 3}, "items": [{"name": "z", "value": 2}],
+                   "only_fallback": [1, 2], "falsy_list": [3],
+                   "logging": [{"console_log_level": "WARNING", "file_log_level": "WARNING",
+                                "file_log_absolute_path": ""}]}
+
+
+# Write the config dict to a file in the directory, returning its path
+def write_config(directory, file_name, config_dict):
+    config_path = directory / file_name
+    config_path.write_text(json.dumps(config_dict))
+    return str(config_path)
+
+
+@pytest.fixture
+def configuration(tmp_path):
+    return JsonConfig([write_config(tmp_path, "override.json", OVERRIDE_CONFIG),
+                       write_config(tmp_path, "fallback.json", FALLBACK_CONFIG)])
+
+
+# Expected lookups, matching what JsonConfig returned before keys were indexed and lookups cached
+@pytest.mark.parametrize("key, simplify_singleton, remove_none, expected", [
+    ("top", True, False, "override"),
+    ("top", False, False, ["override"]),
+    # 0 and null aren't values, so the fallback config is used
+    ("zero", True, False, 7),
+    ("nothing", False, False, ["fallback"]),
+    ("falsy_list", True, False, 3),
+    # An empty string is a value, unless None and empty items are removed
+    ("empty", True, False, ""),
+    ("empty", True, True, "fallback"),
+    ("nested", True, False, {"inner": "a", "zero": 0}),
+    ("nested.inner", True, False, "a"),
+    ("nested.other", False, False, ["c"]),
+    ("nested.zero", True, False, 3),
+    # Lists of objects are searched through, keeping an item for each object
+    ("items", True, False, [{"name": "x", "value": 1}, {"name": "y"}]),
+    ("items.name", True, False, ["x", "y"]),
+    ("items.value", True, False, [1, None]),
+    ("items.value", True, True, 1),
+    ("items.value", False, True, [1]),
+    ("only_override", True, False, 5),
+    ("only_fallback", True, False, [1, 2]),
+    ("logging.console_log_level", False, False, ["WARNING"]),
+])
+def test_get_config_value(configuration, key, simplify_singleton, remove_none, expected):
+    assert configuration.get_config_value(key, simplify_singleton, remove_none) == expected
+    # Served from the cache the second time, with the same result
+    assert configuration.get_config_value(key, simplify_singleton, remove_none) == expected
+
+
+@pytest.mark.parametrize("key", ["missing", "nested.missing"])
+def test_missing_key_fails(configuration, key):
+    assert configuration.get_config_value(key, fail_quietly=True) is None
+    with pytest.raises(Exception):
+        configuration.get_config_value(key)
+
+
+def test_empty_key_fails(configuration):
+    with pytest.raises(Exception):
+        configuration.get_config_value("", fail_quietly=True)
+
+
+# Changing a returned list doesn't change the cached value
+def test_returned_lists_are_copies(configuration):
+    configuration.get_config_value("items.name").append("changed")
+
+    assert configuration.get_config_value("items.name") == ["x", "y"]
+
+
+def test_reload_if_changed_replaces_cached_values(tmp_path, configuration):
+    assert configuration.get_config_value("top") == "override"
+    assert configuration.get_config_value("new_key", fail_quietly=True) is None
+    assert configuration.reload_if_changed() == set()
+
+    override_path = write_config(tmp_path, "override.json", dict(OVERRIDE_CONFIG, top="reloaded", new_key=1))
+    # Make sure the modification time changes, however coarse the filesystem's clock
+    os.utime(override_path, ns=(0, os.stat(override_path).st_mtime_ns + 1000000000))
+
+    assert configuration.reload_if_changed() == {"top", "new_key"}
+    assert configuration.get_config_value("top") == "reloaded"
+    assert configuration.get_config_value("new_key") == 1
+    assert configuration.get_config_value("zero") == 7
+
+
+# A config that fails validation is rejected, keeping the values looked up before the reload
+def test_reload_if_changed_keeps_config_rejected_by_validation(tmp_path, configuration):
+    assert configuration.get_config_value("top") == "override"
+
+    override_path = write_config(tmp_path, "override.json", dict(OVERRIDE_CONFIG, top="rejected"))
+    os.utime(override_path, ns=(0, os.stat(override_path).st_mtime_ns + 1000000000))
+
+    def validate_configuration(reloaded_configuration):
+        if reloaded_configuration.get_config_value("top") == "rejected":
+            raise ValueError("rejected")
+
+    assert configuration.reload_if_changed(validate_configuration) == set()
+    assert configuration.get_config_value("top") == "override"
@@ -0,0 +1,94 @@
+import json
+import logging
+import sys
+import time
+
+import pytest
+
+from util.log_setup import DeferredQueueHandler, JsonLogFormatter, get_logger_with_name, set_log_format
+
+
+# Returns a record of a message logged with the arguments, as a logger would create it
+def create_record(message, *args):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, message, args, None)
+
+
+# Returns the lines of the file once it has the given number of them, waiting for the writer thread
+def read_log_lines(log_path, line_count):
+    for _ in range(100):
+        if log_path.exists() and len(log_path.read_text().splitlines()) >= line_count:
+            break
+        time.sleep(0.05)
+    return log_path.read_text().splitlines()
+
+
+# Messages with only immutable arguments are handed to the writer thread unformatted
+def test_immutable_arguments_are_formatted_later():
+    record = DeferredQueueHandler(None).prepare(create_record("Found %d results for %s", 3, "praw"))
+
+    assert (record.msg, record.args) == ("Found %d results for %s", (3, "praw"))
+    assert record.getMessage() == "Found 3 results for praw"
+
+
+# Messages with an argument that could change before they're written are formatted right away
+@pytest.mark.parametrize("args", [(["praw"],), ({"search": "praw"},), ("praw", {"limit": 100})])
+def test_mutable_arguments_are_formatted_now(args):
+    record = create_record(" ".join(["%s"] * len(args)), *args)
+    expected_message = record.getMessage()
+    record = DeferredQueueHandler(None).prepare(record)
+
+    assert (record.msg, record.args) == (expected_message, None)
+
+
+# Each record is one JSON object, with the traceback of an exception logged along with it
+def test_json_formatter():
+    record = create_record("Found %d results", 3)
+    log_dict = json.loads(JsonLogFormatter().format(record))
+
+    assert {key: log_dict[key] for key in ["logger", "level", "message"]} == {"logger": "test", "level": "INFO",
+                                                                                "message": "Found 3 results"}
+    assert "exception" not in log_dict
+
+    try:
+        raise ValueError("Bad search")
+    except ValueError:
+        record.exc_info = sys.exc_info()
+    assert "ValueError: Bad search" in json.loads(JsonLogFormatter().format(record))["exception"]
+
+
+def test_set_log_format_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        set_log_format("xml")
+
+
+# A list logged and then changed is written as it was when it was logged, from the writer thread, in the chosen format
+def test_file_logging(tmp_path):
+    log_path = tmp_path / "search.log"
+    logger = get_logger_with_name("LogSetupTest", "CRITICAL", str(log_path), "INFO")
+    search_list = ["praw"]
+    logger.info("Searching for %s", search_list)
+    search_list.append("asyncio")
+    logger.debug("Not written at the INFO level")
+    assert read_log_lines(log_path, 1)[0].endswith("[LogSetupTest][INFO]: Searching for ['praw']")
+
+    set_log_format("json")
+    try:
+        logger.warning("Written as JSON")
+        assert json.loads(read_log_lines(log_path, 2)[1])["message"] == "Written as JSON"
+    finally:
+        set_log_format("text")
+    assert len(read_log_lines(log_path, 2)) == 2
+
+
+# A logger asked for again with the same settings is left as it is, and only set up again when they change
+def test_loggers_are_configured_once(tmp_path):
+    logger = get_logger_with_name("LogSetupReuseTest", "WARNING")
+    queue_handler = logger.handlers[0]
+
+    assert get_logger_with_name("LogSetupReuseTest", "WARNING").handlers == [queue_handler]
+    assert not logger.propagate
+    assert logger.level == logging.WARNING
+    get_logger_with_name("LogSetupReuseTest", "WARNING", str(tmp_path / "search.log"), "DEBUG")
+    assert len(logger.handlers) == 1
+    assert logger.handlers[0] is not queue_handler
+    assert logger.level == logging.DEBUG
@@ -0,0 +1,89 @@
+import urllib.request
+
+import pytest
+
+from util.metrics import (PROMETHEUS_CONTENT_TYPE, Counter, Gauge, Histogram, MetricsRegistry, MetricsServer,
+                          escape_label_value, format_labels, format_value)
+
+
+def test_escape_label_value():
+    assert escape_label_value('C:\\path "quoted"\nnext') == 'C:\\\\path \\"quoted\\"\\nnext'
+    assert escape_label_value(5) == "5"
+
+
+def test_format_labels():
+    assert format_labels((), ()) == ""
+    assert format_labels(("search",), ('Say "hi"',)) == '{search="Say \\"hi\\""}'
+    assert format_labels(("search",), ("A",), [("le", "+Inf")]) == '{search="A",le="+Inf"}'
+
+
+def test_format_value():
+    assert format_value(3) == "3.0"
+    assert format_value(0.25) == "0.25"
+    assert format_value(float("inf")) == "+Inf"
+
+
+# Samples are rendered sorted by their label values, after the HELP and TYPE comments
+def test_counter_render():
+    counter = Counter("results_total", "Results found", ["search"])
+    counter.inc(search="B")
+    counter.inc(2, search="A")
+    counter.inc(search="A")
+
+    assert counter.get(search="A") == 3
+    assert counter.get(search="C") is None
+    assert counter.render() == "\n".join(["# HELP results_total Results found", "# TYPE results_total counter",
+                                          'results_total{search="A"} 3.0', 'results_total{search="B"} 1.0'])
+
+
+# Every label has to be given, and no others
+@pytest.mark.parametrize("label_dict", [{}, {"other": "A"}, {"search": "A", "other": "B"}])
+def test_labels_must_match(label_dict):
+    with pytest.raises(ValueError):
+        Gauge("interval_seconds", "Interval", ["search"]).set(1, **label_dict)
+
+
+# Buckets are cumulative, always end with +Inf, and are followed by the sum and count
+def test_histogram_render():
+    histogram = Histogram("duration_seconds", "Duration", buckets=[1, 0.5])
+    for value in [0.1, 0.5, 0.7, 5]:
+        histogram.observe(value)
+
+    assert histogram.get_totals() == (4, 6.3)
+    assert histogram.render().split("\n")[2:] == ['duration_seconds_bucket{le="0.5"} 2',
+                                                  'duration_seconds_bucket{le="1.0"} 3',
+                                                  'duration_seconds_bucket{le="+Inf"} 4',
+                                                  "duration_seconds_sum 6.3", "duration_seconds_count 4"]
+
+
+# A timed block is observed even if it raises
+def test_histogram_time_observes_failures():
+    histogram = Histogram("duration_seconds", "Duration", ["stage"])
+    with pytest.raises(RuntimeError):
+        with histogram.time(stage="search"):
+            raise RuntimeError()
+
+    assert histogram.get_totals(stage="search")[0] == 1
+
+
+def test_registry_write_textfile(tmp_path):
+    registry = MetricsRegistry()
+    registry.register(Gauge("last_cycle_seconds", "Last cycle")).set(1.5)
+    registry.write_textfile(str(tmp_path / "metrics.prom"))
+
+    assert (tmp_path / "metrics.prom").read_text() == registry.render()
+    assert registry.render().endswith("last_cycle_seconds 1.5\n")
+    assert [path.name for path in tmp_path.iterdir()] == ["metrics.prom"]
+
+
+def test_metrics_server():
+    registry = MetricsRegistry()
+    registry.register(Counter("emails_sent_total", "Emails sent")).inc()
+    metrics_server = MetricsServer(registry, "127.0.0.1", 0)
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(metrics_server.get_port()),
+                                    timeout=10) as response:
+            assert response.headers["Content-Type"] == PROMETHEUS_CONTENT_TYPE
+            assert response.read().decode("utf-8") == registry.render()
+    finally:
+        metrics_server.shutdown()
@@ -0,0 +1,121 @@
+import argparse
+import time
+
+import prawcore
+import pytest
+import requests
+
+from util.reddit_clients import DEFAULT_THROTTLE_SECONDS, NoRedditCredentialsError, RedditClientPool
+
+
+# Returns a requests Response with the status code and headers, for building prawcore exceptions
+def create_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = b""
+    return response
+
+
+# Returns a pool of the given number of credentials whose Reddit instances report the rate limits in limits_dict,
+# keyed by slot index, instead of being created with PRAW
+def create_pool(monkeypatch, credential_count, limits_dict=None):
+    pool = RedditClientPool([("client{}".format(slot_index), "secret") for slot_index in range(credential_count)],
+                            "test", "WARNING")
+    limits_dict = limits_dict or {}
+    monkeypatch.setattr(pool, "get_reddit", lambda slot_index: argparse.Namespace(
+        auth=argparse.Namespace(limits=limits_dict.get(slot_index, {}))))
+    return pool
+
+
+# Returns the number of searches using each credential
+def get_in_flight_list(pool):
+    return [in_flight for credential_name, remaining, in_flight, revoked in pool.get_status()]
+
+
+# Searches are spread over the credentials, and released credentials are free again
+def test_acquire_spreads_searches_over_credentials(monkeypatch):
+    pool = create_pool(monkeypatch, 2)
+
+    assert sorted([pool.acquire(), pool.acquire()]) == [0, 1]
+    assert get_in_flight_list(pool) == [1, 1]
+    pool.release(0)
+    pool.release(1)
+    assert get_in_flight_list(pool) == [0, 0]
+
+
+# The credential with the most requests left in its rate limit window is picked
+def test_acquire_prefers_the_largest_remaining_budget(monkeypatch):
+    reset_timestamp = time.time() + 600
+    pool = create_pool(monkeypatch, 2, {0: {"remaining": 5, "reset_timestamp": reset_timestamp},
+                                        1: {"remaining": 100, "reset_timestamp": reset_timestamp}})
+    pool.release(pool.acquire())
+    pool.release(pool.acquire())
+
+    assert [pool.acquire() for _ in range(3)] == [1, 1, 1]
+
+
+# A credential throttled with a retry-after header isn't used until it has waited that long
+def test_too_many_requests_rests_the_credential_for_retry_after(monkeypatch):
+    pool = create_pool(monkeypatch, 2)
+    slot_index = pool.acquire()
+    pool.release(slot_index, prawcore.exceptions.TooManyRequests(create_response(429, {"retry-after": "600"})))
+
+    assert [pool.acquire() for _ in range(3)] == [1 - slot_index] * 3
+
+
+def test_acquire_waits_for_a_throttled_credential(monkeypatch):
+    pool = create_pool(monkeypatch, 1)
+    pool.release(pool.acquire(), prawcore.exceptions.TooManyRequests(create_response(429, {"retry-after": "0.2"})))
+    start_time = time.time()
+
+    assert pool.acquire() == 0
+    assert time.time() - start_time >= 0.15
+
+
+# Without a retry-after header, the credential is rested for the default time
+def test_too_many_requests_without_retry_after_uses_the_default(monkeypatch):
+    pool = create_pool(monkeypatch, 1)
+    pool.release(pool.acquire(), prawcore.exceptions.TooManyRequests(create_response(429)))
+    # Record how long acquire would wait, and end the throttle instead of waiting
+    sleep_list = []
+    monkeypatch.setattr(time, "sleep", lambda seconds: (sleep_list.append(seconds),
+                                                        pool._slot_list[0].update(throttled_until=0)))
+
+    assert pool.acquire() == 0
+    assert DEFAULT_THROTTLE_SECONDS - 5 < sleep_list[0] <= DEFAULT_THROTTLE_SECONDS
+
+
+# Rejected credentials are dropped, and once every one is, acquire fails rather than waiting
+def test_rejected_credentials_are_dropped(monkeypatch):
+    pool = create_pool(monkeypatch, 2)
+    pool.release(pool.acquire(), prawcore.exceptions.InvalidToken(create_response(401)))
+
+    assert pool.get_usable_count() == 1
+    slot_index = pool.acquire()
+    pool.release(slot_index, prawcore.exceptions.ResponseException(create_response(401)))
+    assert pool.get_usable_count() == 0
+    with pytest.raises(NoRedditCredentialsError):
+        pool.acquire()
+
+
+# A search that failed for some other reason doesn't count against its credential
+def test_other_failures_keep_the_credential(monkeypatch):
+    pool = create_pool(monkeypatch, 1)
+    pool.release(pool.acquire(), prawcore.exceptions.ServerError(create_response(500)))
+
+    assert pool.get_usable_count() == 1
+    assert pool.acquire() == 0
+
+
+@pytest.mark.parametrize("exception, fails_over", [
+    (prawcore.exceptions.TooManyRequests(create_response(429)), True),
+    (prawcore.exceptions.InvalidToken(create_response(401)), True),
+    (prawcore.exceptions.OAuthException(create_response(400), "invalid_grant"), True),
+    (prawcore.exceptions.ResponseException(create_response(401)), True),
+    (prawcore.exceptions.ResponseException(create_response(404)), False),
+    (prawcore.exceptions.ServerError(create_response(500)), False),
+    (ValueError(), False),
+])
+def test_should_fail_over(monkeypatch, exception, fails_over):
+    assert create_pool(monkeypatch, 1).should_fail_over(exception) == fails_over
@@ -0,0 +1,139 @@
+from util.search_planner import (MAX_REDDIT_QUERY_LENGTH, get_batched_queries, get_search_groups, get_shard_index,
+                                  get_shard_queries, get_unbatched_queries, normalize_search_string,
+                                  normalize_subreddits, plan_searches)
+
+
+def create_search(search_name, subreddits, search_params, email_recipient=None):
+    search_dict = {"search_name": search_name, "subreddits": subreddits, "search_params": search_params}
+    if email_recipient is not None:
+        search_dict["email_recipient"] = email_recipient
+    return search_dict
+
+
+def test_normalize_subreddits_is_order_and_case_insensitive():
+    assert normalize_subreddits("b+A") == normalize_subreddits("a+b") == "a+b"
+    assert normalize_subreddits(" python + Python ") == "python"
+
+
+def test_normalize_search_string_collapses_whitespace():
+    assert normalize_search_string("  title:praw   AND  python ") == "title:praw AND python"
+
+
+# Searches making the same Reddit query share one entry, fanned out to every recipient and search name
+def test_identical_searches_are_coalesced():
+    query_dict = plan_searches([create_search("A", "python+learnpython", "title:praw"),
+                                create_search("B", "LearnPython+python", "title:praw  ", "b@example.com"),
+                                create_search("C", "python", "title:praw")], "default@example.com")
+
+    assert query_dict == {("learnpython+python", "title:praw"): [("default@example.com", "A"),
+                                                                 ("b@example.com", "B")],
+                          ("python", "title:praw"): [("default@example.com", "C")]}
+
+
+def test_planned_queries_keep_config_order():
+    query_dict = plan_searches([create_search("B", "b", "two"), create_search("A", "a", "one"),
+                                create_search("C", "b", "two")], "default@example.com")
+
+    assert list(query_dict.keys()) == [("b", "two"), ("a", "one")]
+
+
+# Queries on the same subreddits are combined with OR, and matched back to their searches locally
+def test_batched_queries_combine_with_or():
+    query_dict = plan_searches([create_search("A", "python", "title:praw"), create_search("B", "python", "asyncio"),
+                                create_search("C", "rust", "tokio")], "default@example.com")
+
+    batch_list = get_batched_queries(query_dict)
+
+    assert [(subreddits, search_string) for subreddits, search_string, search_members in batch_list] == [
+        ("python", "(title:praw) OR (asyncio)"), ("rust", "tokio")]
+    python_members = batch_list[0][2]
+    assert [search_targets for query_node, search_targets in python_members] == [[("default@example.com", "A")],
+                                                                                 [("default@example.com", "B")]]
+    assert all(query_node is not None for query_node, search_targets in python_members)
+    assert batch_list[1][2] == [(None, [("default@example.com", "C")])]
+
+
+# Every batch stays under the query length limit, and every query ends up in exactly one batch
+def test_batched_queries_respect_max_length():
+    search_list = [create_search("search {}".format(index), "python", "title:keyword{:03d}".format(index))
+                   for index in range(100)]
+    query_dict = plan_searches(search_list, "default@example.com")
+
+    batch_list = get_batched_queries(query_dict)
+
+    assert len(batch_list) > 1
+    assert all(len(search_string) <= MAX_REDDIT_QUERY_LENGTH for subreddits, search_string, members in batch_list)
+    batched_names = [search_name for subreddits, search_string, search_members in batch_list
+                     for query_node, search_targets in search_members
+                     for email_recipient, search_name in search_targets]
+    assert sorted(batched_names) == sorted(search_dict["search_name"] for search_dict in search_list)
+
+
+# A query too long to combine with anything still runs, on its own
+def test_batched_query_longer_than_limit_runs_alone():
+    long_search_string = " ".join("word{}".format(index) for index in range(120))
+    query_dict = plan_searches([create_search("A", "python", "short"), create_search("B", "python",
+                                                                                     long_search_string)],
+                               "default@example.com")
+
+    batch_list = get_batched_queries(query_dict)
+
+    assert [search_string for subreddits, search_string, search_members in batch_list] == ["short",
+                                                                                           long_search_string]
+
+
+# Queries that can't be matched locally, or that don't require any term, aren't batched
+def test_unmatchable_queries_are_not_batched():
+    query_dict = plan_searches([create_search("A", "python", "praw"), create_search("B", "python", "author:spez"),
+                                create_search("C", "python", "NOT java"), create_search("D", "python", "asyncio")],
+                               "default@example.com")
+
+    batch_list = get_batched_queries(query_dict)
+
+    assert sorted(search_string for subreddits, search_string, search_members in batch_list) == [
+        "(praw) OR (asyncio)", "NOT java", "author:spez"]
+
+
+def test_unbatched_queries_run_one_query_each():
+    query_dict = plan_searches([create_search("A", "python", "praw"), create_search("B", "python", "asyncio")],
+                               "default@example.com")
+
+    assert get_unbatched_queries(query_dict) == [("python", "praw", [(None, [("default@example.com", "A")])]),
+                                                 ("python", "asyncio", [(None, [("default@example.com", "B")])])]
+
+
+# Searches sharing a query or a batch are grouped, as are queries joined by a search name they share
+def test_search_groups_follow_queries_and_batches():
+    query_dict = plan_searches([create_search("A", "python", "praw"), create_search("B", "python", "praw"),
+                                create_search("C", "python", "asyncio"), create_search("D", "rust", "tokio"),
+                                create_search("E", "go", "goroutine"), create_search("D", "go", "channels")],
+                               "default@example.com")
+
+    assert sorted(get_search_groups(get_unbatched_queries(query_dict))) == [["A", "B"], ["C"], ["D"], ["E"]]
+    assert sorted(get_search_groups(get_batched_queries(query_dict))) == [["A", "B", "C"], ["D", "E"]]
+
+
+def create_query_dict(query_count):
+    return plan_searches([create_search("Search {}".format(search_index), "sub{}".format(search_index % 7),
+                                        "term{}".format(search_index)) for search_index in range(query_count)],
+                         "default@example.com")
+
+
+# Every query is run by exactly one shard, the same one every time
+def test_shard_queries_partition_the_plan():
+    query_dict = create_query_dict(60)
+    shard_dict_list = [get_shard_queries(query_dict, shard_index, 3) for shard_index in range(3)]
+
+    assert sum(len(shard_dict) for shard_dict in shard_dict_list) == len(query_dict)
+    assert {query_key for shard_dict in shard_dict_list for query_key in shard_dict} == set(query_dict)
+    assert all(len(shard_dict) > 0 for shard_dict in shard_dict_list)
+    assert shard_dict_list == [get_shard_queries(query_dict, shard_index, 3) for shard_index in range(3)]
+
+
+# Going from three shards to two only moves the queries of the removed shard
+def test_removing_a_shard_only_moves_its_queries():
+    query_dict = create_query_dict(60)
+
+    for query_key in query_dict:
+        if get_shard_index(query_key, 3) != 2:
+            assert get_shard_index(query_key, 2) == get_shard_index(query_key, 3)
@@ -0,0 +1,59 @@
+import pytest
+
+from util.search_query import (SearchQueryError, get_required_terms, match_search_query, normalize_text,
+                               parse_search_query, tokenize_search_query)
+
+
+# Returns whether the search string matches a submission with the given title and selftext
+def matches(search_string, title, selftext=""):
+    return match_search_query(parse_search_query(search_string), normalize_text(title), normalize_text(selftext))
+
+
+def test_normalize_text_pads_lowercase_words():
+    assert normalize_text("Hello, World!  PRAW-8") == " hello world praw 8 "
+
+
+def test_tokenize_search_query():
+    assert tokenize_search_query('title:PRAW AND ("exact match" OR NOT python)') == [
+        ("term", "title", " praw "), ("operator", "AND"), ("paren", "("), ("term", None, " exact match "),
+        ("operator", "OR"), ("operator", "NOT"), ("term", None, " python "), ("paren", ")")]
+
+
+# OR binds looser than AND, which binds looser than NOT, and adjacent terms are ANDed
+def test_parse_precedence():
+    assert parse_search_query("a b OR NOT c AND d") == (
+        "or", [("and", [("term", None, " a "), ("term", None, " b ")]),
+               ("and", [("not", ("term", None, " c ")), ("term", None, " d ")])])
+
+
+@pytest.mark.parametrize("search_string", ["author:spez", "-python", "(python", "python)", "python OR", '"!!"',
+                                           "AND"])
+def test_unsupported_syntax_raises(search_string):
+    with pytest.raises(SearchQueryError):
+        parse_search_query(search_string)
+
+
+@pytest.mark.parametrize("search_string, title, selftext, expected", [
+    ("python", "Learning Python", "", True),
+    ("python", "Learning", "some python code", True),
+    ("title:python", "Learning", "some python code", False),
+    ("selftext:python", "Python", "", False),
+    ('"web scraping"', "Web-scraping with PRAW", "", True),
+    ('"web scraping"', "scraping the web", "", False),
+    ("praw AND python", "PRAW for Python", "", True),
+    ("praw python", "PRAW", "", False),
+    ("praw OR python", "python", "", True),
+    ("python NOT snake", "python snake", "", False),
+    ("py", "python", "", False),
+])
+def test_match_search_query(search_string, title, selftext, expected):
+    assert matches(search_string, title, selftext) == expected
+
+
+# A query that can match without any of its terms, like one with a top level NOT, has no required terms
+def test_get_required_terms():
+    assert get_required_terms(parse_search_query("title:praw python")) == [("title", " praw ")]
+    assert get_required_terms(parse_search_query("praw OR python")) == [(None, " praw "), (None, " python ")]
+    assert get_required_terms(parse_search_query("NOT python")) is None
+    assert get_required_terms(parse_search_query("praw OR NOT python")) is None
+    assert get_required_terms(parse_search_query("praw NOT python")) == [(None, " praw ")]
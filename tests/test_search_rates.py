@@ -0,0 +1,75 @@
+import pytest
+
+from util.search_rates import SECONDS_PER_DAY, SearchRateStore
+
+# Settings as passed by get_search_intervals: a 30 minute default kept between 5 minutes and a day, aiming for one
+# new result a run
+INTERVAL_SETTINGS = (30 * 60, 5 * 60, SECONDS_PER_DAY, 1)
+NO_DECAY_HALF_LIFE_SECONDS = 10 ** 12
+
+
+# Returns a store with the search recorded as having run at each of the (start time, new result count) pairs
+def create_store(tmp_path, run_list, half_life_seconds=NO_DECAY_HALF_LIFE_SECONDS):
+    search_rates = SearchRateStore(str(tmp_path / "search_rates.json"), "WARNING")
+    for run_started_utc, new_result_count in run_list:
+        search_rates.record_run("Search", new_result_count, run_started_utc, half_life_seconds)
+    return search_rates
+
+
+# A search without history is polled at the default interval, and its first run only marks the time
+def test_search_without_history_uses_the_default(tmp_path):
+    search_rates = create_store(tmp_path, [(1000.0, 50)])
+
+    assert search_rates.get_daily_rate("Search") is None
+    assert search_rates.get_interval("Search", *INTERVAL_SETTINGS) == 30 * 60
+    assert search_rates.get_interval("Other", *INTERVAL_SETTINGS) == 30 * 60
+
+
+# An interval that would find the target number of results is used when it's between the minimum and maximum
+def test_interval_follows_the_result_rate(tmp_path):
+    search_rates = create_store(tmp_path, [(0.0, 0), (3 * 60 * 60, 3)])
+
+    assert search_rates.get_daily_rate("Search") == 24
+    # (3 hours + the 30 minute default) over (3 results + the 1 result target)
+    assert search_rates.get_interval("Search", *INTERVAL_SETTINGS) == pytest.approx(210 * 60 / 4)
+
+
+# Busy searches are polled no more often than the minimum, and quiet ones no less often than the maximum
+@pytest.mark.parametrize("run_list, interval_seconds", [([(0.0, 0), (3600.0, 100)], 5 * 60),
+                                                        ([(0.0, 0), (30 * SECONDS_PER_DAY, 0)], SECONDS_PER_DAY)])
+def test_interval_is_clamped(tmp_path, run_list, interval_seconds):
+    assert create_store(tmp_path, run_list).get_interval("Search", *INTERVAL_SETTINGS) == interval_seconds
+
+
+# Older history counts for half as much every half-life
+def test_history_decays(tmp_path):
+    search_rates = create_store(tmp_path, [(0.0, 0), (3600.0, 10), (7200.0, 0)], half_life_seconds=3600)
+
+    # 10 * 0.5 results over 3600 * 0.5 + 3600 seconds
+    assert search_rates.get_daily_rate("Search") == pytest.approx(5 / 5400 * SECONDS_PER_DAY)
+
+
+# A run recorded out of order only moves the last run time, rather than counting negative time
+def test_out_of_order_run_is_ignored(tmp_path):
+    search_rates = create_store(tmp_path, [(0.0, 0), (3600.0, 2), (1800.0, 5)])
+
+    assert search_rates.get_daily_rate("Search") == 48
+
+
+# Saved history is loaded by the next store, without the searches that are no longer configured
+def test_history_is_saved_and_pruned(tmp_path):
+    search_rates = create_store(tmp_path, [(0.0, 0), (3600.0, 2)])
+    search_rates.record_run("Removed", 1, 0.0, NO_DECAY_HALF_LIFE_SECONDS)
+    search_rates.remove_other_searches(["Search"])
+    search_rates.save()
+    loaded_search_rates = SearchRateStore(str(tmp_path / "search_rates.json"), "WARNING")
+
+    assert loaded_search_rates.get_daily_rate("Search") == 48
+    assert loaded_search_rates.get_interval("Removed", *INTERVAL_SETTINGS) == 30 * 60
+
+
+# A corrupted history file only sends every search back to the default interval
+def test_corrupted_history_is_ignored(tmp_path):
+    (tmp_path / "search_rates.json").write_text("{not json")
+
+    assert SearchRateStore(str(tmp_path / "search_rates.json"), "WARNING").get_daily_rate("Search") is None
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import time
+
+import pytest
+
+import search_runner
+from search_runner import SearchAndEmailExecutor, get_dedupe_max_age_days
+from util import metrics
+from util.json_config_parser import JsonConfig
+from util.search_rates import SearchRateStore
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   "default_base_config.json")
+
+
+# Returns a JsonConfig of the given settings over the default config
+def create_configuration(tmp_path, config_dict):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(config_dict))
+    return JsonConfig([str(config_path), DEFAULT_CONFIG_PATH])
+
+
+@pytest.mark.parametrize("dedupe_params, max_age_days", [({}, 14), ({"max_age_days": 30}, 30),
+                                                         ({"max_age_days": 0}, None), ({"max_age_days": None}, None),
+                                                         ({"backend": "sqlite"}, 14)])
+def test_dedupe_max_age_days(tmp_path, dedupe_params, max_age_days):
+    configuration = create_configuration(tmp_path, {"dedupe_settings": [dedupe_params]})
+
+    assert get_dedupe_max_age_days(configuration) == max_age_days
+
+
+def test_dedupe_max_age_days_rejects_negative(tmp_path):
+    configuration = create_configuration(tmp_path, {"dedupe_settings": [{"max_age_days": -1}]})
+
+    with pytest.raises(ValueError):
+        get_dedupe_max_age_days(configuration)
+
+
+# Returns an executor for the configuration, keeping its state in the temporary directory. Keyword arguments override
+# the command line arguments
+def create_executor(tmp_path, configuration, **cli_arg_dict):
+    cli_args = argparse.Namespace(**dict(dict(config=None, skipdedupe=False, onerun=False, stream=False, profile=None,
+                                              shard=None, dryrun=False), **cli_arg_dict))
+    return SearchAndEmailExecutor(cli_args, configuration, str(tmp_path))
+
+
+# Settings that are only read on startup are reported when a reload changes them, rather than silently ignored
+def test_reload_warns_about_settings_needing_restart(tmp_path, monkeypatch):
+    configuration = create_configuration(tmp_path, {"metrics_settings": [{"http_port": 0}]})
+    executor = create_executor(tmp_path, configuration)
+    warning_list = []
+    monkeypatch.setattr(executor._logger_instance, "warning",
+                        lambda message, *args: warning_list.append(message % args))
+
+    (tmp_path / "config.json").write_text(json.dumps({"metrics_settings": [{"http_port": 9100}],
+                                                      "search_concurrency": 2}))
+    os.utime(tmp_path / "config.json", (time.time() + 10, time.time() + 10))
+    changed_key_set = executor.reload_configuration()
+
+    assert changed_key_set == {"metrics_settings", "search_concurrency"}
+    assert warning_list == ["Changes to [metrics_settings] only take effect after a restart"]
+
+
+# Raised by the stub stream to end a test's stream loop
+class StreamStoppedError(Exception):
+    pass
+
+
+# Stands in for RedditClientPool, counting each credential's reservations. Reddit instances search for the submissions in
+# submission_list. They stream nothing for a few polls from the first credential ID, while streams from any other are
+# stopped with StreamStoppedError
+class StubRedditClientPool:
+
+    def acquire(self):
+        # The last credential, so releasing it to a pool with fewer credentials fails
+        slot_index = len(self.in_flight_list) - 1
+        self.in_flight_list[slot_index] += 1
+        return slot_index
+
+    def release(self, slot_index, exception=None):
+        self.in_flight_list[slot_index] -= 1
+
+    def get_usable_count(self):
+        return len(self.in_flight_list)
+
+    def get_reddit(self, slot_index):
+        def search(search_string, sort, time_filter):
+            self.search_list.append(search_string)
+            return self.submission_list
+
+        def get_submissions(pause_after, skip_existing):
+            if self.credential_list[0][0] != "first":
+                raise StreamStoppedError()
+            for _ in range(3):
+                yield None
+            raise AssertionError("The stream wasn't restarted")
+        stream = argparse.Namespace(submissions=get_submissions)
+        return argparse.Namespace(subreddit=lambda subreddits: argparse.Namespace(stream=stream, search=search))
+
+    def __init__(self, credential_list, *args, **kwargs):
+        self.credential_list = list(credential_list)
+        self.in_flight_list = [0] * len(self.credential_list)
+        # Submissions every search returns, and the search strings searched for
+        self.submission_list = []
+        self.search_list = []
+
+
+# A reload that changes the Reddit credentials restarts the stream on the new clients, with the credential it was
+# streaming on released to the old ones
+def test_stream_restarts_when_credentials_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_runner, "RedditClientPool", StubRedditClientPool)
+    search_list = [{"search_name": "A", "subreddits": "python", "search_params": "praw"}]
+    configuration = create_configuration(tmp_path, {"searches": search_list, "praw_credentials": [
+        {"client_id": "first", "client_secret": "secret"}, {"client_id": "first", "client_secret": "secret"}]})
+    executor = create_executor(tmp_path, configuration)
+    executor._cli_args.skipdedupe = True
+    executor.initialize_praw()
+    old_reddit_clients = executor._reddit_clients
+
+    (tmp_path / "config.json").write_text(json.dumps({"searches": search_list, "praw_credentials": [
+        {"client_id": "second", "client_secret": "secret"}]}))
+    os.utime(tmp_path / "config.json", (time.time() + 10, time.time() + 10))
+    with pytest.raises(StreamStoppedError):
+        search_runner.stream_loop(executor, executor._logger_instance, 0)
+
+    assert old_reddit_clients.in_flight_list == [0, 0]
+    assert executor._reddit_clients is not old_reddit_clients
+    assert executor._reddit_clients.in_flight_list == [0]
+
+
+# Returns a stand-in for a PRAW submission
+def create_submission(submission_id, title):
+    return argparse.Namespace(id=submission_id, title=title, selftext="", permalink="/r/python/" + submission_id,
+                              url="https://example.com/" + submission_id, created_utc=time.time(),
+                              subreddit=argparse.Namespace(display_name="python"))
+
+
+# Coalesced and batched searches are run as one Reddit query, but each search's metrics are kept under its own name,
+# counting the results it matched
+def test_search_metrics_are_labeled_per_search(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_runner, "RedditClientPool", StubRedditClientPool)
+    configuration = create_configuration(tmp_path, {"search_batching": "or", "searches": [
+        {"search_name": "Metrics A", "subreddits": "python", "search_params": "praw"},
+        {"search_name": "Metrics B", "subreddits": "python", "search_params": "praw"},
+        {"search_name": "Metrics C", "subreddits": "python", "search_params": "asyncio"}]})
+    executor = create_executor(tmp_path, configuration)
+    executor._cli_args.skipdedupe = True
+    executor.initialize_praw()
+    executor._reddit_clients.submission_list = [create_submission("s1", "praw tips"),
+                                                create_submission("s2", "asyncio guide"),
+                                                create_submission("s3", "praw with asyncio")]
+    search_name_list = ["Metrics A", "Metrics B", "Metrics C"]
+    duration_count_list = [metrics.SEARCH_DURATION_SECONDS.get_totals(search=search_name)[0]
+                           for search_name in search_name_list]
+    executor.execute_searches()
+
+    assert len(executor._reddit_clients.search_list) == 1
+    assert [metrics.SEARCH_RESULTS_TOTAL.get(search=search_name) for search_name in search_name_list] == [2, 2, 2]
+    assert [metrics.SEARCH_DURATION_SECONDS.get_totals(search=search_name)[0] - duration_count
+            for search_name, duration_count in zip(search_name_list, duration_count_list)] == [1, 1, 1]
+    assert metrics.SEARCH_RESULTS_TOTAL.get(search="Metrics A, Metrics B, Metrics C") is None
+
+
+# New results are spooled in the dedupe transaction, and a spooled email the SMTP server refuses stays spooled until
+# a later flush sends it
+def test_spooled_results_are_retried_until_sent(tmp_path, monkeypatch, email_tools, smtp_handler):
+    monkeypatch.setattr(search_runner, "RedditClientPool", StubRedditClientPool)
+    configuration = create_configuration(tmp_path, {
+        "searches": [{"search_name": "Spooled", "subreddits": "python", "search_params": "praw"}],
+        "dedupe_settings": [{"backend": "sqlite"}],
+        "email_spool_settings": [{"mode": "spool", "retry_base_seconds": 0.2}]})
+    executor = create_executor(tmp_path, configuration)
+    executor._email_tools = email_tools
+    executor.initialize_praw()
+    executor._reddit_clients.submission_list = [create_submission("s1", "praw tips")]
+    smtp_handler.reject_count = 1
+
+    assert executor.execute_searches() == 1
+    executor.flush_email_spool()
+    assert executor._email_spool.get_pending_count() == 1
+    assert smtp_handler.message_list == []
+
+    time.sleep(0.3)
+    # The submission was recorded as seen along with the spooled email, so it isn't spooled again
+    assert executor.execute_searches() == 0
+    executor.flush_email_spool()
+    assert executor._email_spool.get_pending_count() == 0
+    assert len(smtp_handler.message_list) == 1
+
+
+# Returns the contents of every file under the directory, keyed by path
+def read_directory(directory_path):
+    return {str(file_path): file_path.read_bytes() for file_path in sorted(directory_path.rglob("*"))
+            if file_path.is_file()}
+
+
+# A dry run after a real one (--dryrun --onerun) finds and renders the new results, but leaves the state directory as
+# it was and sends nothing
+def test_dry_run_writes_and_sends_nothing(tmp_path, monkeypatch, email_tools, smtp_handler):
+    monkeypatch.setattr(search_runner, "RedditClientPool", StubRedditClientPool)
+    configuration = create_configuration(tmp_path, {
+        "searches": [{"search_name": "Dry", "subreddits": "python", "search_params": "praw"}],
+        "dedupe_settings": [{"backend": "sqlite"}],
+        "email_spool_settings": [{"mode": "spool"}],
+        "http_cache_settings": [{"mode": "cache"}]})
+    executor = create_executor(tmp_path, configuration)
+    executor._email_tools = email_tools
+    executor.initialize_praw()
+    executor._reddit_clients.submission_list = [create_submission("s1", "praw tips")]
+    executor.execute_searches()
+    executor.flush_email_spool()
+    assert len(smtp_handler.message_list) == 1
+    directory_dict = read_directory(tmp_path)
+
+    dry_run_executor = create_executor(tmp_path, configuration, dryrun=True, onerun=True)
+    dry_run_executor.initialize_praw()
+    dry_run_executor._reddit_clients.submission_list = [create_submission("s1", "praw tips"),
+                                                        create_submission("s2", "more praw tips")]
+    assert dry_run_executor.execute_searches() == 1
+
+    assert "Dry" in dry_run_executor.get_dry_run_report()
+    assert read_directory(tmp_path) == directory_dict
+    assert len(smtp_handler.message_list) == 1
+
+
+# In the adaptive mode, searches are polled at the interval learned from their history, kept within the configured
+# bounds, unless they set their own search_interval_minutes
+def test_adaptive_search_intervals(tmp_path):
+    configuration = create_configuration(tmp_path, {
+        "search_interval_mode": "adaptive", "search_interval_minutes": 30,
+        "adaptive_interval_settings": [{"min_interval_minutes": 10, "max_interval_minutes": 120}],
+        "searches": [{"search_name": "Busy", "subreddits": "a", "search_params": "x"},
+                     {"search_name": "Quiet", "subreddits": "a", "search_params": "y"},
+                     {"search_name": "Fixed", "subreddits": "a", "search_params": "z", "search_interval_minutes": 1}]})
+    search_rates = SearchRateStore(str(tmp_path / "search_rates.json"), "WARNING")
+    for search_name, new_result_count in [("Busy", 1000), ("Quiet", 0), ("Fixed", 1000)]:
+        search_rates.record_run(search_name, 0, 0.0, 3600)
+        search_rates.record_run(search_name, new_result_count, 86400.0, 3600)
+
+    assert search_runner.get_search_intervals(configuration, search_rates) == {"Busy": 600, "Quiet": 7200,
+                                                                               "Fixed": 60}
+
+
+def test_adaptive_interval_settings_reject_min_over_max(tmp_path):
+    configuration = create_configuration(tmp_path, {"adaptive_interval_settings": [
+        {"min_interval_minutes": 60, "max_interval_minutes": 30}]})
+
+    with pytest.raises(ValueError):
+        search_runner.get_adaptive_interval_settings(configuration)
+
+
+# Digest settings are read in minutes, with searches sharing a name using the shortest of their intervals
+def test_get_digest_policy(tmp_path):
+    configuration = create_configuration(tmp_path, {
+        "digest_settings": [{"digest_interval_minutes": 10, "max_emails_per_hour": 4}],
+        "digest_recipients": [{"email_recipient": "slow@example.com", "digest_interval_minutes": 60}],
+        "searches": [{"search_name": "Urgent", "subreddits": "a", "search_params": "x", "digest_interval_minutes": 5},
+                     {"search_name": "Urgent", "subreddits": "b", "search_params": "x", "digest_interval_minutes": 0},
+                     {"search_name": "Other", "subreddits": "a", "search_params": "y"}]})
+    digest_policy = search_runner.get_digest_policy(configuration)
+
+    assert digest_policy.is_enabled()
+    assert digest_policy.get_interval_seconds("a@example.com", "Other") == 600
+    assert digest_policy.get_interval_seconds("slow@example.com", "Other") == 3600
+    assert digest_policy.get_interval_seconds("slow@example.com", "Urgent") == 0
+    assert digest_policy.get_max_emails_per_hour("slow@example.com") == 4
+
+
+def test_get_digest_policy_rejects_negative_settings(tmp_path):
+    configuration = create_configuration(tmp_path, {"digest_settings": [{"max_emails_per_hour": -1}]})
+
+    with pytest.raises(ValueError):
+        search_runner.get_digest_policy(configuration)
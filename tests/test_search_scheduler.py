@@ -0,0 +1,125 @@
+import time
+
+from util.search_scheduler import SearchScheduler
+
+
+# Returns the due searches, waiting at most the given seconds
+def wait_for_due(scheduler, max_wait_seconds=0.0):
+    return sorted(scheduler.wait_for_due_searches(max_wait_seconds))
+
+
+# Runs the due searches instantly and marks them finished, returning them
+def run_cycle(scheduler, max_wait_seconds):
+    due_search_list = wait_for_due(scheduler, max_wait_seconds)
+    scheduler.mark_finished(due_search_list, time.time())
+    return due_search_list
+
+
+def test_new_searches_are_due_immediately():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 60, "B": 120})
+
+    assert wait_for_due(scheduler) == ["A", "B"]
+    assert wait_for_due(scheduler) == []
+
+
+# Searches sharing a query keep running together across cycles despite the jitter, at the shortest interval
+def test_grouped_searches_stay_together_across_cycles():
+    scheduler = SearchScheduler(jitter_seconds=0.3)
+    scheduler.update_searches({"A": 0.6, "B": 0.6, "C": 0.8, "D": 0.6}, [["A", "B", "C"]])
+
+    cycle_list = [run_cycle(scheduler, 2.0) for cycle_index in range(8)]
+
+    assert cycle_list[0] == ["A", "B", "C", "D"]
+    for due_search_list in cycle_list[1:]:
+        assert set(due_search_list) & {"A", "B", "C"} in [set(), {"A", "B", "C"}]
+    grouped_runs = sum(1 for due_search_list in cycle_list if "A" in due_search_list)
+    assert grouped_runs >= 3
+
+
+# Searches that aren't grouped keep schedules of their own
+def test_ungrouped_searches_are_scheduled_on_their_own():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 0.2, "B": 60})
+    assert wait_for_due(scheduler) == ["A", "B"]
+    scheduler.mark_finished(["A", "B"], time.time())
+
+    assert wait_for_due(scheduler, 1.0) == ["A"]
+
+
+# A group formed from searches already scheduled keeps the earliest of their run times
+def test_regrouped_searches_keep_earliest_run_time():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 0.2, "B": 60})
+    scheduler.mark_finished(wait_for_due(scheduler), time.time())
+
+    scheduler.update_searches({"A": 0.2, "B": 60}, [["A", "B"]])
+
+    assert wait_for_due(scheduler, 1.0) == ["A", "B"]
+
+
+def test_removed_search_is_unscheduled():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 60, "B": 60}, [["A", "B"]])
+    scheduler.update_searches({"B": 60})
+
+    assert wait_for_due(scheduler) == ["B"]
+    assert [search_name for search_name, next_run_time, interval_seconds in scheduler.get_schedule()] == ["B"]
+
+
+# A run that comes due while every search in its group is paused is held, and runs once one of them is resumed
+def test_paused_group_is_held_until_resumed():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 60, "B": 60, "C": 60}, [["A", "B"]])
+    scheduler.pause("A")
+    scheduler.pause("B")
+
+    assert wait_for_due(scheduler) == ["C"]
+    assert scheduler.get_queue_depth() == 2
+
+    scheduler.resume("B")
+    assert wait_for_due(scheduler) == ["A", "B"]
+
+
+# A paused search sharing a query with a search that isn't paused still runs with it
+def test_partly_paused_group_runs():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 60, "B": 60}, [["A", "B"]])
+    scheduler.pause("A")
+
+    assert wait_for_due(scheduler) == ["A", "B"]
+
+
+def test_run_now_runs_paused_group_unless_running():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 60, "B": 60}, [["A", "B"]])
+    assert wait_for_due(scheduler) == ["A", "B"]
+
+    assert not scheduler.run_now("B")
+    scheduler.mark_finished(["A", "B"], time.time())
+    scheduler.pause()
+    assert scheduler.run_now("B")
+    assert wait_for_due(scheduler) == ["A", "B"]
+    assert not scheduler.run_now("missing")
+
+
+# Runs missed while a search was running are skipped rather than run back to back
+def test_missed_runs_are_skipped():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 0.1})
+    started_time = time.time() - 1.0
+    assert wait_for_due(scheduler) == ["A"]
+    scheduler.mark_finished(["A"], started_time)
+
+    search_name, next_run_time, interval_seconds = scheduler.get_schedule()[0]
+    assert time.time() < next_run_time <= time.time() + 0.1
+
+
+def test_wait_returns_empty_after_max_wait():
+    scheduler = SearchScheduler()
+    scheduler.update_searches({"A": 60})
+    scheduler.mark_finished(wait_for_due(scheduler), time.time())
+
+    start_time = time.time()
+    assert wait_for_due(scheduler, 0.1) == []
+    assert time.time() - start_time >= 0.1
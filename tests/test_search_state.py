@@ -0,0 +1,52 @@
+import json
+
+from util.search_state import SEARCH_WINDOW_MARGIN_SECONDS, SearchStateStore, get_search_state_key
+
+KEY = get_search_state_key("python", "title:asyncio")
+
+
+# A post indexed late is listed after the previous run's newest submission, and is still reached if it's within the
+# margin
+def test_listing_continues_past_newest_submission_within_margin(tmp_path):
+    search_state = SearchStateStore(str(tmp_path / "search_state.json"))
+    search_state.record_success(KEY, 2000.0, "newest", 1000.0)
+
+    assert not search_state.is_already_seen(KEY, 1000.0)
+    assert not search_state.is_already_seen(KEY, 1000.0 - SEARCH_WINDOW_MARGIN_SECONDS + 1)
+    assert search_state.is_already_seen(KEY, 1000.0 - SEARCH_WINDOW_MARGIN_SECONDS - 1)
+
+
+def test_search_without_state_is_never_seen(tmp_path):
+    search_state = SearchStateStore(str(tmp_path / "search_state.json"))
+
+    assert not search_state.is_already_seen(KEY, 0.0)
+    assert search_state.get_time_filter(KEY) == "week"
+
+
+# The time filter is the smallest window covering the time since the last successful run, plus the margin
+def test_time_filter_narrows_with_recent_success(tmp_path):
+    search_state = SearchStateStore(str(tmp_path / "search_state.json"))
+    search_state.record_success(KEY, 10000.0)
+
+    assert search_state.get_time_filter(KEY, 10000.0 + 60) == "hour"
+    assert search_state.get_time_filter(KEY, 10000.0 + 60 * 60 * 5) == "day"
+    assert search_state.get_time_filter(KEY, 10000.0 + 60 * 60 * 24 * 30) == "week"
+
+
+# Keys that are no longer planned are removed from the file on save, while other processes' keys are kept
+def test_unplanned_keys_are_pruned_on_save(tmp_path):
+    file_path = str(tmp_path / "search_state.json")
+    search_state = SearchStateStore(file_path)
+    search_state.record_success(KEY, 1.0)
+    search_state.record_success("removed|search", 1.0)
+    search_state.save()
+
+    other_search_state = SearchStateStore(file_path)
+    other_search_state.record_success("other|shard", 2.0)
+    other_search_state.save()
+
+    search_state.remove_other_keys({KEY, "other|shard"})
+    search_state.save()
+
+    with open(file_path) as opened_file:
+        assert sorted(json.load(opened_file).keys()) == sorted([KEY, "other|shard"])
@@ -0,0 +1,70 @@
+from util.search_planner import plan_searches
+from util.stream_matcher import AhoCorasickAutomaton, SearchMatcher
+
+
+def create_matcher(*search_tuples):
+    return SearchMatcher(plan_searches([{"search_name": search_name, "subreddits": subreddits,
+                                         "search_params": search_params}
+                                        for search_name, subreddits, search_params in search_tuples],
+                                       "default@example.com"))
+
+
+# Returns the search names matching a post
+def match_names(matcher, subreddit_name, title, selftext=""):
+    return sorted(search_name for email_recipient, search_name in matcher.match(subreddit_name, title, selftext))
+
+
+def test_automaton_finds_overlapping_patterns():
+    automaton = AhoCorasickAutomaton(["he", "she", "his", "hers"])
+
+    assert automaton.find_all("ushers") == {0, 1, 3}
+    assert automaton.find_all("this") == {2}
+    assert automaton.find_all("nothing") == set()
+
+
+def test_automaton_without_patterns_finds_nothing():
+    assert AhoCorasickAutomaton([]).find_all("anything") == set()
+
+
+def test_match_applies_full_query_and_fields():
+    matcher = create_matcher(("praw", "python", "title:praw"), ("async", "python", "asyncio NOT trio"),
+                             ("phrase", "python", '"web scraping"'))
+
+    assert match_names(matcher, "python", "PRAW 8 released") == ["praw"]
+    assert match_names(matcher, "python", "Scraper", "body about praw") == []
+    assert match_names(matcher, "python", "asyncio and web scraping") == ["async", "phrase"]
+    assert match_names(matcher, "python", "asyncio vs trio") == []
+
+
+def test_match_only_in_the_search_subreddits():
+    matcher = create_matcher(("praw", "Python+learnpython", "praw"))
+
+    assert match_names(matcher, "LearnPython", "praw question") == ["praw"]
+    assert match_names(matcher, "rust", "praw question") == []
+
+
+# Searches without a required term are checked against every post
+def test_search_without_required_terms_is_always_evaluated():
+    matcher = create_matcher(("not java", "python", "NOT java"))
+
+    assert match_names(matcher, "python", "anything") == ["not java"]
+    assert match_names(matcher, "python", "java") == []
+
+
+# A search on r/all matches a post from any subreddit
+def test_all_matches_every_subreddit():
+    matcher = create_matcher(("everywhere", "all", "praw"), ("python only", "python", "praw"))
+
+    assert match_names(matcher, "learnpython", "praw") == ["everywhere"]
+    assert match_names(matcher, "python", "praw") == ["everywhere", "python only"]
+    assert "all" in matcher.get_subreddits().split("+")
+
+
+def test_unmatchable_queries_are_skipped():
+    matcher = create_matcher(("author", "python", "author:spez"), ("popular", "popular", "praw"),
+                             ("excluded", "all-python", "praw"), ("ok", "python", "praw"))
+
+    assert sorted(search_string for subreddits, search_string in matcher.get_skipped_queries()) == [
+        "author:spez", "praw", "praw"]
+    assert matcher.get_subreddits() == "python"
+    assert match_names(matcher, "python", "praw") == ["ok"]
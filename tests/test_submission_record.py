@@ -0,0 +1,56 @@
+import argparse
+
+from util.submission_record import SearchResultIndex, SubmissionRecord, create_submission_record
+
+
+# Returns a record of a submission in r/python, created at the given Unix time
+def create_record(submission_id, created_utc=0):
+    return SubmissionRecord(submission_id, "Title " + submission_id, "/r/python/" + submission_id, created_utc,
+                            "python", "https://example.com/" + submission_id)
+
+
+# Only the fields used after a search are copied off the submission
+def test_create_submission_record():
+    submission = argparse.Namespace(id="s1", title="Title", selftext="Body", permalink="/r/python/s1",
+                                    created_utc=100.0, subreddit=argparse.Namespace(display_name="python"),
+                                    url="https://example.com/s1")
+
+    assert create_submission_record(submission) == SubmissionRecord("s1", "Title", "/r/python/s1", 100.0, "python",
+                                                                    "https://example.com/s1")
+
+
+# A submission found for several targets, or found again, is held once with every target it was found for
+def test_add_merges_search_targets():
+    result_index = SearchResultIndex()
+    result_index.add([("a@example.com", "First")], create_record("s1"))
+    result_index.add([("a@example.com", "Second"), ("b@example.com", "First")], create_record("s1"))
+    result_index.add([("a@example.com", "First")], create_record("s2"))
+
+    assert len(result_index) == 2
+    assert result_index.get_submission_ids() == {"s1", "s2"}
+    assert result_index.get_email_recipients() == {"a@example.com", "b@example.com"}
+    assert result_index.get_submission_ids_by_search() == {"First": {"s1", "s2"}, "Second": {"s1"}}
+
+
+# Removed submissions drop out of every grouping, and IDs that aren't in the index are ignored
+def test_remove():
+    result_index = SearchResultIndex()
+    result_index.add([("a@example.com", "First")], create_record("s1"))
+    result_index.add([("b@example.com", "First")], create_record("s2"))
+    result_index.remove(["s2", "missing"])
+
+    assert len(result_index) == 1
+    assert result_index.get_email_recipients() == {"a@example.com"}
+    assert result_index.get_results_by_recipient() == {"a@example.com": {"First": {"s1": create_record("s1")}}}
+
+
+# Results are grouped by recipient, then search, with each search's submissions ordered newest first
+def test_get_results_by_recipient():
+    result_index = SearchResultIndex()
+    result_index.add([("a@example.com", "First")], create_record("old", 100))
+    result_index.add([("a@example.com", "First"), ("b@example.com", "Second")], create_record("new", 300))
+    result_index.add([("a@example.com", "First")], create_record("middle", 200))
+    results_by_recipient = result_index.get_results_by_recipient()
+
+    assert list(results_by_recipient["a@example.com"]["First"]) == ["new", "middle", "old"]
+    assert results_by_recipient["b@example.com"] == {"Second": {"new": create_record("new", 300)}}
@@ -0,0 +1,116 @@
+import ipaddress
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from util.log_setup import get_logger_with_name
+
+
+# Returns whether the host is a loopback address, or localhost, which only accepts connections from this machine
+def is_loopback_host(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# Serves a small JSON control API over HTTP from a background thread, so a running search daemon can be told to run
+# searches now, pause or resume them, and asked for its stats without a restart. The scheduled loop keeps running, and
+# is woken up by the scheduler as soon as a run is asked for. Only listens on loopback addresses, as it has no
+# authentication
+#   GET  /stats                     the scheduler's state along with the stats returned by stats_function
+#   POST /run[?search=NAME]         run one search, or every search, right away, even if paused
+#   POST /pause[?search=NAME]       pause one search, or every search
+#   POST /resume[?search=NAME]      resume one search, or every search
+class ControlServer:
+
+    # Returns the stats served at /stats
+    def get_stats(self):
+        now = time.time()
+        stats_dict = {"paused": self._scheduler.is_paused(),
+                      "queue_depth": self._scheduler.get_queue_depth(),
+                      "searches": [{"search_name": search_name, "paused": self._scheduler.is_paused(search_name),
+                                    "running_or_held": next_run_time is None,
+                                    "next_run_in_seconds": None if next_run_time is None else
+                                    max(0.0, next_run_time - now), "interval_seconds": interval_seconds}
+                                   for search_name, next_run_time, interval_seconds in self._scheduler.get_schedule()]}
+        stats_dict.update(self._stats_function())
+        return stats_dict
+
+    # Run one of the commands POSTed to the API, for the named search or every search, returning the (HTTP status,
+    # response dict)
+    def run_command(self, command, search_name=None):
+        if search_name is not None and not self._scheduler.has_search(search_name):
+            return 404, {"error": "No search named [{}] is scheduled by this process".format(search_name)}
+
+        if command == "run":
+            search_names = [search_name] if search_name is not None else \
+                [schedule_entry[0] for schedule_entry in self._scheduler.get_schedule()]
+            started_search_names = [name for name in search_names if self._scheduler.run_now(name)]
+            if search_name is not None and len(started_search_names) == 0:
+                return 409, {"error": "Search [{}] is already running".format(search_name)}
+            self._logger_instance.info("Control API asked to run [%s]", ", ".join(started_search_names))
+            return 202, {"scheduled": started_search_names}
+        elif command == "pause":
+            self._scheduler.pause(search_name)
+        elif command == "resume":
+            self._scheduler.resume(search_name)
+        else:
+            return 404, {"error": "Unknown command [{}], expected one of: run, pause, resume".format(command)}
+        return 200, {"paused": self._scheduler.is_paused(search_name)}
+
+    # Returns the port the server is listening on
+    def get_port(self):
+        return self._http_server.server_port
+
+    def shutdown(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+
+    # Constructor to pass in the SearchScheduler to control, a function returning a dict of extra stats, the address
+    # to listen on and logging information, which starts the server. Raises ValueError if the host isn't a loopback
+    # address
+    def __init__(self, scheduler, stats_function, host="127.0.0.1", port=9465, console_log_level="INFO",
+                 file_log_filepath="", file_log_level="INFO"):
+        if not is_loopback_host(host):
+            raise ValueError("control_settings.http_host [{}] is not a loopback address. The control API has no "
+                             "authentication, so it only listens on this machine".format(host))
+        self._logger_instance = get_logger_with_name("ControlServer", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._scheduler = scheduler
+        self._stats_function = stats_function
+        control_server = self
+
+        class ControlHandler(BaseHTTPRequestHandler):
+
+            # Requests are logged by the commands they run rather than by the HTTP server
+            def log_message(self, format, *args):
+                pass
+
+            def __send_json(self, status_code, body_dict):
+                body = json.dumps(body_dict, indent=4, sort_keys=True).encode("utf-8")
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if urlsplit(self.path).path != "/stats":
+                    self.send_error(404)
+                    return
+                self.__send_json(200, control_server.get_stats())
+
+            def do_POST(self):
+                split_url = urlsplit(self.path)
+                search_name = parse_qs(split_url.query).get("search", [None])[0]
+                self.__send_json(*control_server.run_command(split_url.path.strip("/"), search_name))
+
+        self._http_server = ThreadingHTTPServer((host, port), ControlHandler)
+        self._http_server.daemon_threads = True
+        threading.Thread(target=self._http_server.serve_forever, name="control", daemon=True).start()
+        self._logger_instance.info("Serving the control API on %s:%d", host, self.get_port())
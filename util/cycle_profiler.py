@@ -0,0 +1,156 @@
+import cProfile
+import glob
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from os import path
+
+from util.log_setup import get_logger_with_name
+
+# Allocations made by the profilers themselves and by the import machinery are left out of the memory summaries
+MEMORY_SNAPSHOT_FILTERS = [tracemalloc.Filter(False, tracemalloc.__file__),
+                           tracemalloc.Filter(False, cProfile.__file__),
+                           tracemalloc.Filter(False, pstats.__file__),
+                           tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                           tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")]
+
+
+# Returns a pstats function tuple as a readable "file:line(function)" string
+def format_function(function_key):
+    return pstats.func_std_string(function_key)
+
+
+# Profiles search cycles with cProfile and, optionally, tracemalloc. Each cycle's pstats file and top allocations are
+# written to the output directory, keeping the first cycle as a baseline and only the most recent cycles after it,
+# along with a summary of how the latest cycle differs from the first
+class CycleProfiler:
+
+    # Wrap a function handed to a worker thread during a cycle, so its time is added to the cycle's profile. cProfile
+    # only sees the thread it was enabled in
+    def wrap_worker(self, function):
+        def profiled_function(*args, **kwargs):
+            worker_profile = cProfile.Profile()
+            try:
+                worker_profile.enable()
+            except ValueError:
+                # From Python 3.12 a single profiler sees every thread, so the cycle's profile already covers this one
+                return function(*args, **kwargs)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                worker_profile.disable()
+                with self._lock:
+                    self._worker_profile_list.append(worker_profile)
+        return profiled_function
+
+    # Context manager profiling the cycle run in its block, writing out the results once the block finishes
+    @contextmanager
+    def profile_cycle(self):
+        self._cycle_number += 1
+        with self._lock:
+            self._worker_profile_list = []
+        if self._trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        cycle_profile = cProfile.Profile()
+        start_time = time.perf_counter()
+        cycle_profile.enable()
+        try:
+            yield
+        finally:
+            cycle_profile.disable()
+            cycle_seconds = time.perf_counter() - start_time
+            try:
+                self.__write_cycle(cycle_profile, cycle_seconds)
+            except OSError as exception:
+                # Losing a profile shouldn't take the search daemon down with it
+                self._logger_instance.error("Couldn't write the profile of cycle %d: %r", self._cycle_number,
+                                            exception)
+
+    # Returns the path of a file for the given cycle number, with the given extension
+    def __get_cycle_path(self, cycle_number, extension):
+        return path.join(self._output_directory, "cycle_{:06d}.{}".format(cycle_number, extension))
+
+    # Write the cycle's pstats file, its memory summary and the diff from the first cycle, then rotate old cycles out
+    def __write_cycle(self, cycle_profile, cycle_seconds):
+        os.makedirs(self._output_directory, exist_ok=True)
+        # The snapshot is taken before the profile is collected, so it doesn't count the collected stats
+        snapshot = None
+        if self._trace_memory:
+            snapshot = tracemalloc.take_snapshot().filter_traces(MEMORY_SNAPSHOT_FILTERS)
+
+        cycle_stats = pstats.Stats(cycle_profile)
+        with self._lock:
+            worker_profile_list = self._worker_profile_list
+            self._worker_profile_list = []
+        for worker_profile in worker_profile_list:
+            cycle_stats.add(worker_profile)
+        cycle_stats.dump_stats(self.__get_cycle_path(self._cycle_number, "pstats"))
+
+        if snapshot is not None:
+            with open(self.__get_cycle_path(self._cycle_number, "memory.txt"), 'w') as opened_file:
+                opened_file.write("Cycle {} traced memory: {} bytes\n\n".format(
+                    self._cycle_number, sum(statistic.size for statistic in snapshot.statistics("filename"))))
+                for statistic in snapshot.statistics("lineno")[:self._top_count]:
+                    opened_file.write("{}\n".format(statistic))
+
+        if self._first_cycle is None:
+            self._first_cycle = (self._cycle_number, cycle_seconds, cycle_stats.stats, snapshot)
+        else:
+            self.__write_diff(cycle_seconds, cycle_stats.stats, snapshot)
+        self._logger_instance.info("Wrote the profile of cycle %d (%.2f seconds) to %s", self._cycle_number,
+                                   cycle_seconds, self._output_directory)
+        self.__remove_old_cycles()
+
+    # Write a summary of the functions and allocations that grew the most between the first and the latest cycle
+    def __write_diff(self, cycle_seconds, stats_dict, snapshot):
+        first_cycle_number, first_cycle_seconds, first_stats_dict, first_snapshot = self._first_cycle
+        # pstats entries are (primitive calls, total calls, internal time, cumulative time, callers)
+        time_change_list = sorted(((stats_dict.get(function_key, (0, 0, 0, 0))[3] -
+                                    first_stats_dict.get(function_key, (0, 0, 0, 0))[3], function_key)
+                                   for function_key in set(stats_dict) | set(first_stats_dict)), reverse=True)
+        temporary_file_path = path.join(self._output_directory, "diff.txt.tmp")
+        with open(temporary_file_path, 'w') as opened_file:
+            opened_file.write("Cycle {} took {:.3f} seconds, cycle {} took {:.3f} seconds\n\n".format(
+                first_cycle_number, first_cycle_seconds, self._cycle_number, cycle_seconds))
+            opened_file.write("Largest increases in cumulative seconds:\n")
+            for time_change, function_key in time_change_list[:self._top_count]:
+                opened_file.write("{:+10.4f}  {}\n".format(time_change, format_function(function_key)))
+            if snapshot is not None and first_snapshot is not None:
+                statistic_diff_list = snapshot.compare_to(first_snapshot, "lineno")
+                opened_file.write("\nTraced memory change: {:+d} bytes\n\nLargest allocation changes:\n".format(
+                    sum(statistic_diff.size_diff for statistic_diff in statistic_diff_list)))
+                for statistic_diff in statistic_diff_list[:self._top_count]:
+                    opened_file.write("{}\n".format(statistic_diff))
+        os.replace(temporary_file_path, path.join(self._output_directory, "diff.txt"))
+
+    # Delete the files of cycles that have rotated out, keeping the first cycle's as the baseline
+    def __remove_old_cycles(self):
+        oldest_kept_cycle_number = self._cycle_number - self._keep_cycles + 1
+        for file_path in glob.glob(path.join(self._output_directory, "cycle_*.*")):
+            cycle_number = int(path.basename(file_path).split(".")[0].split("_")[1])
+            if cycle_number != self._first_cycle[0] and cycle_number < oldest_kept_cycle_number:
+                os.remove(file_path)
+
+    # Constructor to pass in the directory profiles are written to, whether to trace memory allocations, how many of
+    # the most recent cycles to keep, and how many functions or allocations to list in the summaries. Files left by an
+    # earlier run are removed so the baseline is this run's first cycle
+    def __init__(self, output_directory, trace_memory=False, keep_cycles=10, top_count=25, console_log_level="INFO",
+                 file_log_filepath=None, file_log_level=None):
+        self._logger_instance = get_logger_with_name("CycleProfiler", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._output_directory = output_directory
+        self._trace_memory = trace_memory
+        self._keep_cycles = max(1, keep_cycles)
+        self._top_count = top_count
+        self._lock = threading.Lock()
+        self._cycle_number = 0
+        self._worker_profile_list = []
+        # Number, seconds, pstats dict and memory snapshot of the first cycle, which later cycles are compared to
+        self._first_cycle = None
+        for file_path in glob.glob(path.join(output_directory, "cycle_*.*")) + [path.join(output_directory,
+                                                                                          "diff.txt")]:
+            if path.isfile(file_path):
+                os.remove(file_path)
@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import threading
+import time
+from os import path
+
+from util.log_setup import get_logger_with_name
+
+# SQLite limits the number of bound parameters per statement, so membership checks are issued in chunks of this size
+SQLITE_QUERY_CHUNK_SIZE = 500
+
+
+# Splits a list into lists of at most chunk_size items
+def chunk_list(input_list, chunk_size):
+    return [input_list[index:index + chunk_size] for index in range(0, len(input_list), chunk_size)]
+
+
+# The original dedupe store: a one column CSV (submission_id, no header) that is appended to and never compacted.
+# The file is read once when the store is created and kept in memory while the process is running
+class CsvDedupeStore:
+
+    # Returns the subset of the given submission IDs that haven't been seen before
+    def filter_new(self, submission_ids):
+        with self._lock:
+            return set(submission_ids) - self._seen_id_set
+
+    # Record the given submission IDs as seen, appending them to the CSV file (creating it if it didn't exist)
+    def add(self, submission_ids):
+        with self._lock:
+            new_ids = set(submission_ids) - self._seen_id_set
+            with open(self._file_path, 'a+') as opened_file:
+                opened_file.writelines([submission_id + '\n' for submission_id in new_ids])
+            self._seen_id_set.update(new_ids)
+
+    # Record the unseen submission IDs among the given ones as seen, returning the set of them. Before they're recorded,
+    # write_function is called with the set and None, as the CSV can't share a transaction with anything the function
+    # writes. A crash in between leaves the submissions unseen, so they're emailed again rather than lost
+    def claim(self, submission_ids, write_function=None):
+        claimed_id_set = self.filter_new(submission_ids)
+        if write_function is not None:
+            write_function(claimed_id_set, None)
+        self.add(claimed_id_set)
+        return claimed_id_set
+
+    # The CSV has no record of when an ID was seen, so nothing can be evicted
+    def evict_expired(self):
+        return 0
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return iter(self._seen_id_set)
+
+    def __len__(self):
+        return len(self._seen_id_set)
+
+    # Constructor to pass in the CSV file path and logging information
+    def __init__(self, file_path, console_log_level="INFO", file_log_filepath="", file_log_level="INFO"):
+        self._logger_instance = get_logger_with_name("CsvDedupeStore", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._file_path = file_path
+        self._lock = threading.Lock()
+        # A HashSet to store all the values in the CSV file
+        self._seen_id_set = set()
+
+        # Only read the file if it exists
+        if path.isfile(file_path):
+            with open(file_path, 'r') as opened_file:
+                # Use rstrip() to get rid of the trailing whitespace and newline. Then add to the Set
+                self._seen_id_set.update(line.rstrip() for line in opened_file)
+            self._seen_id_set.discard('')
+            self._logger_instance.info("Existing results file found at %s, %d unique values found",
+                                       file_path, len(self._seen_id_set))
+
+
+# Stores seen submission IDs in an indexed SQLite table in WAL mode alongside the time each was first seen, so
+# membership checks don't require reading the full history and IDs too old to reappear in results can be evicted
+class SqliteDedupeStore:
+
+    # Returns the subset of the given submission IDs that haven't been seen before
+    def filter_new(self, submission_ids):
+        unseen_id_set = set(submission_ids)
+        with self._lock:
+            for id_chunk in chunk_list(list(unseen_id_set), SQLITE_QUERY_CHUNK_SIZE):
+                cursor = self._connection.execute(
+                    "SELECT submission_id FROM seen_submissions WHERE submission_id IN ({})".format(
+                        ",".join("?" * len(id_chunk))), id_chunk)
+                unseen_id_set.difference_update(row[0] for row in cursor)
+        return unseen_id_set
+
+    # Record the given submission IDs as seen in a single transaction. IDs that were already seen keep their timestamp
+    def add(self, submission_ids, seen_utc=None):
+        seen_utc = seen_utc or time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO seen_submissions (submission_id, first_seen_utc) VALUES (?, ?)",
+                [(submission_id, seen_utc) for submission_id in submission_ids])
+
+    # Record the unseen submission IDs among the given ones as seen, returning the set of them. The check and the insert
+    # happen under the database's write lock, so when several processes share the database, each ID is only claimed
+    # by one of them. write_function is called with the set and the connection before the transaction commits, so
+    # whatever it writes to this database, like spooled emails, is committed along with the IDs or not at all
+    def claim(self, submission_ids, write_function=None, seen_utc=None):
+        seen_utc = seen_utc or time.time()
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            claimed_id_set = set(submission_ids)
+            for id_chunk in chunk_list(list(claimed_id_set), SQLITE_QUERY_CHUNK_SIZE):
+                cursor = self._connection.execute(
+                    "SELECT submission_id FROM seen_submissions WHERE submission_id IN ({})".format(
+                        ",".join("?" * len(id_chunk))), id_chunk)
+                claimed_id_set.difference_update(row[0] for row in cursor)
+            self._connection.executemany(
+                "INSERT INTO seen_submissions (submission_id, first_seen_utc) VALUES (?, ?)",
+                [(submission_id, seen_utc) for submission_id in claimed_id_set])
+            if write_function is not None:
+                write_function(claimed_id_set, self._connection)
+        return claimed_id_set
+
+    # Remove IDs first seen longer ago than the configured max age, returning the number removed
+    def evict_expired(self):
+        if self._max_age_seconds is None:
+            return 0
+        with self._lock, self._connection:
+            cursor = self._connection.execute("DELETE FROM seen_submissions WHERE first_seen_utc < ?",
+                                              (time.time() - self._max_age_seconds,))
+        if cursor.rowcount > 0:
+            self._logger_instance.info("Evicted %d submission IDs older than %d days", cursor.rowcount,
+                                       self._max_age_seconds // (60 * 60 * 24))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM seen_submissions").fetchone()[0]
+
+    # Import the IDs from a legacy CSV dedupe file, then rename it so the import only happens once
+    def __migrate_from_csv(self, csv_file_path):
+        csv_store = CsvDedupeStore(csv_file_path)
+        # The CSV doesn't record when IDs were seen, so treat them as seen now and let them age out from here
+        self.add(list(csv_store))
+        migrated_file_path = csv_file_path + ".migrated"
+        os.replace(csv_file_path, migrated_file_path)
+        self._logger_instance.warning("Migrated %d submission IDs from %s to %s. The CSV was renamed to %s",
+                                      len(csv_store), csv_file_path, self._file_path, migrated_file_path)
+
+    # Constructor to pass in the database path, the max age in days of IDs to keep (None or 0 keeps them forever), an
+    # optional legacy CSV file to import and logging information. A read only store opens the database without
+    # creating or migrating anything, and is empty if there's no database yet
+    def __init__(self, file_path, max_age_days=None, csv_file_path=None, console_log_level="INFO",
+                 file_log_filepath="", file_log_level="INFO", read_only=False):
+        self._logger_instance = get_logger_with_name("SqliteDedupeStore", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._file_path = file_path
+        self._max_age_seconds = max_age_days * 60 * 60 * 24 if max_age_days else None
+        self._lock = threading.Lock()
+
+        # The connection is shared between threads, with access serialized by the lock
+        if read_only and path.isfile(file_path):
+            self._connection = sqlite3.connect("file:{}?mode=ro".format(file_path), uri=True,
+                                               check_same_thread=False)
+            self._logger_instance.info("Dedupe database opened read only at %s with %d submission IDs", file_path,
+                                       len(self))
+            return
+        if read_only:
+            self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+        else:
+            # https://www.sqlite.org/wal.html
+            self._connection = sqlite3.connect(file_path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS seen_submissions (submission_id TEXT PRIMARY KEY, "
+                                     "first_seen_utc REAL NOT NULL) WITHOUT ROWID")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS seen_submissions_first_seen_utc "
+                                     "ON seen_submissions (first_seen_utc)")
+
+        if read_only:
+            self._logger_instance.info("No dedupe database at %s yet, every submission is new", file_path)
+            return
+        if csv_file_path is not None and path.isfile(csv_file_path):
+            self.__migrate_from_csv(csv_file_path)
+
+        self._logger_instance.info("Dedupe database opened at %s with %d submission IDs", file_path, len(self))
+
+
+# Create the dedupe store for the configured backend, storing its files in the given directory. A read only store is
+# only ever read from, and leaves the directory as it is
+def create_dedupe_store(backend, directory, max_age_days=None, console_log_level="INFO", file_log_filepath="",
+                        file_log_level="INFO", read_only=False):
+    csv_file_path = directory + "/old_results.csv"
+    if backend == "csv":
+        return CsvDedupeStore(csv_file_path, console_log_level, file_log_filepath, file_log_level)
+    elif backend == "sqlite":
+        return SqliteDedupeStore(directory + "/old_results.sqlite3", max_age_days, csv_file_path, console_log_level,
+                                 file_log_filepath, file_log_level, read_only)
+    else:
+        raise ValueError("Unknown dedupe backend [{}], expected one of: csv, sqlite".format(backend))
@@ -0,0 +1,161 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from util.log_setup import get_logger_with_name
+from util.submission_record import SubmissionRecord
+
+# The window max_emails_per_hour is counted over
+SECONDS_PER_HOUR = 60 * 60
+
+
+# How often each recipient may be emailed. Results for a search with a digest interval wait until the recipient hasn't
+# been emailed for that long, and a recipient with a budget isn't emailed more often than that per hour. An interval
+# or budget of 0 means none. Search intervals take precedence over recipient intervals, which take precedence over the
+# defaults
+class DigestPolicy:
+
+    # Returns the seconds a recipient must go without an email before results of the search are sent
+    def get_interval_seconds(self, email_recipient, search_name):
+        if search_name in self._search_interval_dict:
+            return self._search_interval_dict[search_name]
+        return self._recipient_dict.get(email_recipient, {}).get("interval_seconds", self._default_interval_seconds)
+
+    # Returns the most emails a recipient may be sent per hour, or 0 for no limit
+    def get_max_emails_per_hour(self, email_recipient):
+        return self._recipient_dict.get(email_recipient, {}).get("max_emails_per_hour",
+                                                                 self._default_max_emails_per_hour)
+
+    # Returns whether any results could be held back, which is only worth buffering them for if so
+    def is_enabled(self):
+        return self._default_interval_seconds > 0 or self._default_max_emails_per_hour > 0 or \
+            any(interval_seconds > 0 for interval_seconds in self._search_interval_dict.values()) or \
+            any(value > 0 for recipient_policy in self._recipient_dict.values() for value in recipient_policy.values())
+
+    # Constructor to pass in the default interval and budget, a dict of recipients to dicts with their own
+    # "interval_seconds" and/or "max_emails_per_hour", and a dict of search names to their own interval in seconds
+    def __init__(self, default_interval_seconds=0, default_max_emails_per_hour=0, recipient_dict=None,
+                 search_interval_dict=None):
+        self._default_interval_seconds = default_interval_seconds
+        self._default_max_emails_per_hour = default_max_emails_per_hour
+        self._recipient_dict = recipient_dict or {}
+        self._search_interval_dict = search_interval_dict or {}
+
+
+# Persists results that are waiting to be emailed as part of a digest, along with when each recipient was last
+# emailed, in tables of a SQLite database. The tables live in the dedupe database, so results can be buffered in the
+# same transaction that marks them as seen, and moved to the email spool in the same transaction that removes them
+class DigestBuffer:
+
+    # Add a dict of recipients to dicts of search names to dicts of submission IDs to SubmissionRecords to the buffer.
+    # When a connection to the same database is passed in, the rows are inserted as part of the caller's transaction
+    def add(self, results_by_recipient, connection=None):
+        buffered_utc = time.time()
+        row_list = [(email_recipient, search_name, submission_record.id, submission_record.title,
+                     submission_record.permalink, submission_record.created_utc, submission_record.subreddit,
+                     submission_record.url, buffered_utc)
+                    for email_recipient, search_dict in results_by_recipient.items()
+                    for search_name, submission_dict in search_dict.items()
+                    for submission_record in submission_dict.values()]
+        insert_sql = "INSERT OR IGNORE INTO digest_buffer (email_recipient, search_name, submission_id, title, " \
+                     "permalink, created_utc, subreddit, url, buffered_utc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        if connection is not None:
+            connection.executemany(insert_sql, row_list)
+            return
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(insert_sql, row_list)
+            self._connection.execute("COMMIT")
+
+    # Returns the set of recipients with buffered results that the policy allows to be emailed now
+    def __get_due_recipients(self, digest_policy, now_utc):
+        pending_dict = {}
+        for email_recipient, search_name in self._connection.execute(
+                "SELECT DISTINCT email_recipient, search_name FROM digest_buffer"):
+            pending_dict.setdefault(email_recipient, []).append(search_name)
+
+        due_recipient_set = set()
+        for email_recipient, search_names in pending_dict.items():
+            row = self._connection.execute("SELECT last_sent_utc FROM digest_recipients WHERE email_recipient = ?",
+                                           (email_recipient,)).fetchone()
+            last_sent_utc = None if row is None else row[0]
+            if last_sent_utc is not None and not any(
+                    now_utc - last_sent_utc >= digest_policy.get_interval_seconds(email_recipient, search_name)
+                    for search_name in search_names):
+                continue
+            max_emails_per_hour = digest_policy.get_max_emails_per_hour(email_recipient)
+            if max_emails_per_hour > 0 and self._connection.execute(
+                    "SELECT COUNT(*) FROM digest_sends WHERE email_recipient = ? AND sent_utc > ?",
+                    (email_recipient, now_utc - SECONDS_PER_HOUR)).fetchone()[0] >= max_emails_per_hour:
+                continue
+            due_recipient_set.add(email_recipient)
+        return due_recipient_set
+
+    # Context manager taking every buffered result of the recipients that are due an email under the policy. It yields
+    # the results, grouped like SearchResultIndex.get_results_by_recipient, and the connection of its transaction so
+    # the emails made from them can be spooled in it. The results are removed and the emails counted against each
+    # recipient's budget once the block finishes, and kept buffered if it raises
+    @contextmanager
+    def take_due(self, digest_policy):
+        with self._lock:
+            now_utc = time.time()
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                due_recipient_set = self.__get_due_recipients(digest_policy, now_utc)
+                results_by_recipient = {}
+                for email_recipient in sorted(due_recipient_set):
+                    for row in self._connection.execute(
+                            "SELECT search_name, submission_id, title, permalink, created_utc, subreddit, url FROM "
+                            "digest_buffer WHERE email_recipient = ? ORDER BY search_name, created_utc DESC",
+                            (email_recipient,)):
+                        results_by_recipient.setdefault(email_recipient, {}).setdefault(row[0], {})[row[1]] = \
+                            SubmissionRecord(*row[1:])
+
+                yield results_by_recipient, self._connection
+
+                for email_recipient in due_recipient_set:
+                    self._connection.execute("DELETE FROM digest_buffer WHERE email_recipient = ?", (email_recipient,))
+                    self._connection.execute("INSERT OR REPLACE INTO digest_recipients (email_recipient, "
+                                             "last_sent_utc) VALUES (?, ?)", (email_recipient, now_utc))
+                    self._connection.execute("INSERT INTO digest_sends (email_recipient, sent_utc) VALUES (?, ?)",
+                                             (email_recipient, now_utc))
+                self._connection.execute("DELETE FROM digest_sends WHERE sent_utc <= ?", (now_utc - SECONDS_PER_HOUR,))
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    # Returns the number of results waiting in the buffer
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM digest_buffer").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    # Constructor to pass in the path of the SQLite database to keep the buffer in, and logging information
+    def __init__(self, file_path, console_log_level="INFO", file_log_filepath="", file_log_level="INFO"):
+        self._logger_instance = get_logger_with_name("DigestBuffer", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._lock = threading.Lock()
+        # Transactions are managed explicitly, so taking results can hold the write lock from reading to removing them
+        self._connection = sqlite3.connect(file_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS digest_buffer (email_recipient TEXT NOT NULL, "
+                                 "search_name TEXT NOT NULL, submission_id TEXT NOT NULL, title TEXT NOT NULL, "
+                                 "permalink TEXT NOT NULL, created_utc REAL NOT NULL, subreddit TEXT NOT NULL, "
+                                 "url TEXT NOT NULL, buffered_utc REAL NOT NULL, "
+                                 "PRIMARY KEY (email_recipient, search_name, submission_id))")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS digest_recipients (email_recipient TEXT PRIMARY KEY, "
+                                 "last_sent_utc REAL NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS digest_sends (email_recipient TEXT NOT NULL, "
+                                 "sent_utc REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS digest_sends_recipient ON digest_sends "
+                                 "(email_recipient, sent_utc)")
+        buffered_count = len(self)
+        if buffered_count > 0:
+            self._logger_instance.info("Digest buffer at %s has %d results waiting to be sent", file_path,
+                                       buffered_count)
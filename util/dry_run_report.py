@@ -0,0 +1,177 @@
+import threading
+
+SECONDS_PER_DAY = 60 * 60 * 24
+
+
+# Collects what a --dryrun cycle did and would have done, and formats it as a cost report: the Reddit requests and
+# results of each query, the time spent in each stage, the emails each recipient would be sent, and the searches that
+# are coalesced, batched together or redundant
+class DryRunReport:
+
+    # Record the planned queries (from plan_searches), the batches they run as, and each search's polling interval
+    def set_plan(self, query_dict, batch_list, search_interval_dict):
+        self._query_dict = query_dict
+        self._batch_list = batch_list
+        self._search_interval_dict = search_interval_dict
+
+    # Record a Reddit query that ran, with the requests and search pages it took, the results it fetched and how long
+    # it took
+    def record_query(self, subreddits, search_string, search_names, time_filter, request_count, page_count,
+                     result_count, seconds):
+        with self._lock:
+            self._query_stats_list.append({"subreddits": subreddits, "search_string": search_string,
+                                           "search_names": search_names, "time_filter": time_filter,
+                                           "requests": request_count, "pages": page_count, "results": result_count,
+                                           "seconds": seconds})
+
+    # Record a failed Reddit query
+    def record_failure(self, search_name, exception):
+        with self._lock:
+            self._failure_list.append((search_name, exception))
+
+    # Add to the seconds spent in a stage of the cycle
+    def record_stage(self, stage_name, seconds):
+        with self._lock:
+            self._stage_seconds_dict[stage_name] = self._stage_seconds_dict.get(stage_name, 0) + seconds
+
+    # Record the dicts of each search name to the set of submission IDs it found, before and after dedupe
+    def record_results(self, fetched_ids_by_search, new_ids_by_search):
+        self._fetched_ids_by_search = fetched_ids_by_search
+        self._new_ids_by_search = new_ids_by_search
+
+    # Record the MIME emails that would have been sent, and the DigestPolicy that would have held them back
+    def record_emails(self, mime_email_list, digest_policy):
+        self._email_list = [(mime_email["To"], len(mime_email.as_string())) for mime_email in mime_email_list]
+        self._digest_policy = digest_policy
+
+    # Returns a dict of each search name to the set of recipients it sends to
+    def __get_recipients_by_search(self):
+        recipient_dict = {}
+        for search_targets in self._query_dict.values():
+            for email_recipient, search_name in search_targets:
+                recipient_dict.setdefault(search_name, set()).add(email_recipient)
+        return recipient_dict
+
+    # Returns the number of times a day a query or recipient with searches at the given intervals runs
+    def __get_runs_per_day(self, search_names):
+        interval_list = [self._search_interval_dict[search_name] for search_name in search_names
+                         if search_name in self._search_interval_dict]
+        return SECONDS_PER_DAY / min(interval_list) if len(interval_list) > 0 else 0
+
+    # Returns the lines listing each query's cost
+    def __format_queries(self):
+        line_list = ["Reddit queries ({} run):".format(len(self._query_stats_list))]
+        total_requests = 0
+        total_requests_per_day = 0
+        for query_stats in sorted(self._query_stats_list,
+                                  key=lambda stats: (-stats["requests"], stats["search_string"])):
+            runs_per_day = self.__get_runs_per_day(query_stats["search_names"])
+            total_requests += query_stats["requests"]
+            total_requests_per_day += query_stats["requests"] * runs_per_day
+            line_list.append("  [{}] in [{}] over the last {}: {} requests, {} pages, {} results, {:.3f} seconds, "
+                             "~{:.0f} requests a day. Searches: {}".format(
+                                 query_stats["search_string"], query_stats["subreddits"], query_stats["time_filter"],
+                                 query_stats["requests"], query_stats["pages"], query_stats["results"],
+                                 query_stats["seconds"], query_stats["requests"] * runs_per_day,
+                                 ", ".join(query_stats["search_names"])))
+        for search_name, exception in self._failure_list:
+            line_list.append("  Search [{}] FAILED: {!r}".format(search_name, exception))
+        line_list.append("  Total: {} requests this run, ~{:.0f} a day at the current intervals".format(
+            total_requests, total_requests_per_day))
+        return line_list
+
+    # Returns the lines listing each search's results before and after dedupe
+    def __format_searches(self):
+        search_names = sorted(self.__get_recipients_by_search().keys())
+        line_list = ["Results per search (fetched / new after dedupe):"]
+        for search_name in search_names:
+            line_list.append("  {}: {} / {}".format(search_name,
+                                                    len(self._fetched_ids_by_search.get(search_name, ())),
+                                                    len(self._new_ids_by_search.get(search_name, ()))))
+        return line_list
+
+    # Returns the lines listing the emails each recipient would be sent, this run and projected over a day
+    def __format_emails(self):
+        email_dict = dict(self._email_list)
+        line_list = ["Emails ({} this run, {} bytes):".format(len(self._email_list), sum(email_dict.values()))]
+        recipient_search_dict = {}
+        for search_name, email_recipients in self.__get_recipients_by_search().items():
+            for email_recipient in email_recipients:
+                recipient_search_dict.setdefault(email_recipient, set()).add(search_name)
+        for email_recipient, search_names in sorted(recipient_search_dict.items()):
+            # A recipient can be emailed at most once per run of their most frequent search, and no more often than
+            # their digest interval and hourly budget allow
+            emails_per_day = self.__get_runs_per_day(search_names)
+            if self._digest_policy is not None:
+                interval_seconds = min(self._digest_policy.get_interval_seconds(email_recipient, search_name)
+                                       for search_name in search_names)
+                if interval_seconds > 0:
+                    emails_per_day = min(emails_per_day, SECONDS_PER_DAY / interval_seconds)
+                max_emails_per_hour = self._digest_policy.get_max_emails_per_hour(email_recipient)
+                if max_emails_per_hour > 0:
+                    emails_per_day = min(emails_per_day, max_emails_per_hour * 24)
+            line_list.append("  {}: {} this run ({} bytes), at most ~{:.0f} a day".format(
+                email_recipient, 1 if email_recipient in email_dict else 0, email_dict.get(email_recipient, 0),
+                emails_per_day))
+        return line_list
+
+    # Returns the lines listing searches that share a query, queries batched into one request, and searches whose
+    # results were all found by another search for the same recipient
+    def __format_overlap(self):
+        line_list = ["Coalesced and redundant searches:"]
+        for (subreddits, search_string), search_targets in self._query_dict.items():
+            if len(search_targets) > 1:
+                line_list.append("  Coalesced: [{}] in [{}] runs once for {} searches: {}".format(
+                    search_string, subreddits, len(search_targets),
+                    ", ".join("[{}] for {}".format(search_name, email_recipient)
+                              for email_recipient, search_name in sorted(search_targets))))
+            target_list = list(search_targets)
+            for search_target in set(target_list):
+                if target_list.count(search_target) > 1:
+                    line_list.append("  Redundant: search [{}] is configured {} times for {}".format(
+                        search_target[1], target_list.count(search_target), search_target[0]))
+        for subreddits, search_string, search_members in self._batch_list:
+            if len(search_members) > 1:
+                line_list.append("  Batched: {} queries in [{}] run as one request: {}".format(
+                    len(search_members), subreddits, search_string))
+
+        recipient_dict = self.__get_recipients_by_search()
+        for search_name, fetched_ids in sorted(self._fetched_ids_by_search.items()):
+            for other_search_name, other_fetched_ids in sorted(self._fetched_ids_by_search.items()):
+                if search_name != other_search_name and len(fetched_ids) > 0 and \
+                        fetched_ids <= other_fetched_ids and \
+                        len(recipient_dict.get(search_name, set()) & recipient_dict.get(other_search_name, set())) > 0:
+                    line_list.append("  Redundant: every result of [{}] was also found by [{}] for the same "
+                                     "recipient".format(search_name, other_search_name))
+                    break
+        if len(line_list) == 1:
+            line_list.append("  None")
+        return line_list
+
+    # Returns the report as text
+    def format_report(self):
+        line_list = ["Dry run cost report. Nothing was recorded as seen and no email was sent", ""]
+        line_list.extend(self.__format_queries())
+        line_list.append("")
+        line_list.extend(self.__format_searches())
+        line_list.append("")
+        line_list.append("Seconds per stage: " + ", ".join("{} {:.3f}".format(stage_name, seconds) for
+                                                           stage_name, seconds in self._stage_seconds_dict.items()))
+        line_list.append("")
+        line_list.extend(self.__format_emails())
+        line_list.append("")
+        line_list.extend(self.__format_overlap())
+        return "\n".join(line_list)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._query_dict = {}
+        self._batch_list = []
+        self._search_interval_dict = {}
+        self._query_stats_list = []
+        self._failure_list = []
+        self._stage_seconds_dict = {}
+        self._fetched_ids_by_search = {}
+        self._new_ids_by_search = {}
+        self._email_list = []
+        self._digest_policy = None
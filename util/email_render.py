@@ -0,0 +1,78 @@
+# Used for escaping submission titles when HTML is emitted directly
+import html
+
+# First line of every email body
+EMAIL_HEADER_MARKDOWN = "## New Search Results Found!"
+EMAIL_HEADER_HTML = "<h2>New Search Results Found!</h2>"
+
+
+# Returns a string of markdown formatted text listing one search's submissions
+def construct_search_markdown(search_name, dict_of_submissions):
+    # Add the search name from the JSON
+    search_lines = ['### {}'.format(search_name)]
+    # Add all the separate submissions as their titles with hyperlinks to the post
+    for submission in dict_of_submissions.values():
+        search_lines.append('- [{}](https://reddit.com{})'.format(submission.title, submission.permalink))
+    return "\n".join(search_lines)
+
+
+# Returns a string of markdown formatted text
+def construct_email_markdown(dict_of_searches_and_submissions):
+    email_body_lines = [EMAIL_HEADER_MARKDOWN]
+    for search_name, dict_of_submissions in dict_of_searches_and_submissions.items():
+        email_body_lines.append(construct_search_markdown(search_name, dict_of_submissions))
+    # Aggregate the lines of markdown into a single string and return
+    return "\n".join(email_body_lines)
+
+
+# Returns a string of HTML listing one search's submissions, escaped directly rather than going through Markdown
+def construct_search_html(search_name, dict_of_submissions):
+    search_lines = ['<h3>{}</h3>'.format(html.escape(search_name)), '<ul>']
+    for submission in dict_of_submissions.values():
+        search_lines.append('<li><a href="https://reddit.com{}">{}</a></li>'.format(
+            html.escape(submission.permalink), html.escape(submission.title)))
+    search_lines.append('</ul>')
+    return "\n".join(search_lines)
+
+
+# Renders the plain text and HTML email bodies for each recipient. Each search's fragment is rendered once per set of
+# results and reused for every recipient of that search, so the rendering cost doesn't grow with the recipient count
+class EmailRenderer:
+
+    # Returns the (markdown, html) fragment for a search, rendering it if it hasn't been rendered yet
+    def __get_search_fragment(self, search_name, dict_of_submissions):
+        fragment_key = (search_name, tuple(dict_of_submissions.keys()))
+        if fragment_key not in self._fragment_dict:
+            search_markdown = construct_search_markdown(search_name, dict_of_submissions)
+            if self._use_markdown:
+                search_html = self._markdown.markdown(search_markdown)
+            else:
+                search_html = construct_search_html(search_name, dict_of_submissions)
+            self._fragment_dict[fragment_key] = (search_markdown, search_html)
+        return self._fragment_dict[fragment_key]
+
+    # Returns the (markdown, html) bodies of an email for a dict of search names to dicts of submissions. These are
+    # the same as rendering construct_email_markdown's output as a whole
+    def render_email(self, dict_of_searches_and_submissions):
+        markdown_list = [EMAIL_HEADER_MARKDOWN]
+        html_list = [EMAIL_HEADER_HTML]
+        for search_name, dict_of_submissions in dict_of_searches_and_submissions.items():
+            search_markdown, search_html = self.__get_search_fragment(search_name, dict_of_submissions)
+            markdown_list.append(search_markdown)
+            html_list.append(search_html)
+        return "\n".join(markdown_list), "\n".join(html_list)
+
+    # Returns the number of distinct search fragments rendered so far
+    def get_fragment_count(self):
+        return len(self._fragment_dict)
+
+    # Constructor to choose whether the HTML is rendered from the Markdown or emitted directly
+    def __init__(self, use_markdown=True):
+        self._use_markdown = use_markdown
+        # Python-Markdown is only imported when it's used, as importing it takes longer than rendering most emails
+        self._markdown = None
+        if use_markdown:
+            import markdown
+            self._markdown = markdown
+        # Maps (search_name, tuple of submission IDs) to the rendered (markdown, html) fragment
+        self._fragment_dict = {}
@@ -0,0 +1,204 @@
+import email
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from util import metrics
+from util.log_setup import get_logger_with_name
+
+# Seconds a claimed email is reserved for the sender that claimed it. If the process dies mid-send, the email is
+# retried once this runs out
+CLAIM_LEASE_SECONDS = 10 * 60
+
+# Longest the background senders sleep before checking the spool again without being woken
+IDLE_POLL_SECONDS = 60
+
+
+# Returns the seconds to wait before the next attempt at sending an email that has failed the given number of times,
+# doubling with every failure up to the maximum
+def get_retry_delay(attempt_count, retry_base_seconds, retry_max_seconds):
+    return min(retry_max_seconds, retry_base_seconds * 2 ** max(0, attempt_count - 1))
+
+
+# Rendered emails waiting to be sent, kept in a table of a SQLite database so they survive a crash or an SMTP outage.
+# The table lives in the dedupe database, so emails can be spooled in the same transaction that marks their
+# submissions as seen
+class EmailSpool:
+
+    # Add MIME emails to the spool. When a connection to the same database is passed in, the rows are inserted without
+    # committing, as part of the caller's transaction. Otherwise they're committed right away
+    def enqueue(self, mime_message_list, connection=None):
+        enqueued_utc = time.time()
+        row_list = [(mime_message["To"], mime_message.as_string(), enqueued_utc, enqueued_utc)
+                    for mime_message in mime_message_list]
+        insert_sql = "INSERT INTO email_spool (recipient, message, enqueued_utc, next_attempt_utc) VALUES (?, ?, ?, ?)"
+        if connection is not None:
+            connection.executemany(insert_sql, row_list)
+            return
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(insert_sql, row_list)
+            self._connection.execute("COMMIT")
+
+    # Claim the oldest email that's due to be sent, returning its (spool ID, attempt count, MIME message), or None if
+    # none are due. The claim holds the email back from other senders, in this process or another, until it's
+    # released or its lease runs out
+    def claim_due_email(self):
+        claim_time = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT spool_id, attempt_count, message FROM email_spool WHERE failed = 0 AND "
+                    "next_attempt_utc <= ? ORDER BY next_attempt_utc, spool_id LIMIT 1", (claim_time,)).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE email_spool SET next_attempt_utc = ?, attempt_count = attempt_count + 1 "
+                        "WHERE spool_id = ?", (claim_time + CLAIM_LEASE_SECONDS, row[0]))
+            finally:
+                self._connection.execute("COMMIT")
+        if row is None:
+            return None
+        return row[0], row[1] + 1, email.message_from_string(row[2])
+
+    # Remove a sent email from the spool
+    def remove(self, spool_id):
+        with self._lock:
+            self._connection.execute("DELETE FROM email_spool WHERE spool_id = ?", (spool_id,))
+
+    # Record a failed attempt at sending an email, either scheduling the next attempt or, if it shouldn't be retried,
+    # keeping it in the spool as failed
+    def release_failed(self, spool_id, error_text, next_attempt_utc=None):
+        with self._lock:
+            if next_attempt_utc is None:
+                self._connection.execute("UPDATE email_spool SET failed = 1, last_error = ? WHERE spool_id = ?",
+                                         (error_text, spool_id))
+            else:
+                self._connection.execute("UPDATE email_spool SET next_attempt_utc = ?, last_error = ? "
+                                         "WHERE spool_id = ?", (next_attempt_utc, error_text, spool_id))
+
+    # Returns the number of emails waiting to be sent, including ones waiting to be retried
+    def get_pending_count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM email_spool WHERE failed = 0").fetchone()[0]
+
+    # Returns the time the next pending email is due, or None if there are none
+    def get_next_attempt_time(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT MIN(next_attempt_utc) FROM email_spool WHERE failed = 0").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    # Constructor to pass in the path of the SQLite database to keep the spool in, and logging information
+    def __init__(self, file_path, console_log_level="INFO", file_log_filepath="", file_log_level="INFO"):
+        self._logger_instance = get_logger_with_name("EmailSpool", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._lock = threading.Lock()
+        # Transactions are managed explicitly, so claims can take the write lock before reading
+        self._connection = sqlite3.connect(file_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS email_spool (spool_id INTEGER PRIMARY KEY, "
+                                 "recipient TEXT NOT NULL, message TEXT NOT NULL, enqueued_utc REAL NOT NULL, "
+                                 "next_attempt_utc REAL NOT NULL, attempt_count INTEGER NOT NULL DEFAULT 0, "
+                                 "failed INTEGER NOT NULL DEFAULT 0, last_error TEXT)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS email_spool_due ON email_spool (failed, next_attempt_utc)")
+        pending_count = self.get_pending_count()
+        if pending_count > 0:
+            self._logger_instance.info("Email spool at %s has %d emails waiting to be sent", file_path, pending_count)
+
+
+# Sends the emails in an EmailSpool, either from background threads that are woken when emails are spooled, or all at
+# once with flush. Failed sends are retried with exponential backoff until they run out of attempts
+class EmailSpoolWorker:
+
+    # Send every email that's due, one at a time, returning the number sent. Safe to call from several threads at once
+    def send_due(self):
+        sent_count = 0
+        while not self._stop_event.is_set():
+            claimed_email = self._email_spool.claim_due_email()
+            if claimed_email is None:
+                break
+            spool_id, attempt_count, mime_message = claimed_email
+            try:
+                self._send_function(mime_message)
+            except Exception as exception:
+                if attempt_count >= self._max_attempts:
+                    self._email_spool.release_failed(spool_id, repr(exception))
+                    self._logger_instance.error("Giving up on the email to %s after %d attempts, it stays in the "
+                                                "spool as failed: %r", mime_message["To"], attempt_count, exception)
+                else:
+                    retry_delay = get_retry_delay(attempt_count, self._retry_base_seconds, self._retry_max_seconds)
+                    self._email_spool.release_failed(spool_id, repr(exception), time.time() + retry_delay)
+                    self._logger_instance.warning("Sending the email to %s failed (attempt %d of %d), retrying in %d "
+                                                  "seconds: %r", mime_message["To"], attempt_count, self._max_attempts,
+                                                  retry_delay, exception)
+                metrics.EMAIL_SEND_FAILURES_TOTAL.inc()
+                continue
+            self._email_spool.remove(spool_id)
+            sent_count += 1
+        metrics.EMAIL_SPOOL_PENDING.set(self._email_spool.get_pending_count())
+        return sent_count
+
+    # Send every email that's due on the given number of threads, returning once they're all sent or have failed
+    def flush(self, thread_count=1):
+        with ThreadPoolExecutor(max_workers=max(1, thread_count), thread_name_prefix="email-flush") as thread_pool:
+            return sum(thread_pool.map(lambda thread_index: self.send_due(), range(max(1, thread_count))))
+
+    # Wake the background threads to send newly spooled emails
+    def wake(self):
+        self._wake_event.set()
+
+    # Start the given number of background sender threads
+    def start(self, thread_count=1):
+        for thread_index in range(max(1, thread_count)):
+            sender_thread = threading.Thread(target=self.__run, name="email-sender-{}".format(thread_index),
+                                             daemon=True)
+            sender_thread.start()
+            self._thread_list.append(sender_thread)
+        self._logger_instance.info("Started %d email sender threads", len(self._thread_list))
+
+    # Stop the background threads once they've finished the email they're sending
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        for sender_thread in self._thread_list:
+            sender_thread.join()
+        self._thread_list = []
+
+    # Loop of each background thread, sending whatever's due and then sleeping until the next retry is due or it's
+    # woken up
+    def __run(self):
+        while not self._stop_event.is_set():
+            # Cleared before sending, so emails spooled while this thread is busy still wake it afterwards
+            self._wake_event.clear()
+            try:
+                self.send_due()
+                next_attempt_time = self._email_spool.get_next_attempt_time()
+            except Exception as exception:
+                # A broken spool database is logged and retried rather than killing the thread
+                self._logger_instance.error("Email sender failed: %r", exception)
+                next_attempt_time = None
+            wait_seconds = IDLE_POLL_SECONDS
+            if next_attempt_time is not None:
+                wait_seconds = min(IDLE_POLL_SECONDS, max(0.0, next_attempt_time - time.time()))
+            self._wake_event.wait(wait_seconds)
+
+    # Constructor to pass in the spool, the function sending a single MIME email, the retry policy and logging
+    # information. Threads aren't started until start is called
+    def __init__(self, email_spool, send_function, retry_base_seconds=60, retry_max_seconds=3600, max_attempts=10,
+                 console_log_level="INFO", file_log_filepath="", file_log_level="INFO"):
+        self._logger_instance = get_logger_with_name("EmailSpoolWorker", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._email_spool = email_spool
+        self._send_function = send_function
+        self._retry_base_seconds = retry_base_seconds
+        self._retry_max_seconds = retry_max_seconds
+        self._max_attempts = max(1, max_attempts)
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread_list = []
@@ -13,6 +13,7 @@ https://developers.google.com/identity/protocols/OAuth2
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from util.log_setup import get_logger_with_name
+from util import metrics
 import urllib.parse
 import urllib.request
 import json
@@ -21,6 +22,10 @@ import base64
 import time
 import sys
 import argparse
+import threading
+
+# Access tokens are refreshed this many seconds before Google says they expire, so one can't expire mid-send
+ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS = 60
 
 
 def url_escape(text):
@@ -88,19 +93,93 @@ class EmailTools:
                                            self.GOOGLE_REFRESH_TOKEN)
         return response['access_token'], response['expires_in']
 
-    def send_mail(self, mime_message_list):
-        access_token, expires_in = self.refresh_authorization()
-        auth_string = generate_oauth2_string(self.GOOGLE_ACCOUNT_EMAIL, access_token, as_base64=True)
-        server = smtplib.SMTP('smtp.gmail.com:587')
+    # Returns the cached access token, only refreshing it once it's within a minute of its expiry
+    def get_access_token(self):
+        with self._token_lock:
+            if self._access_token is None or time.time() >= self._access_token_expiry_time:
+                access_token, expires_in = self.refresh_authorization()
+                metrics.TOKEN_REFRESHES_TOTAL.inc(service="google")
+                self._access_token = access_token
+                self._access_token_expiry_time = time.time() + expires_in - ACCESS_TOKEN_EXPIRY_MARGIN_SECONDS
+                self._logger_instance.debug("Cached new access token expiring in %d seconds", expires_in)
+            return self._access_token
+
+    # Open and authenticate a new SMTP session
+    def __open_smtp_connection(self):
+        self._logger_instance.debug("Opening SMTP connection to %s:%d", self._smtp_host, self._smtp_port)
+        auth_string = generate_oauth2_string(self.GOOGLE_ACCOUNT_EMAIL, self.get_access_token(), as_base64=True)
+        server = smtplib.SMTP(self._smtp_host, self._smtp_port)
         server.ehlo(self.GOOGLE_API_CLIENT_ID)
-        server.starttls()
-        server.docmd('AUTH', 'XOAUTH2 ' + auth_string)
-        for mime_message in mime_message_list:
-            self._logger_instance.info("Sending email to: %s",mime_message["To"])
-            server.sendmail(self.GOOGLE_ACCOUNT_EMAIL, mime_message["To"].replace(" ", "").split(","),
-                        mime_message.as_string())
+        if self._smtp_use_tls:
+            server.starttls()
+            server.ehlo(self.GOOGLE_API_CLIENT_ID)
+        code, response = server.docmd('AUTH', 'XOAUTH2 ' + auth_string)
+        # https://developers.google.com/gmail/imap/xoauth2-protocol#smtp_protocol_exchange
+        if code != 235:
+            server.close()
+            raise smtplib.SMTPAuthenticationError(code, response)
+        return server
+
+    # Returns an idle pooled SMTP session that still responds to NOOP, or a newly opened one if none are left
+    def __checkout_smtp_connection(self):
+        while True:
+            with self._smtp_pool_lock:
+                if len(self._idle_smtp_connections) == 0:
+                    break
+                server = self._idle_smtp_connections.pop()
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            self._logger_instance.debug("Discarding pooled SMTP connection that failed its health check")
+            server.close()
+        return self.__open_smtp_connection()
+
+    # Return an SMTP session to the pool for the next send, closing it if the pool is already full
+    def __checkin_smtp_connection(self, server):
+        with self._smtp_pool_lock:
+            if len(self._idle_smtp_connections) < self._max_smtp_connections:
+                self._idle_smtp_connections.append(server)
+                return
         server.quit()
 
+    def send_mail(self, mime_message_list):
+        with metrics.SMTP_SEND_DURATION_SECONDS.time():
+            server = self.__checkout_smtp_connection()
+            try:
+                for mime_message in mime_message_list:
+                    self._logger_instance.info("Sending email to: %s",mime_message["To"])
+                    recipients = mime_message["To"].replace(" ", "").split(",")
+                    try:
+                        server.sendmail(self.GOOGLE_ACCOUNT_EMAIL, recipients, mime_message.as_string())
+                    except smtplib.SMTPServerDisconnected:
+                        # The server may drop a connection between the health check and the send, so reconnect once
+                        self._logger_instance.info("SMTP connection was closed by the server, reconnecting")
+                        try:
+                            server.close()
+                        except OSError:
+                            pass
+                        server = self.__open_smtp_connection()
+                        server.sendmail(self.GOOGLE_ACCOUNT_EMAIL, recipients, mime_message.as_string())
+                    metrics.EMAILS_SENT_TOTAL.inc()
+            except Exception:
+                # Don't return a session in an unknown state to the pool
+                server.close()
+                raise
+            self.__checkin_smtp_connection(server)
+
+    # Close all pooled SMTP sessions
+    def close(self):
+        with self._smtp_pool_lock:
+            idle_smtp_connections = self._idle_smtp_connections
+            self._idle_smtp_connections = []
+        for server in idle_smtp_connections:
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                server.close()
+
     def call_authorize_tokens(self, client_id, client_secret, authorization_code):
         params = {}
         params['client_id'] = client_id
@@ -128,9 +207,11 @@ class EmailTools:
         response = self.call_authorize_tokens(google_client_id, google_client_secret, authorization_code)
         return response['refresh_token'], response['access_token'], response['expires_in']
 
-    # Constructor to pass in logging information
+    # Constructor to pass in credentials, logging information and optionally the SMTP server to send through and the
+    # number of idle authenticated SMTP sessions to keep open between sends
     def __init__(self, google_account_email, google_api_client_id, google_api_client_secret, google_refresh_token,
-                 console_log_level, file_log_filepath, file_log_level):
+                 console_log_level, file_log_filepath, file_log_level, smtp_host="smtp.gmail.com", smtp_port=587,
+                 smtp_use_tls=True, max_smtp_connections=1):
 
         self._LOG_NAME = "EmailTools"
         self._logger_instance = get_logger_with_name(self._LOG_NAME, console_log_level,
@@ -143,6 +224,19 @@ class EmailTools:
         self.GOOGLE_API_CLIENT_SECRET = google_api_client_secret
         self.GOOGLE_REFRESH_TOKEN = google_refresh_token
 
+        # Access token cache, refreshed by get_access_token once expired
+        self._token_lock = threading.Lock()
+        self._access_token = None
+        self._access_token_expiry_time = 0
+
+        # Pool of idle authenticated SMTP sessions, reused between sends
+        self._smtp_host = smtp_host
+        self._smtp_port = smtp_port
+        self._smtp_use_tls = smtp_use_tls
+        self._max_smtp_connections = max_smtp_connections
+        self._smtp_pool_lock = threading.Lock()
+        self._idle_smtp_connections = []
+
         if google_refresh_token == "":
             # Throw an exception if the credentials are empty, providing information on how to fix
             if google_api_client_id == "" and google_api_client_secret == "":
@@ -168,17 +262,18 @@ class EmailTools:
         self._logger_instance.info("All Oauth2 credentials present. Checking for validity...")
 
         # Initialize vars outside of try block
-        access_token, expires_in = [None] * 2
+        access_token = None
 
-        # Test the authorization getting and swallow any exception, rethrowing our own exception
+        # Test the authorization getting and swallow any exception, rethrowing our own exception. The token is cached
+        # so the first send doesn't need to refresh it again
         try:
-            access_token, expires_in = self.refresh_authorization()
+            access_token = self.get_access_token()
         except Exception:
             message = "Exception thrown during initialization; Getting authorization didn't work! Check credentials."
             self._logger_instance.critical(message)
             raise ValueError(message, Exception)
 
-        if access_token != "" and expires_in > 0:
+        if access_token != "" and self._access_token_expiry_time > time.time():
             self._logger_instance.info("Credentials valid! Returning EmailTools class")
         else:
             raise Exception("Oauth2 credentials invalid! Clear your Refresh token and reauthenticate")
@@ -0,0 +1,50 @@
+import json
+import os
+from contextlib import contextmanager
+from os import path
+
+# Advisory locks are only available on POSIX. Elsewhere, JSON state files can't be shared between processes, which
+# only matters when searches are sharded
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Context manager holding an exclusive lock on a file next to the given file, so processes sharing a state directory
+# take turns reading and writing it. The lock is released if the process dies
+@contextmanager
+def locked_file(file_path):
+    if fcntl is None:
+        yield
+        return
+    with open(file_path + ".lock", 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+# Write the changed keys of a JSON object file, and remove the removed ones, keeping every other key as it is on disk so
+# keys changed by another process aren't overwritten. Goes through a temporary file so a crash mid-write can't corrupt
+# the file. Returns the merged dict that was written
+def merge_json_file(file_path, changed_dict, removed_keys=()):
+    with locked_file(file_path):
+        merged_dict = {}
+        if path.isfile(file_path):
+            try:
+                with open(file_path) as opened_file:
+                    merged_dict = json.load(opened_file)
+            except ValueError:
+                # Nothing in a corrupt file can be kept, so it's replaced with this process's keys
+                merged_dict = {}
+        merged_dict.update(changed_dict)
+        for removed_key in removed_keys:
+            merged_dict.pop(removed_key, None)
+        # The temporary file is per process, so two processes can't write to the same one
+        temporary_file_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(temporary_file_path, 'w') as opened_file:
+            json.dump(merged_dict, opened_file, indent=4, sort_keys=True)
+        os.replace(temporary_file_path, file_path)
+    return merged_dict
@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from os import path
+
+import prawcore
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Modes of the CachingRequestor. "off" sends every request to Reddit, "cache" serves GET responses from disk until
+# they expire, "record" sends every request and saves every response, and "replay" serves only saved responses
+HTTP_CACHE_MODES = ["off", "cache", "record", "replay"]
+
+# Response headers that aren't stored, or that are left out of responses served from disk. Reddit's rate limit headers
+# describe the budget at the time of the original request, so repeating them would throttle requests that never
+# reach Reddit
+UNSTORED_HEADERS = ["set-cookie", "content-encoding", "transfer-encoding", "connection"]
+RATE_LIMIT_HEADERS = ["x-ratelimit-remaining", "x-ratelimit-used", "x-ratelimit-reset"]
+
+
+# Raised in replay mode when a request has no saved response
+class HttpCacheMissError(Exception):
+    pass
+
+
+# Returns the key a request's response is stored under, made from its method, URL, query parameters and form data.
+# Headers (including the Authorization header) aren't part of the key, so responses are shared between credentials
+def get_request_key(method, url, params=None, data=None):
+    def normalize_items(items):
+        if items is None:
+            return None
+        if isinstance(items, (bytes, str)):
+            return items.decode("utf-8", "replace") if isinstance(items, bytes) else items
+        if isinstance(items, dict):
+            items = items.items()
+        return sorted([str(key), str(value)] for key, value in items)
+    return json.dumps([method.upper(), url, normalize_items(params), normalize_items(data)])
+
+
+# Drop-in replacement for the PRAW requestor that keeps responses on disk, keyed by request method, URL and parameters.
+# Passed to praw.Reddit with requestor_class and requestor_kwargs
+# https://praw.readthedocs.io/en/latest/getting_started/configuration.html#using-a-custom-requestor
+class CachingRequestor(prawcore.Requestor):
+
+    # Returns the path of the file a request key's response is stored in
+    def __get_entry_path(self, request_key):
+        return path.join(self._cache_directory, hashlib.sha256(request_key.encode("utf-8")).hexdigest() + ".json")
+
+    # Returns the stored entry dict for a request key, or None if there isn't a readable one
+    def __read_entry(self, request_key):
+        entry_path = self.__get_entry_path(request_key)
+        if not path.isfile(entry_path):
+            return None
+        try:
+            with open(entry_path) as opened_file:
+                entry = json.load(opened_file)
+        except ValueError:
+            return None
+        # Two keys landing in the same file is astronomically unlikely, but never serve another request's response
+        return entry if entry.get("request_key") == request_key else None
+
+    # Store a response under a request key, going through a temporary file so readers never see a partial entry.
+    # Returns the entry, which a read only cache doesn't store
+    def __write_entry(self, request_key, response):
+        entry = {"request_key": request_key, "stored_utc": time.time(), "status_code": response.status_code,
+                 "url": response.url, "encoding": response.encoding,
+                 "headers": {name: value for name, value in response.headers.items()
+                             if name.lower() not in UNSTORED_HEADERS},
+                 "body": base64.b64encode(response.content).decode("ascii")}
+        if self._read_only:
+            return entry
+        entry_path = self.__get_entry_path(request_key)
+        # The temporary file is per process and thread, so concurrent writers never share one
+        temporary_file_path = "{}.{}.{}.tmp".format(entry_path, os.getpid(), threading.get_ident())
+        with open(temporary_file_path, 'w') as opened_file:
+            json.dump(entry, opened_file)
+        os.replace(temporary_file_path, entry_path)
+        return entry
+
+    # Returns a requests Response rebuilt from a stored entry, without the stored rate limit headers
+    def __create_response(self, entry):
+        response = requests.Response()
+        response.status_code = entry["status_code"]
+        response.url = entry["url"]
+        response.encoding = entry["encoding"]
+        response.headers = CaseInsensitiveDict({name: value for name, value in entry["headers"].items()
+                                                if name.lower() not in RATE_LIMIT_HEADERS})
+        response._content = base64.b64decode(entry["body"])
+        return response
+
+    # Send a GET request, answering it from disk while the stored response is fresh and revalidating it with its ETag
+    # or Last-Modified header once it isn't. Only successful responses are stored
+    def __request_with_cache(self, request_key, args, timeout, kwargs):
+        entry = self.__read_entry(request_key)
+        if entry is not None and time.time() - entry["stored_utc"] < self._ttl_seconds:
+            self.cache_hits += 1
+            return self.__create_response(entry)
+
+        if entry is not None:
+            stored_headers = CaseInsensitiveDict(entry["headers"])
+            conditional_headers = {}
+            if "etag" in stored_headers:
+                conditional_headers["If-None-Match"] = stored_headers["etag"]
+            if "last-modified" in stored_headers:
+                conditional_headers["If-Modified-Since"] = stored_headers["last-modified"]
+            if len(conditional_headers) > 0:
+                kwargs["headers"] = dict(kwargs.get("headers") or {}, **conditional_headers)
+
+        response = super().request(*args, timeout=timeout, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            # Still current, so serve the stored body but pass the fresh rate limit headers on to PRAW
+            self.revalidations += 1
+            entry = self.__write_entry(request_key, self.__create_response(entry))
+            revalidated_response = self.__create_response(entry)
+            revalidated_response.headers.update({name: value for name, value in response.headers.items()
+                                                 if name.lower() in RATE_LIMIT_HEADERS})
+            return revalidated_response
+        self.cache_misses += 1
+        if response.status_code == 200:
+            self.__write_entry(request_key, response)
+        return response
+
+    # Issue the HTTP request according to the cache mode. Matches the signature of prawcore.Requestor.request, which is
+    # called both with keyword arguments and with the method and URL as positional arguments
+    def request(self, *args, timeout=None, **kwargs):
+        method = kwargs.get("method", args[0] if len(args) > 0 else "")
+        url = kwargs.get("url", args[1] if len(args) > 1 else "")
+        request_key = get_request_key(method, url, kwargs.get("params"), kwargs.get("data"))
+
+        if self._mode == "replay":
+            entry = self.__read_entry(request_key)
+            if entry is None:
+                self.cache_misses += 1
+                # Wrapped like any other failed request, which PRAW doesn't retry
+                raise prawcore.exceptions.RequestException(HttpCacheMissError(
+                    "No recorded response for {} {}".format(method.upper(), url)), args, kwargs)
+            self.cache_hits += 1
+            return self.__create_response(entry)
+
+        if self._mode == "record":
+            response = super().request(*args, timeout=timeout, **kwargs)
+            self.__write_entry(request_key, response)
+            return response
+
+        if self._mode == "cache" and method.upper() == "GET":
+            return self.__request_with_cache(request_key, args, timeout, kwargs)
+        return super().request(*args, timeout=timeout, **kwargs)
+
+    # Constructor to pass in the directory responses are kept in, the cache mode, and how many seconds a stored
+    # response is served without revalidation in cache mode. A read only cache serves stored responses as usual but
+    # never writes to the directory. Any other arguments are passed to prawcore.Requestor
+    def __init__(self, *args, cache_directory, mode="cache", ttl_seconds=300, read_only=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if mode not in HTTP_CACHE_MODES:
+            raise ValueError("HTTP cache mode [{}] is not one of {}".format(mode, HTTP_CACHE_MODES))
+        self._cache_directory = cache_directory
+        self._mode = mode
+        self._ttl_seconds = ttl_seconds
+        self._read_only = read_only
+        # Counts of the requests answered from disk, sent to Reddit, and revalidated with a 304 response
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.revalidations = 0
+        if not read_only:
+            os.makedirs(cache_directory, exist_ok=True)
@@ -1,7 +1,11 @@
 import json
+import os
 from os import path
 
-from util.log_setup import get_logger_with_name
+from util.log_setup import get_logger_with_name, set_log_format
+
+# Cached in place of the result of a lookup for a key that isn't defined in any config
+VALUE_NOT_FOUND = object()
 
 
 # https://stackoverflow.com/questions/19078170/python-how-would-you-save-a-simple-settings-config-file
@@ -58,18 +62,73 @@ class JsonConfig:
                     # Mirror the behavior of our base case by returning a list
                     return [None]
 
-    # Given a key of a value to look for, find it in the object and return it
+    # Returns every dotted key that can be found in the object, like "logging" and "logging.file_log_level"
+    def __collect_keys(self, remaining_obj, key_prefix, key_set):
+        if isinstance(remaining_obj, list):
+            # Lists of objects are searched through transparently, so their keys don't add a level
+            for inner_obj in remaining_obj:
+                self.__collect_keys(inner_obj, key_prefix, key_set)
+        elif isinstance(remaining_obj, dict):
+            for key, value in remaining_obj.items():
+                key_set.add(key_prefix + key)
+                self.__collect_keys(value, key_prefix + key + ".", key_set)
+
+    # Returns a list with the flattened search result for the key in each config, in override order
+    def __search_configs(self, key):
+        if key in self._key_index:
+            return self._key_index[key]
+        return [self.__flatten_list(self.__parsed_json_search(key, config_tuple[1]))
+                for config_tuple in self._config_tuples]
+
+    # Called whenever config files are ingested, this private method precomputes the flattened search result of every
+    # key present in any config, and clears the lookups resolved from the previous configs
+    def __build_key_index(self):
+        key_set = set()
+        for config_tuple in self._config_tuples:
+            self.__collect_keys(config_tuple[1], "", key_set)
+
+        self._key_index = {}
+        self._lookup_cache = {}
+        for key in key_set:
+            try:
+                self._key_index[key] = self.__search_configs(key)
+            except (AttributeError, TypeError):
+                # Keys that can't be searched in every config are left to raise when they are looked up
+                pass
+
+    # Given a key of a value to look for, find it in the object and return it. Lookups are resolved once for each
+    # combination of arguments and then served from a cache until the config files are ingested again
     def get_config_value(self, key, simplify_singleton=True, remove_none=False, fail_quietly=False):
 
         if key == "":
             # https://realpython.com/python-exceptions/
             raise Exception("Empty key passed in, a value cannot be found")
 
-        # iterate through the config_values list of tuples. If the value is present, return it.
+        cache_key = (key, simplify_singleton, remove_none)
+        if cache_key not in self._lookup_cache:
+            self._lookup_cache[cache_key] = self.__resolve_config_value(key, simplify_singleton, remove_none)
+        search_result = self._lookup_cache[cache_key]
+
+        if search_result is not VALUE_NOT_FOUND:
+            # Copy lists so a caller modifying the returned value can't change the cached one
+            return list(search_result) if isinstance(search_result, list) else search_result
+
+        # If there are no configs left to check, the key isn't defined. Throw an exception
+        message = "Value could not be found for key [{}]".format(key)
+        # Allow the function to exit cleanly if desired (Use case: value is optional)
+        if fail_quietly:
+            self._logger_instance.info(message)
+            return None
+        else:
+            self._logger_instance.critical(message)
+            raise Exception(message)
+
+    # Resolve a key against the configs in override order, returning VALUE_NOT_FOUND if no config defines it
+    def __resolve_config_value(self, key, simplify_singleton, remove_none):
+
+        # iterate through the search results of each config. If the value is present, return it.
         # Otherwise continue to the fallback config, until we have no more configs left to check
-        for config_tuple in self._config_tuples:
-            # search_result list can be a nested list, so flatten it
-            search_result = self.__flatten_list(self.__parsed_json_search(key, config_tuple[1]))
+        for search_result in self.__search_configs(key):
 
             # If parameter is set to True (default=False) remove None items from the search result
             if remove_none:
@@ -84,15 +143,7 @@ class JsonConfig:
                 else:
                     return search_result
 
-        # If there are no configs left to check, the key isn't defined. Throw an exception
-        message = "Value could not be found for key [{}]".format(key)
-        # Allow the function to exit cleanly if desired (Use case: value is optional)
-        if fail_quietly:
-            self._logger_instance.info(message)
-            return None
-        else:
-            self._logger_instance.critical(message)
-            raise Exception(message)
+        return VALUE_NOT_FOUND
 
     # Called after config files are ingested, this private method replaces the logger with a configured version
     # Private Methods: https://linux.die.net/diveintopython/html/object_oriented_framework/private_functions.html
@@ -103,10 +154,60 @@ class JsonConfig:
         config_console_log_level = self.get_config_value("logging.console_log_level")
         config_file_log_level = self.get_config_value("logging.file_log_level")
         config_file_log_filepath = self.get_config_value("logging.file_log_absolute_path")
+        # The format applies to every logger, including ones already set up
+        set_log_format(self.get_config_value("logging.log_format", fail_quietly=True) or "text")
 
         self._logger_instance = get_logger_with_name(self._LOG_NAME, config_console_log_level, config_file_log_filepath,
                                                      config_file_log_level)
 
+    # Returns the list of modification times of the config files, in the same order as the files
+    def __get_file_mtimes(self):
+        return [os.stat(config_tuple[0]).st_mtime_ns for config_tuple in self._config_tuples]
+
+    # Returns the set of top level keys whose merged value differs between two lists of config tuples
+    def __get_changed_keys(self, old_config_tuples, new_config_tuples):
+        key_set = set()
+        for config_tuple in old_config_tuples + new_config_tuples:
+            key_set.update(config_tuple[1].keys())
+        return set(key for key in key_set if [config_tuple[1].get(key) for config_tuple in old_config_tuples] !=
+                   [config_tuple[1].get(key) for config_tuple in new_config_tuples])
+
+    # Re-ingest the config files if any has been modified since it was last read, replacing the config all at once.
+    # The optional validate function is called with this JsonConfig after the new values are in place, and should
+    # raise an exception if they aren't usable. If a file can't be read or parsed, or fails validation, the previous
+    # config is kept. Returns the set of top level keys that changed, which is empty if nothing was reloaded
+    def reload_if_changed(self, validate_function=None):
+        try:
+            file_mtime_list = self.__get_file_mtimes()
+        except OSError as exception:
+            self._logger_instance.error("Config file can't be checked for changes, keeping the current config: %s",
+                                        exception)
+            return set()
+        if file_mtime_list == self._file_mtime_list:
+            return set()
+        # Whatever the outcome, don't retry these versions of the files on every check
+        self._file_mtime_list = file_mtime_list
+
+        old_config_state = (self._config_tuples, self._key_index, self._lookup_cache)
+        try:
+            new_config_tuples = []
+            for config_tuple in self._config_tuples:
+                with open(config_tuple[0]) as file_data:
+                    new_config_tuples.append((config_tuple[0], json.load(file_data)))
+            self._config_tuples = new_config_tuples
+            self.__build_key_index()
+            if validate_function is not None:
+                validate_function(self)
+        except Exception as exception:
+            self._config_tuples, self._key_index, self._lookup_cache = old_config_state
+            self._logger_instance.error("Modified config files were rejected, keeping the current config: %s",
+                                        exception)
+            return set()
+
+        changed_key_set = self.__get_changed_keys(old_config_state[0], self._config_tuples)
+        self._logger_instance.info("Config files reloaded, changed keys: %s", ", ".join(sorted(changed_key_set)))
+        return changed_key_set
+
     # Constructor to pass in a list of JSON config file paths, with override values first and fallback values after
     def __init__(self, file_path_list):
 
@@ -115,6 +216,9 @@ class JsonConfig:
 
         # Store a list of tuples of the format ("file_path",dict) so we can track the source of each config
         self._config_tuples = []
+        # Flattened search results of each key in each config, and the lookups resolved from them
+        self._key_index = {}
+        self._lookup_cache = {}
 
         if isinstance(file_path_list, str):
             file_path_list = [file_path_list]
@@ -134,6 +238,8 @@ class JsonConfig:
                 # Add a new tuple to the config values list
                 self._config_tuples.append((filename, json.load(file_data)))
 
+        self._file_mtime_list = self.__get_file_mtimes()
+        self.__build_key_index()
         self.__bootstrap_logger()
         self._logger_instance.debug("Ingested Config files are: {}".format(self._config_tuples))
         self._logger_instance.info("Config files successfully ingested!")
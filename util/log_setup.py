@@ -1,16 +1,53 @@
 # https://docs.python.org/3/howto/logging.html#logging-basic-tutorial
 # https://www.toptal.com/python/in-depth-python-logging
+import atexit
+import json
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 LOG_FORMATTER = logging.Formatter("%(asctime)s[%(name)s][%(levelname)s]: %(message)s", datefmt='%Y-%m-%dT%H:%M:%S%z')
 
+# Argument types that can't change between a message being logged and being formatted on the writer thread
+IMMUTABLE_ARG_TYPES = (str, int, float, bool, bytes, type(None))
+
+
+# Formats each record as a single line JSON object, for log collectors that parse structured logs
+class JsonLogFormatter(logging.Formatter):
+
+    def format(self, record):
+        log_dict = {"time": self.formatTime(record, self.datefmt), "logger": record.name, "level": record.levelname,
+                    "message": record.getMessage(), "thread": record.threadName}
+        if record.exc_info:
+            log_dict["exception"] = self.formatException(record.exc_info)
+        return json.dumps(log_dict)
+
+    def __init__(self):
+        super().__init__(datefmt='%Y-%m-%dT%H:%M:%S%z')
+
+
+# Formatters selectable with the logging.log_format setting
+LOG_FORMATTER_DICT = {"text": LOG_FORMATTER, "json": JsonLogFormatter()}
+
+
+# Hands records to the writer thread without formatting them, so the caller only pays for creating the record. The
+# message is merged with its arguments up front only when an argument could be changed before it's written
+class DeferredQueueHandler(QueueHandler):
+
+    def prepare(self, record):
+        if record.args and not (isinstance(record.args, tuple) and
+                                all(isinstance(arg, IMMUTABLE_ARG_TYPES) for arg in record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
 
 def get_console_handler(log_level):
 
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(LOG_FORMATTER)
+    console_handler.setFormatter(_log_state["formatter"])
     console_handler.setLevel(log_level)
     return console_handler
 
@@ -20,28 +57,84 @@ def get_file_handler(log_file, log_level):
     # https://docs.python.org/3/library/logging.handlers.html
     # Set write mode to append https://docs.python.org/3/library/functions.html#filemodes
     file_handler = RotatingFileHandler(log_file, mode='a', maxBytes=1000000, backupCount=10)
-    file_handler.setFormatter(LOG_FORMATTER)
+    file_handler.setFormatter(_log_state["formatter"])
     file_handler.setLevel(log_level)
     return file_handler
 
 
+# Returns the shared handler writing to the console, or to a log file, at the given level. Loggers share handlers so
+# there's only ever one handler rotating each log file
+def get_shared_handler(log_level, log_filename=None):
+    handler_key = (log_filename, logging.getLevelName(log_level) if isinstance(log_level, int) else log_level)
+    if handler_key not in _log_state["handlers"]:
+        if log_filename is None:
+            _log_state["handlers"][handler_key] = get_console_handler(log_level)
+        else:
+            _log_state["handlers"][handler_key] = get_file_handler(log_filename, log_level)
+    return _log_state["handlers"][handler_key]
+
+
+# Returns the queue handler feeding the writer thread for a set of handlers, starting the thread if there isn't one
+# for that set yet. Slow writes, like a file being rotated, then never hold up the thread that logged the message
+def get_queue_handler(handler_tuple):
+    if handler_tuple not in _log_state["listeners"]:
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, *handler_tuple, respect_handler_level=True)
+        listener.start()
+        _log_state["listeners"][handler_tuple] = (listener, DeferredQueueHandler(log_queue))
+    return _log_state["listeners"][handler_tuple][1]
+
+
+# Choose the format of every log line, "text" or "json", including the lines of loggers set up already
+def set_log_format(log_format):
+    if log_format not in LOG_FORMATTER_DICT:
+        raise ValueError("Log format [{}] is not one of {}".format(log_format, sorted(LOG_FORMATTER_DICT.keys())))
+    with _log_state["lock"]:
+        _log_state["formatter"] = LOG_FORMATTER_DICT[log_format]
+        for handler in _log_state["handlers"].values():
+            handler.setFormatter(_log_state["formatter"])
+
+
+# Write out every queued message and stop the writer threads. Called when the interpreter exits
+def stop_log_listeners():
+    with _log_state["lock"]:
+        listener_list = [listener for listener, queue_handler in _log_state["listeners"].values()]
+        _log_state["listeners"] = {}
+    for listener in listener_list:
+        listener.stop()
+
+
 def get_logger_with_name(log_name, log_level_console="INFO", log_filename="", log_level_file="INFO"):
 
     logger = logging.getLogger(log_name)
-    # With this pattern, it's rarely necessary to propagate the error up to parent
-    logger.propagate = False
-    # Set the root logger to the lowest level so its handlers set logging limits instead
-    logger.setLevel(logging.DEBUG)
+    # Each logger is configured once, and only set up again if it's asked for with different settings
+    logger_settings = (log_level_console, log_filename or None, log_level_file)
+    with _log_state["lock"]:
+        if _log_state["loggers"].get(log_name) == logger_settings:
+            return logger
 
-    # If the logger was initialized earlier, an old handler might be hanging around. Remove it.
-    for handler in logger.handlers:
-        logger.removeHandler(handler)
+        handler_list = [get_shared_handler(log_level_console)]
+        # Only add a Handler for file logging if the file path passed in is not empty
+        if log_filename:
+            handler_list.append(get_shared_handler(log_level_file, log_filename))
 
-    logger.addHandler(get_console_handler(log_level_console))
+        # With this pattern, it's rarely necessary to propagate the error up to parent
+        logger.propagate = False
+        # The logger drops anything none of its handlers would write before a record is even created, so disabled
+        # debug lines cost a single level check
+        logger.setLevel(min(handler.level for handler in handler_list))
 
-    # Only add a Handler for file logging if the file path passed in is not empty
-    if not log_filename == "":
-        logger.debug("Adding handler for log file %s with log level %s", log_filename, log_level_file)
-        logger.addHandler(get_file_handler(log_filename, log_level_file))
+        # If the logger was initialized earlier, an old handler might be hanging around. Remove it.
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(get_queue_handler(tuple(handler_list)))
+        _log_state["loggers"][log_name] = logger_settings
 
+    if log_filename:
+        logger.debug("Adding handler for log file %s with log level %s", log_filename, log_level_file)
     return logger
+
+
+# Handlers, writer threads and logger settings shared by every logger in the process
+_log_state = {"lock": threading.RLock(), "formatter": LOG_FORMATTER, "handlers": {}, "listeners": {}, "loggers": {}}
+atexit.register(stop_log_listeners)
@@ -0,0 +1,251 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the buckets that durations are counted in, spanning quick lookups to hour-long cycles
+DEFAULT_DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+# Content type of the Prometheus text exposition format
+# https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Returns a label value escaped for the Prometheus text format
+def escape_label_value(label_value):
+    return str(label_value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Returns the {name="value",...} label set string of a metric sample, or an empty string if there are no labels
+def format_labels(label_names, label_values, extra_label_pairs=()):
+    label_pairs = list(zip(label_names, label_values)) + list(extra_label_pairs)
+    if len(label_pairs) == 0:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(label_name, escape_label_value(label_value))
+                          for label_name, label_value in label_pairs) + "}"
+
+
+# Returns a float formatted the way Prometheus expects, with infinities spelled out
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+# Base of the metric types, holding one value per combination of label values
+class Metric:
+
+    METRIC_TYPE = ""
+
+    # Returns the tuple of label values for the keyword arguments, which must name every label of the metric
+    def _get_label_values(self, label_dict):
+        if set(label_dict.keys()) != set(self._label_names):
+            raise ValueError("Metric {} takes the labels {}, not {}".format(self.name, self._label_names,
+                                                                           sorted(label_dict.keys())))
+        return tuple(str(label_dict[label_name]) for label_name in self._label_names)
+
+    # Returns the value for the given label values, or None if it was never set
+    def get(self, **label_dict):
+        label_values = self._get_label_values(label_dict)
+        with self._lock:
+            return self._value_dict.get(label_values)
+
+    # Returns the sample lines of the metric in the Prometheus text format
+    def _get_sample_lines(self):
+        with self._lock:
+            return ["{}{} {}".format(self.name, format_labels(self._label_names, label_values), format_value(value))
+                    for label_values, value in sorted(self._value_dict.items())]
+
+    # Returns the metric in the Prometheus text format, including its HELP and TYPE comments
+    def render(self):
+        return "\n".join(["# HELP {} {}".format(self.name, self.help_text),
+                          "# TYPE {} {}".format(self.name, self.METRIC_TYPE)] + self._get_sample_lines())
+
+    # Constructor to pass in the metric name, its help text and the names of its labels
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self._label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        # Maps each tuple of label values to the value for it
+        self._value_dict = {}
+
+
+# A count that only goes up, like the number of results fetched
+class Counter(Metric):
+
+    METRIC_TYPE = "counter"
+
+    # Add the amount to the count for the given label values
+    def inc(self, amount=1, **label_dict):
+        label_values = self._get_label_values(label_dict)
+        with self._lock:
+            self._value_dict[label_values] = self._value_dict.get(label_values, 0) + amount
+
+
+# A value that can be set to anything, like the duration of the last cycle
+class Gauge(Metric):
+
+    METRIC_TYPE = "gauge"
+
+    # Set the value for the given label values
+    def set(self, value, **label_dict):
+        label_values = self._get_label_values(label_dict)
+        with self._lock:
+            self._value_dict[label_values] = value
+
+
+# Counts observations, like durations, in cumulative buckets along with their sum, so quantiles can be estimated
+class Histogram(Metric):
+
+    METRIC_TYPE = "histogram"
+
+    # Record an observed value for the given label values
+    def observe(self, value, **label_dict):
+        label_values = self._get_label_values(label_dict)
+        with self._lock:
+            bucket_counts, value_sum, value_count = self._value_dict.get(label_values,
+                                                                         ([0] * len(self._buckets), 0, 0))
+            bucket_counts = [bucket_count + (1 if value <= upper_bound else 0)
+                             for bucket_count, upper_bound in zip(bucket_counts, self._buckets)]
+            self._value_dict[label_values] = (bucket_counts, value_sum + value, value_count + 1)
+
+    # Returns the (count, sum) of the values observed for the given label values
+    def get_totals(self, **label_dict):
+        label_values = self._get_label_values(label_dict)
+        with self._lock:
+            bucket_counts, value_sum, value_count = self._value_dict.get(label_values, ([], 0, 0))
+        return value_count, value_sum
+
+    # Context manager observing the seconds its block took, whether or not the block raised
+    @contextmanager
+    def time(self, **label_dict):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **label_dict)
+
+    def _get_sample_lines(self):
+        sample_lines = []
+        with self._lock:
+            for label_values, (bucket_counts, value_sum, value_count) in sorted(self._value_dict.items()):
+                for upper_bound, bucket_count in zip(self._buckets, bucket_counts):
+                    sample_lines.append("{}_bucket{} {}".format(self.name, format_labels(
+                        self._label_names, label_values, [("le", format_value(upper_bound))]), bucket_count))
+                labels = format_labels(self._label_names, label_values)
+                sample_lines.append("{}_sum{} {}".format(self.name, labels, format_value(value_sum)))
+                sample_lines.append("{}_count{} {}".format(self.name, labels, value_count))
+        return sample_lines
+
+    # Constructor to pass in the metric name, its help text, the names of its labels and the upper bounds of its
+    # buckets. A bucket for every value (+Inf) is always added
+    def __init__(self, name, help_text, label_names=(), buckets=None):
+        super().__init__(name, help_text, label_names)
+        self._buckets = sorted(set(buckets or DEFAULT_DURATION_BUCKETS) | {float("inf")})
+
+
+# Holds a set of metrics to render together, either served over HTTP or written to a file
+class MetricsRegistry:
+
+    # Add a metric to the registry and return it
+    def register(self, metric):
+        with self._lock:
+            self._metric_list.append(metric)
+        return metric
+
+    # Returns every registered metric in the Prometheus text format
+    def render(self):
+        with self._lock:
+            metric_list = list(self._metric_list)
+        return "\n".join(metric.render() for metric in metric_list) + "\n"
+
+    # Write the metrics to a file for the node exporter's textfile collector, going through a temporary file so the
+    # collector never reads a partial file
+    # https://github.com/prometheus/node_exporter#textfile-collector
+    def write_textfile(self, file_path):
+        temporary_file_path = file_path + ".tmp"
+        with open(temporary_file_path, 'w') as opened_file:
+            opened_file.write(self.render())
+        os.replace(temporary_file_path, file_path)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metric_list = []
+
+
+# Serves a registry's metrics at /metrics over HTTP from a background thread
+class MetricsServer:
+
+    # Returns the port the server is listening on
+    def get_port(self):
+        return self._http_server.server_port
+
+    def shutdown(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+
+    # Constructor to pass in the registry to serve and the address to listen on, which starts the server
+    def __init__(self, registry, host="127.0.0.1", port=9464):
+        # Only loaded when metrics are served, as single runs write them to a file instead
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            # Requests aren't logged, as a scraper would fill the console with them
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._http_server.daemon_threads = True
+        threading.Thread(target=self._http_server.serve_forever, name="metrics", daemon=True).start()
+
+
+# The project's metrics, recorded wherever each stage happens
+REGISTRY = MetricsRegistry()
+SEARCH_DURATION_SECONDS = REGISTRY.register(Histogram(
+    "reddit_search_duration_seconds", "Seconds taken by the Reddit query each search ran in, including paging",
+    ["search"]))
+SEARCH_RESULTS_TOTAL = REGISTRY.register(Counter(
+    "reddit_search_results_total", "Submissions each search found, before dedupe", ["search"]))
+SEARCH_FAILURES_TOTAL = REGISTRY.register(Counter(
+    "reddit_search_failures_total", "Reddit searches that failed", ["search"]))
+DEDUPE_SUBMISSIONS_TOTAL = REGISTRY.register(Counter(
+    "dedupe_submissions_total", "Submissions checked against the dedupe store, by whether they were already seen",
+    ["result"]))
+DEDUPE_DURATION_SECONDS = REGISTRY.register(Histogram(
+    "dedupe_duration_seconds", "Seconds taken to dedupe and record each cycle's results"))
+EMAIL_RENDER_DURATION_SECONDS = REGISTRY.register(Histogram(
+    "email_render_duration_seconds", "Seconds taken to render each cycle's emails"))
+SMTP_SEND_DURATION_SECONDS = REGISTRY.register(Histogram(
+    "smtp_send_duration_seconds", "Seconds taken to send each batch of emails over SMTP"))
+EMAILS_SENT_TOTAL = REGISTRY.register(Counter(
+    "emails_sent_total", "Emails sent"))
+EMAIL_SEND_FAILURES_TOTAL = REGISTRY.register(Counter(
+    "email_send_failures_total", "Failed attempts at sending a spooled email"))
+EMAIL_SPOOL_PENDING = REGISTRY.register(Gauge(
+    "email_spool_pending", "Emails in the spool waiting to be sent or retried"))
+DIGEST_BUFFER_PENDING = REGISTRY.register(Gauge(
+    "digest_buffer_pending", "Results held in the digest buffer until their recipient's digest is due"))
+TOKEN_REFRESHES_TOTAL = REGISTRY.register(Counter(
+    "oauth_token_refreshes_total", "OAuth access tokens fetched", ["service"]))
+CYCLE_DURATION_SECONDS = REGISTRY.register(Histogram(
+    "search_cycle_duration_seconds", "Seconds taken by each cycle of searching, deduping and emailing"))
+LAST_CYCLE_DURATION_SECONDS = REGISTRY.register(Gauge(
+    "search_cycle_last_duration_seconds", "Seconds taken by the most recent cycle"))
+LAST_CYCLE_END_TIMESTAMP = REGISTRY.register(Gauge(
+    "search_cycle_last_end_timestamp_seconds", "Unix time the most recent cycle finished"))
+SEARCH_INTERVAL_SECONDS = REGISTRY.register(Gauge(
+    "search_interval_seconds", "Seconds between runs of each search, to compare cycle durations against",
+    ["search"]))
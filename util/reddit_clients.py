@@ -0,0 +1,147 @@
+import threading
+import time
+
+import praw
+import prawcore
+
+from util.log_setup import get_logger_with_name
+
+# Seconds a credential is rested after Reddit answers 429 Too Many Requests without a usable retry-after header
+DEFAULT_THROTTLE_SECONDS = 60
+
+
+# Returns True if the exception means a credential was rejected, as opposed to a problem with the request itself
+def is_auth_failure(exception):
+    if isinstance(exception, (prawcore.exceptions.OAuthException, prawcore.exceptions.InvalidToken)):
+        return True
+    # Refused requests for an access token are raised as plain response exceptions
+    return isinstance(exception, prawcore.exceptions.ResponseException) and \
+        getattr(exception.response, "status_code", None) == 401
+
+
+# Raised when every configured Reddit credential has been rejected
+class NoRedditCredentialsError(Exception):
+    pass
+
+
+# Keeps a Reddit client per configured credential set and hands searches the least loaded of them, judged by the rate
+# limit budget Reddit last reported for each credential less the searches already using it. A throttled credential is
+# rested until its window resets and a rejected one is dropped, with searches failing over to the others.
+# PRAW instances are not thread safe, so each thread lazily gets its own instance of each credential's client
+class RedditClientPool:
+
+    # Returns a short, loggable name for a credential that doesn't reveal its secret
+    def __get_credential_name(self, slot_index):
+        return "#{} ({})".format(slot_index, self._credential_list[slot_index][0][:4] + "...")
+
+    # Returns the rate limit budget of a credential available to a new search, which is unlimited until Reddit has
+    # reported one. Budgets whose window has reset are counted as unlimited again
+    def __get_available_budget(self, slot, now):
+        if slot["remaining"] is None or (slot["reset_timestamp"] is not None and slot["reset_timestamp"] <= now):
+            return float("inf")
+        # Keep one request in reserve per search already using the credential, as each may be about to make one
+        return slot["remaining"] - slot["in_flight"]
+
+    # Pick the least loaded usable credential and reserve it for a search, waiting for a throttled credential's window
+    # to reset if all of them are exhausted. Returns the credential's slot index, to be passed to get_reddit and release
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                best_slot_index = None
+                best_score = None
+                next_available_time = None
+                for slot_index, slot in enumerate(self._slot_list):
+                    if slot["revoked"]:
+                        continue
+                    available_budget = self.__get_available_budget(slot, now)
+                    if slot["throttled_until"] > now or available_budget <= 0:
+                        available_time = max(slot["throttled_until"], slot["reset_timestamp"] or now)
+                        if next_available_time is None or available_time < next_available_time:
+                            next_available_time = available_time
+                        continue
+                    score = (available_budget, -slot["in_flight"])
+                    if best_score is None or score > best_score:
+                        best_slot_index, best_score = slot_index, score
+
+                if best_slot_index is not None:
+                    self._slot_list[best_slot_index]["in_flight"] += 1
+                    return best_slot_index
+                if next_available_time is None:
+                    raise NoRedditCredentialsError("Every configured Reddit credential has been rejected")
+
+            wait_seconds = max(0.0, next_available_time - time.time())
+            self._logger_instance.warning("Every Reddit credential is out of requests, waiting %.1f seconds for the "
+                                          "first reset", wait_seconds)
+            time.sleep(wait_seconds)
+
+    # Returns the calling thread's Reddit instance for the credential
+    def get_reddit(self, slot_index):
+        if not hasattr(self._thread_local, "reddit_dict"):
+            self._thread_local.reddit_dict = {}
+        if slot_index not in self._thread_local.reddit_dict:
+            client_id, client_secret = self._credential_list[slot_index]
+            self._thread_local.reddit_dict[slot_index] = praw.Reddit(client_id=client_id, client_secret=client_secret,
+                                                                     user_agent=self._user_agent,
+                                                                     requestor_class=self._requestor_class,
+                                                                     requestor_kwargs=self._requestor_kwargs,
+                                                                     **self._praw_settings)
+        return self._thread_local.reddit_dict[slot_index]
+
+    # Release a credential reserved by acquire, recording the rate limit headers Reddit returned to it and, if the
+    # search failed, whether the failure means the credential is throttled or was rejected
+    def release(self, slot_index, exception=None):
+        # https://praw.readthedocs.io/en/latest/code_overview/other/auth.html#praw.models.Auth.limits
+        limits = self.get_reddit(slot_index).auth.limits
+        with self._lock:
+            slot = self._slot_list[slot_index]
+            slot["in_flight"] -= 1
+            if limits.get("remaining") is not None:
+                slot["remaining"] = limits.get("remaining")
+                slot["reset_timestamp"] = limits.get("reset_timestamp")
+
+            if isinstance(exception, prawcore.exceptions.TooManyRequests):
+                try:
+                    throttle_seconds = float(exception.retry_after)
+                except (TypeError, ValueError):
+                    throttle_seconds = DEFAULT_THROTTLE_SECONDS
+                slot["throttled_until"] = time.time() + throttle_seconds
+                self._logger_instance.warning("Reddit credential %s was throttled, resting it for %.1f seconds",
+                                              self.__get_credential_name(slot_index), throttle_seconds)
+            elif exception is not None and is_auth_failure(exception):
+                slot["revoked"] = True
+                self._logger_instance.error("Reddit credential %s was rejected and won't be used again until it's "
+                                            "changed in the config: %r", self.__get_credential_name(slot_index),
+                                            exception)
+
+    # Returns True if the failure of a search using a credential can be retried with another credential
+    def should_fail_over(self, exception):
+        return isinstance(exception, prawcore.exceptions.TooManyRequests) or is_auth_failure(exception)
+
+    # Returns the number of credentials that haven't been rejected
+    def get_usable_count(self):
+        with self._lock:
+            return len([slot for slot in self._slot_list if not slot["revoked"]])
+
+    # Returns a list of (credential_name, remaining, in_flight, revoked) tuples describing each credential
+    def get_status(self):
+        with self._lock:
+            return [(self.__get_credential_name(slot_index), slot["remaining"], slot["in_flight"], slot["revoked"])
+                    for slot_index, slot in enumerate(self._slot_list)]
+
+    # Constructor to pass in a list of (client_id, client_secret) tuples, the user agent, logging information, and
+    # optionally the requestor class and arguments and a dict of other PRAW settings every Reddit instance is created with
+    def __init__(self, credential_list, user_agent, console_log_level="INFO", file_log_filepath="",
+                 file_log_level="INFO", requestor_class=None, requestor_kwargs=None, praw_settings=None):
+        self._logger_instance = get_logger_with_name("RedditClientPool", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._credential_list = list(credential_list)
+        self._user_agent = user_agent
+        self._requestor_class = requestor_class
+        self._requestor_kwargs = requestor_kwargs
+        self._praw_settings = dict(praw_settings or {})
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+        self._slot_list = [{"remaining": None, "reset_timestamp": None, "in_flight": 0, "throttled_until": 0,
+                            "revoked": False} for credential in self._credential_list]
+        self._logger_instance.info("Using %d Reddit credentials", len(self._credential_list))
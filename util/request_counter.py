@@ -0,0 +1,34 @@
+import threading
+
+import prawcore
+
+
+# Counts the HTTP requests PRAW makes, per thread, so the cost of a search can be read off the thread it ran on.
+# Requests to a search endpoint are also counted as listing pages
+class RequestCounter:
+
+    # Returns the (request count, search page count) of the calling thread so far
+    def get_thread_counts(self):
+        return getattr(self._thread_local, "request_count", 0), getattr(self._thread_local, "page_count", 0)
+
+    # Record a request made by the calling thread to the given URL
+    def record_request(self, url):
+        self._thread_local.request_count = getattr(self._thread_local, "request_count", 0) + 1
+        if "/search" in str(url):
+            self._thread_local.page_count = getattr(self._thread_local, "page_count", 0) + 1
+
+    # Returns a subclass of the requestor class (PRAW's default if None) that records every request it makes here.
+    # Passed to praw.Reddit with requestor_class, so it also covers requests served by the CachingRequestor
+    def create_requestor_class(self, requestor_class=None):
+        request_counter = self
+
+        class CountingRequestor(requestor_class or prawcore.Requestor):
+
+            def request(self, *args, **kwargs):
+                request_counter.record_request(args[1] if len(args) > 1 else kwargs.get("url"))
+                return super().request(*args, **kwargs)
+
+        return CountingRequestor
+
+    def __init__(self):
+        self._thread_local = threading.local()
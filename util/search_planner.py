@@ -0,0 +1,110 @@
+import hashlib
+
+from util.search_query import SearchQueryError, get_required_terms, parse_search_query
+
+# Reddit rejects search queries longer than this many characters
+MAX_REDDIT_QUERY_LENGTH = 512
+
+
+# Returns the subreddits string in a canonical form, so "b+A" and "a+b" are recognized as the same multireddit
+def normalize_subreddits(subreddits):
+    return "+".join(sorted(set(subreddit.strip().lower() for subreddit in subreddits.split("+"))))
+
+
+# Returns the search string with runs of whitespace collapsed, which doesn't change what Reddit matches
+def normalize_search_string(search_string):
+    return " ".join(search_string.split())
+
+
+# Groups the configured searches by the Reddit query they would make, so each unique query only runs once.
+# Returns an ordered dict of (subreddits, search_string) keys mapping to the list of (email_recipient, search_name)
+# tuples whose results the query should be fanned out to
+def plan_searches(search_list, default_email_recipient):
+    query_dict = {}
+    for search_params in search_list:
+        # Use optional configuration for email recipient alongside each search, otherwise default to the fallback
+        email_recipient = search_params.get("email_recipient", default_email_recipient)
+        query_key = (normalize_subreddits(search_params.get("subreddits")),
+                     normalize_search_string(search_params.get("search_params")))
+        query_dict.setdefault(query_key, []).append((email_recipient, search_params.get("search_name")))
+    return query_dict
+
+
+# Returns the index of the shard, out of shard_count, that runs the planned query with the given (subreddits,
+# search_string) key. Uses rendezvous hashing on a stable hash rather than Python's per-process one, so every worker
+# agrees on the assignment, and changing the number of shards only moves the queries of the shards added or removed
+def get_shard_index(query_key, shard_count):
+    return max(range(shard_count), key=lambda shard_index: hashlib.sha256("{}|{}|{}".format(
+        shard_index, *query_key).encode("utf-8")).digest())
+
+
+# Returns the planned queries run by the given shard. Queries are sharded rather than searches, so the searches sharing
+# a query are still coalesced on one shard
+def get_shard_queries(query_dict, shard_index, shard_count):
+    return {query_key: search_targets for query_key, search_targets in query_dict.items()
+            if get_shard_index(query_key, shard_count) == shard_index}
+
+
+# Convert planned queries into batches of (subreddits, search_string, members) that are each one Reddit query, where
+# members is a list of (query_node, search_targets) tuples. A query_node of None means every result of the batch is
+# a result for those search targets, otherwise it's matched locally against each result with match_search_query
+def get_unbatched_queries(query_dict):
+    return [(subreddits, search_string, [(None, search_targets)])
+            for (subreddits, search_string), search_targets in query_dict.items()]
+
+
+# Returns the Reddit query that matches the union of the given search strings
+def combine_search_strings(search_string_list):
+    if len(search_string_list) == 1:
+        return search_string_list[0]
+    return " OR ".join("({})".format(search_string) for search_string in search_string_list)
+
+
+# Like get_unbatched_queries, but queries on the same subreddits are combined with OR into as few Reddit queries as
+# the query length limit allows. Queries the local evaluator can't match, or that don't require any term to be
+# present (which would widen the combined query to nearly every post), are left to run on their own
+def get_batched_queries(query_dict, max_query_length=MAX_REDDIT_QUERY_LENGTH):
+    batch_list = []
+    # Maps subreddits to the list of (search_string, query_node, search_targets) in the batch currently being filled
+    open_batch_dict = {}
+
+    def close_batch(subreddits):
+        open_batch = open_batch_dict.pop(subreddits)
+        if len(open_batch) == 1:
+            batch_list.append((subreddits, open_batch[0][0], [(None, open_batch[0][2])]))
+        else:
+            batch_list.append((subreddits, combine_search_strings([member[0] for member in open_batch]),
+                               [(member[1], member[2]) for member in open_batch]))
+
+    for (subreddits, search_string), search_targets in query_dict.items():
+        try:
+            query_node = parse_search_query(search_string)
+        except SearchQueryError:
+            query_node = None
+        if query_node is None or get_required_terms(query_node) is None:
+            batch_list.append((subreddits, search_string, [(None, search_targets)]))
+            continue
+
+        open_batch = open_batch_dict.get(subreddits, [])
+        combined_search_string = combine_search_strings([member[0] for member in open_batch] + [search_string])
+        if len(open_batch) > 0 and len(combined_search_string) > max_query_length:
+            close_batch(subreddits)
+        open_batch_dict.setdefault(subreddits, []).append((search_string, query_node, search_targets))
+
+    for subreddits in list(open_batch_dict.keys()):
+        close_batch(subreddits)
+    return batch_list
+
+
+# Returns the searches that have to run together because they share a Reddit query, directly or through a batch, as a
+# list of sorted lists of search names. A search whose name appears in several queries joins them into one group
+def get_search_groups(batch_list):
+    group_list = []
+    for subreddits, search_string, search_members in batch_list:
+        group = set(search_name for query_node, search_targets in search_members
+                    for email_recipient, search_name in search_targets)
+        for other_group in [other_group for other_group in group_list if len(other_group & group) > 0]:
+            group_list.remove(other_group)
+            group |= other_group
+        group_list.append(group)
+    return [sorted(group) for group in group_list]
@@ -0,0 +1,144 @@
+import re
+
+# Fields that can be evaluated locally against a submission. Reddit supports more (author:, site:, flair:...), but a
+# query using them can't be matched locally and is left to run on its own
+SUPPORTED_FIELDS = ["title", "selftext"]
+
+# Words are runs of letters, digits and underscores, compared case insensitively like Reddit's search
+WORD_PATTERN = re.compile(r"\w+")
+
+# Tokens of the search syntax: parentheses, optionally field-prefixed quoted phrases, and bare words
+QUERY_TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|(?:(\w+):)?"([^"]*)"|(?:(\w+):)?([^\s()"]+))')
+
+
+# Raised when a search string uses syntax the local evaluator doesn't understand
+class SearchQueryError(ValueError):
+    pass
+
+
+# Returns the lowercase words of the text joined by single spaces and padded with a space on either side, so a
+# phrase can be matched on word boundaries with a substring check
+def normalize_text(text):
+    return " {} ".format(" ".join(WORD_PATTERN.findall(text.lower())))
+
+
+# Split a search string into a list of tokens. Operators are ("operator", "AND"|"OR"|"NOT"), parentheses are
+# ("paren", "("|")") and terms are ("term", field, normalized_text)
+def tokenize_search_query(search_string):
+    tokens = []
+    position = 0
+    search_string = search_string.rstrip()
+    while position < len(search_string):
+        match = QUERY_TOKEN_PATTERN.match(search_string, position)
+        if match is None:
+            raise SearchQueryError("Unable to parse [{}] at position {}".format(search_string, position))
+        position = match.end()
+        open_paren, close_paren, phrase_field, phrase, word_field, word = match.groups()
+        if open_paren or close_paren:
+            tokens.append(("paren", open_paren or close_paren))
+        elif word in ["AND", "OR", "NOT"] and word_field is None:
+            tokens.append(("operator", word))
+        elif word is not None and word.startswith("-"):
+            raise SearchQueryError("Negation with [-] isn't supported, use NOT instead")
+        else:
+            field = phrase_field if phrase is not None else word_field
+            if field is not None and field not in SUPPORTED_FIELDS:
+                raise SearchQueryError("Field [{}:] can't be evaluated locally".format(field))
+            text = normalize_text(phrase if phrase is not None else word)
+            if text.strip() == "":
+                raise SearchQueryError("Term [{}] has no words to match".format(phrase or word))
+            tokens.append(("term", field, text))
+    return tokens
+
+
+# Recursive descent parser for the search syntax. Precedence from loosest to tightest is OR, AND (explicit or implied
+# by adjacent terms), NOT. Nodes are tuples: ("or", [nodes]), ("and", [nodes]), ("not", node), ("term", field, text)
+class _SearchQueryParser:
+
+    def __peek(self):
+        return self._tokens[self._position] if self._position < len(self._tokens) else None
+
+    def __parse_or(self):
+        children = [self.__parse_and()]
+        while self.__peek() == ("operator", "OR"):
+            self._position += 1
+            children.append(self.__parse_and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def __parse_and(self):
+        children = [self.__parse_not()]
+        while True:
+            token = self.__peek()
+            if token == ("operator", "AND"):
+                self._position += 1
+            elif token is None or token == ("operator", "OR") or token == ("paren", ")"):
+                break
+            children.append(self.__parse_not())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def __parse_not(self):
+        if self.__peek() == ("operator", "NOT"):
+            self._position += 1
+            return ("not", self.__parse_not())
+        return self.__parse_atom()
+
+    def __parse_atom(self):
+        token = self.__peek()
+        if token is None:
+            raise SearchQueryError("Search string ended unexpectedly")
+        self._position += 1
+        if token == ("paren", "("):
+            node = self.__parse_or()
+            if self.__peek() != ("paren", ")"):
+                raise SearchQueryError("Unbalanced parentheses")
+            self._position += 1
+            return node
+        elif token[0] == "term":
+            return token
+        raise SearchQueryError("Unexpected {} [{}]".format(token[0], token[1]))
+
+    def parse(self):
+        node = self.__parse_or()
+        if self.__peek() is not None:
+            raise SearchQueryError("Unexpected {} [{}]".format(*self.__peek()))
+        return node
+
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._position = 0
+
+
+# Parse a search string like 'title:PRAW AND ("exact match" OR NOT python)' into a node tree for match_search_query
+def parse_search_query(search_string):
+    return _SearchQueryParser(tokenize_search_query(search_string)).parse()
+
+
+# Returns a list of (field, text) terms at least one of which appears in every submission the query matches, or None
+# if there's no such guarantee (e.g. "NOT python" matches submissions without any of the query's terms)
+def get_required_terms(node):
+    if node[0] == "term":
+        return [(node[1], node[2])]
+    elif node[0] == "not":
+        return None
+    child_term_lists = [get_required_terms(child) for child in node[1]]
+    if node[0] == "and":
+        # Any child's terms are required, so use the shortest list to rule out the most submissions
+        child_term_lists = [term_list for term_list in child_term_lists if term_list is not None]
+        return min(child_term_lists, key=len) if len(child_term_lists) > 0 else None
+    if None in child_term_lists:
+        return None
+    return [term for term_list in child_term_lists for term in term_list]
+
+
+# Evaluate the node tree against a submission's title and selftext, each already passed through normalize_text.
+# A term without a field matches either of them
+def match_search_query(node, normalized_title, normalized_selftext):
+    if node[0] == "term":
+        field, text = node[1], node[2]
+        return (field != "selftext" and text in normalized_title) or \
+               (field != "title" and text in normalized_selftext)
+    elif node[0] == "not":
+        return not match_search_query(node[1], normalized_title, normalized_selftext)
+    elif node[0] == "and":
+        return all(match_search_query(child, normalized_title, normalized_selftext) for child in node[1])
+    return any(match_search_query(child, normalized_title, normalized_selftext) for child in node[1])
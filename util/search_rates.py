@@ -0,0 +1,94 @@
+import json
+import threading
+from os import path
+
+from util.file_lock import merge_json_file
+from util.log_setup import get_logger_with_name
+
+SECONDS_PER_DAY = 60 * 60 * 24
+
+
+# Persists each search's history of new (post-dedupe) results as JSON, so a polling interval can be picked from how
+# often the search actually finds something. Older history counts for less, halving in weight every half-life, so the
+# rate follows searches that become more or less active
+class SearchRateStore:
+
+    # Record a run of a search that found the given number of new results. The first recorded run only marks the time,
+    # as the results it found may have been posted any time before it
+    def record_run(self, search_name, new_result_count, run_started_utc, half_life_seconds):
+        with self._lock:
+            state = self._state_dict.setdefault(search_name, {"result_count": 0.0, "elapsed_seconds": 0.0})
+            self._changed_names.add(search_name)
+            last_run_utc = state.get("last_run_utc")
+            state["last_run_utc"] = run_started_utc
+            if last_run_utc is None or run_started_utc <= last_run_utc:
+                return
+            elapsed_seconds = run_started_utc - last_run_utc
+            decay = 0.5 ** (elapsed_seconds / half_life_seconds)
+            state["result_count"] = state["result_count"] * decay + new_result_count
+            state["elapsed_seconds"] = state["elapsed_seconds"] * decay + elapsed_seconds
+
+    # Returns the search's average number of new results per day, or None if it hasn't been observed yet
+    def get_daily_rate(self, search_name):
+        with self._lock:
+            state = self._state_dict.get(search_name)
+            if state is None or state["elapsed_seconds"] == 0:
+                return None
+            return state["result_count"] / state["elapsed_seconds"] * SECONDS_PER_DAY
+
+    # Returns the interval in seconds a search should be polled at to find the target number of new results per run,
+    # kept between the minimum and maximum. The default interval is treated as one run's worth of history that found
+    # the target number, so a search without history starts at the default and moves away from it as runs add up
+    def get_interval(self, search_name, default_interval_seconds, min_interval_seconds, max_interval_seconds,
+                     target_results_per_run):
+        with self._lock:
+            state = self._state_dict.get(search_name, {"result_count": 0.0, "elapsed_seconds": 0.0})
+            result_count = state["result_count"] + target_results_per_run
+            elapsed_seconds = state["elapsed_seconds"] + default_interval_seconds
+        interval_seconds = target_results_per_run * elapsed_seconds / result_count
+        return min(max_interval_seconds, max(min_interval_seconds, interval_seconds))
+
+    # Drop the history of searches that are no longer configured
+    def remove_other_searches(self, search_names):
+        with self._lock:
+            for search_name in list(self._state_dict.keys()):
+                if search_name not in search_names:
+                    self._state_dict.pop(search_name)
+                    self._changed_names.discard(search_name)
+                    self._removed_names.add(search_name)
+
+    # Write the history changed since the last save to disk, picking up the history other processes sharing the file
+    # have saved since. A crash mid-write can't corrupt the existing history
+    def save(self):
+        with self._lock:
+            self._state_dict = merge_json_file(self._file_path, {search_name: self._state_dict[search_name]
+                                                                 for search_name in self._changed_names},
+                                               self._removed_names)
+            self._changed_names = set()
+            self._removed_names = set()
+        self._logger_instance.debug("Saved result rates for %d searches to %s", len(self._state_dict),
+                                    self._file_path)
+
+    # Constructor to pass in the path of the JSON history file and logging information
+    def __init__(self, file_path, console_log_level="INFO", file_log_filepath="", file_log_level="INFO"):
+
+        self._LOG_NAME = "SearchRateStore"
+        self._logger_instance = get_logger_with_name(self._LOG_NAME, console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._file_path = file_path
+        self._lock = threading.Lock()
+        self._state_dict = {}
+        # Searches recorded or removed since the last save, the only ones this process writes
+        self._changed_names = set()
+        self._removed_names = set()
+
+        if path.isfile(file_path):
+            try:
+                with open(file_path) as opened_file:
+                    self._state_dict = json.load(opened_file)
+                self._logger_instance.info("Loaded result rates for %d searches from %s", len(self._state_dict),
+                                           file_path)
+            except ValueError:
+                # Losing the history only sends every search back to the default interval
+                self._logger_instance.warning("Result rate file %s could not be parsed, starting without history",
+                                              file_path)
@@ -0,0 +1,256 @@
+import heapq
+import random
+import threading
+import time
+
+from util.log_setup import get_logger_with_name
+
+
+# Schedules searches on their own intervals with a priority queue of next run times, so the caller can sleep exactly
+# until the next search is due instead of polling. Searches that share a Reddit query (or a batch of them) are
+# scheduled together as one group, at the shortest of their intervals, so they keep running as one query rather than
+# drifting apart. Runs are spread out with random jitter per group. Searches can be paused, in which case a group's run
+# that comes due while every search in it is paused is held until one of them is resumed
+class SearchScheduler:
+
+    # Returns the interval with a random jitter applied, limited to half the interval so short intervals keep their
+    # cadence
+    def __get_jittered_interval(self, interval_seconds):
+        jitter_seconds = min(self._jitter_seconds, interval_seconds / 2)
+        return interval_seconds + random.uniform(-jitter_seconds, jitter_seconds)
+
+    # Push the group onto the queue to run at the given time. Entries for groups that were since removed or
+    # rescheduled are recognized by their stale sequence number and dropped when they reach the front of the queue
+    def __schedule(self, group, run_time):
+        self._sequence += 1
+        self._group_entry_dict[group] = (run_time, self._sequence)
+        heapq.heappush(self._run_queue, (run_time, self._sequence, group))
+
+    # Returns the interval of the group, the shortest of its searches' intervals
+    def __get_group_interval(self, group):
+        return min(self._interval_dict[search_name] for search_name in group)
+
+    # Returns whether every search in the group is paused
+    def __is_group_paused(self, group):
+        return self._all_paused or all(search_name in self._paused_set for search_name in group)
+
+    # Set the searches to schedule from a dict of search names to intervals in seconds, and optionally a list of lists
+    # of search names that run together, like the searches sharing a Reddit query. The lists must not overlap, and
+    # searches in none of them are scheduled on their own. New searches are due immediately, removed searches are
+    # unscheduled and searches with a changed interval are rescheduled. A group that changed keeps the earliest next
+    # run time of the searches in it
+    def update_searches(self, search_interval_dict, search_group_list=None):
+        with self._lock:
+            for search_name in list(self._interval_dict.keys()):
+                if search_name not in search_interval_dict:
+                    self._interval_dict.pop(search_name)
+                    self._paused_set.discard(search_name)
+                    self._held_set.discard(search_name)
+                    self._forced_set.discard(search_name)
+                    self._logger_instance.info("Unscheduled search [%s]", search_name)
+
+            new_search_group_dict = {}
+            for search_names in search_group_list or []:
+                group = tuple(sorted(set(search_name for search_name in search_names
+                                         if search_name in search_interval_dict)))
+                for search_name in group:
+                    new_search_group_dict[search_name] = group
+            for search_name in search_interval_dict:
+                new_search_group_dict.setdefault(search_name, (search_name,))
+
+            now = time.time()
+            old_interval_dict = dict(self._interval_dict)
+            self._interval_dict.update(search_interval_dict)
+            old_group_entry_dict = self._group_entry_dict
+            self._group_entry_dict = {}
+            for group in sorted(set(new_search_group_dict.values())):
+                new_search_names = [search_name for search_name in group if search_name not in old_interval_dict]
+                for search_name in new_search_names:
+                    self._logger_instance.info("Scheduled search [%s] every %.1f minutes", search_name,
+                                               self._interval_dict[search_name] / 60)
+                if any(search_name in self._running_set for search_name in group):
+                    # Scheduled by mark_finished once the run finishes
+                    continue
+                if any(search_name in self._held_set for search_name in group):
+                    # Held until resumed, unless it was grouped with a search that isn't paused
+                    if not self.__is_group_paused(group):
+                        self._held_set.difference_update(group)
+                        self.__schedule(group, now)
+                    continue
+                if len(new_search_names) > 0:
+                    self.__schedule(group, now)
+                    continue
+
+                old_group_set = set(self._search_group_dict[search_name] for search_name in group)
+                interval_seconds = self.__get_group_interval(group)
+                if old_group_set == {group} and \
+                        interval_seconds == min(old_interval_dict[search_name] for search_name in group):
+                    if group in old_group_entry_dict:
+                        self._group_entry_dict[group] = old_group_entry_dict[group]
+                    continue
+                old_run_time_list = [old_group_entry_dict[old_group][0] for old_group in old_group_set
+                                     if old_group in old_group_entry_dict]
+                if old_group_set == {group}:
+                    self.__schedule(group, now + self.__get_jittered_interval(interval_seconds))
+                    self._logger_instance.debug("Rescheduled searches [%s] every %.1f minutes", ", ".join(group),
+                                                interval_seconds / 60)
+                else:
+                    self.__schedule(group, min(old_run_time_list, default=now))
+                    self._logger_instance.debug("Grouped searches [%s] to run together", ", ".join(group))
+            self._search_group_dict = new_search_group_dict
+        self.wake()
+
+    # Run the search, along with the rest of its group, as soon as possible, even if it's paused, unless it's already
+    # running. Returns whether the run was scheduled
+    def run_now(self, search_name):
+        with self._lock:
+            if search_name not in self._interval_dict:
+                return False
+            group = self._search_group_dict[search_name]
+            if any(group_search_name in self._running_set for group_search_name in group):
+                return False
+            self._held_set.difference_update(group)
+            self._forced_set.update(group)
+            self.__schedule(group, time.time())
+        self.wake()
+        return True
+
+    # Returns whether the search is scheduled
+    def has_search(self, search_name):
+        with self._lock:
+            return search_name in self._interval_dict
+
+    # Returns whether the search is paused, or, without a search name, whether every search is
+    def is_paused(self, search_name=None):
+        with self._lock:
+            return self._all_paused or search_name in self._paused_set
+
+    # Pause the search, or every search if no name is passed in. Runs already in progress finish. A search that shares
+    # a query with a search that isn't paused keeps running with it
+    def pause(self, search_name=None):
+        with self._lock:
+            if search_name is None:
+                self._all_paused = True
+            else:
+                self._paused_set.add(search_name)
+        self._logger_instance.info("Paused %s", "every search" if search_name is None else
+                                   "search [{}]".format(search_name))
+
+    # Resume the search, or every search if no name is passed in. Runs that came due while paused are run right away
+    def resume(self, search_name=None):
+        with self._lock:
+            if search_name is None:
+                self._all_paused = False
+                self._paused_set = set()
+            else:
+                self._paused_set.discard(search_name)
+            now = time.time()
+            for group in set(self._search_group_dict[search_name] for search_name in self._held_set):
+                if not self.__is_group_paused(group):
+                    self._held_set.difference_update(group)
+                    self.__schedule(group, now)
+        self._logger_instance.info("Resumed %s", "every search" if search_name is None else
+                                   "search [{}]".format(search_name))
+        self.wake()
+
+    # Returns the number of searches waiting for their turn: due but not yet started, or held while paused
+    def get_queue_depth(self):
+        with self._lock:
+            now = time.time()
+            return len(self._held_set) + sum(len(group) for group, (run_time, sequence) in
+                                             self._group_entry_dict.items() if run_time <= now)
+
+    # Interrupt a wait_for_due_searches call so the queue is checked again immediately
+    def wake(self):
+        self._wake_event.set()
+
+    # Sleep until at least one search is due or max_wait_seconds pass, then return the list of due searches, which are
+    # marked as running. Every search in a due group is returned together. Returns an empty list if the wait ended
+    # without any search being due
+    def wait_for_due_searches(self, max_wait_seconds):
+        deadline = time.time() + max_wait_seconds
+        while True:
+            with self._lock:
+                now = time.time()
+                due_search_list = []
+                while len(self._run_queue) > 0 and self._run_queue[0][0] <= now:
+                    run_time, sequence, group = heapq.heappop(self._run_queue)
+                    if self._group_entry_dict.get(group) != (run_time, sequence):
+                        continue
+                    self._group_entry_dict.pop(group)
+                    if self.__is_group_paused(group) and \
+                            not any(search_name in self._forced_set for search_name in group):
+                        # Hold the run until a search in the group is resumed
+                        self._held_set.update(group)
+                        continue
+                    self._forced_set.difference_update(group)
+                    self._running_set.update(group)
+                    due_search_list.extend(group)
+                next_run_time = self._run_queue[0][0] if len(self._run_queue) > 0 else None
+                self._wake_event.clear()
+
+            if len(due_search_list) > 0 or now >= deadline:
+                return due_search_list
+            wait_seconds = deadline - now if next_run_time is None else min(deadline, next_run_time) - now
+            self._wake_event.wait(max(0.0, wait_seconds))
+
+    # Mark the searches as no longer running, scheduling the next run of their groups an interval after they started.
+    # Runs missed while a search was running are skipped rather than run back to back
+    def mark_finished(self, search_name_list, started_time):
+        with self._lock:
+            now = time.time()
+            self._running_set.difference_update(search_name_list)
+            for group in sorted(set(self._search_group_dict[search_name] for search_name in search_name_list
+                                    if search_name in self._search_group_dict)):
+                if group in self._group_entry_dict or \
+                        any(search_name in self._running_set or search_name in self._held_set
+                            for search_name in group):
+                    # Already rescheduled by run_now or update_searches, or still running with a search regrouped
+                    # into it
+                    continue
+                interval_seconds = self.__get_group_interval(group)
+                next_run_time = started_time + self.__get_jittered_interval(interval_seconds)
+                while next_run_time <= now:
+                    next_run_time += interval_seconds
+                self.__schedule(group, next_run_time)
+        self.wake()
+
+    # Returns a list of (search_name, next_run_time, interval_seconds) tuples, soonest first, with running searches
+    # and searches held while paused given a next_run_time of None
+    def get_schedule(self):
+        with self._lock:
+            schedule_list = sorted((run_time, search_name, self._interval_dict[search_name])
+                                   for group, (run_time, sequence) in self._group_entry_dict.items()
+                                   for search_name in group)
+            schedule_list = [(search_name, run_time, interval_seconds)
+                             for run_time, search_name, interval_seconds in schedule_list]
+            schedule_list.extend((search_name, None, self._interval_dict[search_name])
+                                 for search_name in sorted(self._running_set | self._held_set)
+                                 if search_name in self._interval_dict)
+            return schedule_list
+
+    # Constructor to pass in the maximum seconds of random jitter added to or removed from each interval and logging
+    # information
+    def __init__(self, jitter_seconds=0, console_log_level="INFO", file_log_filepath="", file_log_level="INFO"):
+        self._logger_instance = get_logger_with_name("SearchScheduler", console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._jitter_seconds = jitter_seconds
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        # Heap of (run_time, sequence, group) tuples, where a group is a sorted tuple of search names
+        self._run_queue = []
+        self._sequence = 0
+        # Maps each scheduled group to the (run_time, sequence) of its current queue entry
+        self._group_entry_dict = {}
+        # Maps each search to its interval in seconds, and to the group it runs with
+        self._interval_dict = {}
+        self._search_group_dict = {}
+        # Names of the searches that have been returned as due and not yet marked finished
+        self._running_set = set()
+        # Whether every search is paused, and the names of searches paused on their own
+        self._all_paused = False
+        self._paused_set = set()
+        # Names of the searches in groups whose runs came due while paused, which are run once resumed
+        self._held_set = set()
+        # Names of the searches in groups asked to run with run_now, which run even if they're paused
+        self._forced_set = set()
@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+from os import path
+
+from util.file_lock import merge_json_file
+from util.log_setup import get_logger_with_name
+
+# Reddit's time_filter windows that are narrower than the week the searches used to always request, smallest first
+# https://praw.readthedocs.io/en/latest/code_overview/models/subreddit.html#praw.models.Subreddit.search
+TIME_FILTER_WINDOWS = [("hour", 60 * 60), ("day", 60 * 60 * 24), ("week", 60 * 60 * 24 * 7)]
+
+# Reddit search indexing lags behind submission, so windows and high-water marks are widened by this many seconds
+SEARCH_WINDOW_MARGIN_SECONDS = 60 * 10
+
+
+# Returns the key a search's state is stored under. Searches with the same subreddits and parameters share state
+def get_search_state_key(subreddits, search_string):
+    return "{}|{}".format(subreddits, search_string)
+
+
+# Persists a per-search high-water mark (the newest submission seen and when the search last succeeded) as JSON so
+# each run only has to page through the submissions posted since the previous successful run
+class SearchStateStore:
+
+    # Returns the stored state dict for the key, or an empty dict if the search hasn't successfully run before
+    def get_state(self, key):
+        with self._lock:
+            return dict(self._state_dict.get(key, {}))
+
+    # Returns the smallest Reddit time_filter window covering the time since the search last successfully ran
+    def get_time_filter(self, key, now=None):
+        last_success_utc = self.get_state(key).get("last_success_utc")
+        if last_success_utc is None:
+            return TIME_FILTER_WINDOWS[-1][0]
+
+        seconds_since_last_success = (now or time.time()) - last_success_utc + SEARCH_WINDOW_MARGIN_SECONDS
+        for time_filter, window_seconds in TIME_FILTER_WINDOWS:
+            if seconds_since_last_success <= window_seconds:
+                return time_filter
+        # Fall back to the widest window, the same one every search used before state was tracked
+        return TIME_FILTER_WINDOWS[-1][0]
+
+    # Returns True once a newest-first listing has reached submissions that a previous run already walked past. Posts
+    # indexed late can be listed after the newest submission seen by the previous run, so the listing carries on past it
+    # until the margin is used up, and the submissions seen twice are dropped by dedupe
+    def is_already_seen(self, key, created_utc):
+        newest_created_utc = self.get_state(key).get("newest_created_utc")
+        return newest_created_utc is not None and created_utc < newest_created_utc - SEARCH_WINDOW_MARGIN_SECONDS
+
+    # Record a successful run of a search along with the newest submission it returned, if any
+    def record_success(self, key, run_started_utc, newest_id=None, newest_created_utc=None):
+        with self._lock:
+            state = self._state_dict.setdefault(key, {})
+            self._changed_keys.add(key)
+            state["last_success_utc"] = run_started_utc
+            if newest_created_utc is not None and newest_created_utc >= state.get("newest_created_utc", 0):
+                state["newest_id"] = newest_id
+                state["newest_created_utc"] = newest_created_utc
+
+    # Drop the state of queries that are no longer planned, like those of removed searches or of batches that changed
+    def remove_other_keys(self, keys):
+        with self._lock:
+            for key in list(self._state_dict.keys()):
+                if key not in keys:
+                    self._state_dict.pop(key)
+                    self._changed_keys.discard(key)
+                    self._removed_keys.add(key)
+
+    # Write the searches recorded or removed since the last save to disk, picking up the state other processes sharing the file
+    # (like other shards) have saved since. A crash mid-write can't corrupt the existing state
+    def save(self):
+        with self._lock:
+            self._state_dict = merge_json_file(self._file_path, {key: self._state_dict[key]
+                                                                 for key in self._changed_keys}, self._removed_keys)
+            self._changed_keys = set()
+            self._removed_keys = set()
+        self._logger_instance.debug("Saved state for %d searches to %s", len(self._state_dict), self._file_path)
+
+    # Constructor to pass in the path of the JSON state file and logging information
+    def __init__(self, file_path, console_log_level="INFO", file_log_filepath="", file_log_level="INFO"):
+
+        self._LOG_NAME = "SearchStateStore"
+        self._logger_instance = get_logger_with_name(self._LOG_NAME, console_log_level, file_log_filepath,
+                                                     file_log_level)
+        self._file_path = file_path
+        self._lock = threading.Lock()
+        self._state_dict = {}
+        # Keys recorded or removed since the last save, the only ones this process writes
+        self._changed_keys = set()
+        self._removed_keys = set()
+
+        if path.isfile(file_path):
+            try:
+                with open(file_path) as opened_file:
+                    self._state_dict = json.load(opened_file)
+                self._logger_instance.info("Loaded state for %d searches from %s", len(self._state_dict), file_path)
+            except ValueError:
+                # A corrupt state file only costs one full week-long search per search, so start over
+                self._logger_instance.warning("State file %s could not be parsed, starting without state", file_path)
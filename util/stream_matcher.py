@@ -0,0 +1,132 @@
+from collections import deque
+
+from util.search_query import SearchQueryError, get_required_terms, match_search_query, normalize_text, \
+    parse_search_query
+
+# The subreddit that streams every post, and so matches a post from any subreddit
+ALL_SUBREDDITS = "all"
+
+# Reddit's other aliases for a mix of subreddits, which can't be told apart from a post's own subreddit
+SUBREDDIT_ALIASES = ["popular", "friends", "mod"]
+
+
+# Aho-Corasick automaton finding every one of a fixed set of patterns in a text in a single pass, so the cost of
+# scanning a submission doesn't grow with the number of keywords being looked for
+# https://en.wikipedia.org/wiki/Aho%E2%80%93Corasick_algorithm
+class AhoCorasickAutomaton:
+
+    # Returns the set of indices (into the pattern list passed to the constructor) of the patterns found in the text
+    def find_all(self, text):
+        found_pattern_set = set()
+        state = 0
+        for character in text:
+            while state != 0 and character not in self._goto_list[state]:
+                state = self._fail_list[state]
+            state = self._goto_list[state].get(character, 0)
+            found_pattern_set.update(self._output_list[state])
+        return found_pattern_set
+
+    # Constructor to pass in the list of pattern strings to look for
+    def __init__(self, pattern_list):
+        # Each state has a dict of character transitions, a fallback state, and the patterns ending at it
+        self._goto_list = [{}]
+        self._fail_list = [0]
+        self._output_list = [set()]
+
+        # Build a trie of the patterns
+        for pattern_index, pattern in enumerate(pattern_list):
+            state = 0
+            for character in pattern:
+                if character not in self._goto_list[state]:
+                    self._goto_list.append({})
+                    self._fail_list.append(0)
+                    self._output_list.append(set())
+                    self._goto_list[state][character] = len(self._goto_list) - 1
+                state = self._goto_list[state][character]
+            self._output_list[state].add(pattern_index)
+
+        # Breadth first, point each state at the longest proper suffix of it that is also in the trie
+        state_queue = deque(self._goto_list[0].values())
+        while len(state_queue) > 0:
+            state = state_queue.popleft()
+            for character, next_state in self._goto_list[state].items():
+                state_queue.append(next_state)
+                fail_state = self._fail_list[state]
+                while fail_state != 0 and character not in self._goto_list[fail_state]:
+                    fail_state = self._fail_list[fail_state]
+                self._fail_list[next_state] = self._goto_list[fail_state].get(character, 0)
+                self._output_list[next_state] |= self._output_list[self._fail_list[next_state]]
+
+
+# Evaluates every planned search against a streamed submission. The terms each search requires are found with one
+# Aho-Corasick pass over the title and selftext, and only the searches with a required term present (plus those that
+# don't require any) have their full query evaluated
+class SearchMatcher:
+
+    # Returns the list of (email_recipient, search_name) search targets whose searches match the submission
+    def match(self, subreddit_name, title, selftext):
+        normalized_title = normalize_text(title)
+        normalized_selftext = normalize_text(selftext)
+
+        # Find the searches with at least one of their required terms present in the field the term applies to
+        candidate_search_set = set(self._unfiltered_search_list)
+        title_pattern_set = self._automaton.find_all(normalized_title)
+        selftext_pattern_set = self._automaton.find_all(normalized_selftext)
+        for pattern_index in title_pattern_set | selftext_pattern_set:
+            for field, search_index in self._pattern_search_list[pattern_index]:
+                if (field != "selftext" and pattern_index in title_pattern_set) or \
+                        (field != "title" and pattern_index in selftext_pattern_set):
+                    candidate_search_set.add(search_index)
+
+        matched_target_list = []
+        for search_index in sorted(candidate_search_set):
+            subreddit_set, query_node, search_targets = self._search_list[search_index]
+            if (ALL_SUBREDDITS in subreddit_set or subreddit_name.lower() in subreddit_set) and \
+                    match_search_query(query_node, normalized_title, normalized_selftext):
+                matched_target_list.extend(search_targets)
+        return matched_target_list
+
+    # Returns the subreddits of every compiled search joined into a multireddit string
+    def get_subreddits(self):
+        return "+".join(sorted(set(subreddit for subreddit_set, query_node, search_targets in self._search_list
+                                   for subreddit in subreddit_set)))
+
+    # Returns a dict of the queries that couldn't be compiled, mapping (subreddits, search_string) to the error
+    def get_skipped_queries(self):
+        return self._skipped_query_dict
+
+    # Constructor to pass in a dict of planned queries as returned by plan_searches. Queries that can't be evaluated
+    # locally are left out and returned by get_skipped_queries
+    def __init__(self, query_dict):
+        # List of (subreddit_set, query_node, search_targets) for each compiled search
+        self._search_list = []
+        # Indices of the searches without required terms, which are evaluated against every submission
+        self._unfiltered_search_list = []
+        # Dict of queries that couldn't be compiled, mapping (subreddits, search_string) to the parsing error
+        self._skipped_query_dict = {}
+
+        # Maps each distinct required term text to the list of (field, search_index) tuples requiring it
+        pattern_dict = {}
+        for (subreddits, search_string), search_targets in query_dict.items():
+            subreddit_set = set(subreddits.lower().split("+"))
+            try:
+                query_node = parse_search_query(search_string)
+                for subreddit in subreddit_set:
+                    # r/all with excluded subreddits, like all-python, is left out as well
+                    if subreddit in SUBREDDIT_ALIASES or "-" in subreddit:
+                        raise SearchQueryError("Subreddit [{}] can't be matched locally".format(subreddit))
+            except SearchQueryError as exception:
+                self._skipped_query_dict[(subreddits, search_string)] = exception
+                continue
+
+            search_index = len(self._search_list)
+            self._search_list.append((subreddit_set, query_node, search_targets))
+            required_terms = get_required_terms(query_node)
+            if required_terms is None:
+                self._unfiltered_search_list.append(search_index)
+                continue
+            for field, text in required_terms:
+                pattern_dict.setdefault(text, []).append((field, search_index))
+
+        self._automaton = AhoCorasickAutomaton(list(pattern_dict.keys()))
+        self._pattern_search_list = list(pattern_dict.values())
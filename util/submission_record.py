@@ -0,0 +1,64 @@
+from collections import namedtuple
+
+# Immutable, slotted record of the submission fields used after a search, created when results are ingested so the
+# results don't keep full PRAW Submission objects (and through them the Reddit instance) alive.
+# Fields are documented on https://praw.readthedocs.io/en/latest/code_overview/models/submission.html
+SubmissionRecord = namedtuple("SubmissionRecord", ["id", "title", "permalink", "created_utc", "subreddit", "url"])
+
+
+# Create a SubmissionRecord from a PRAW Submission. All fields are present in search and stream listings, so reading
+# them doesn't trigger a fetch
+def create_submission_record(submission):
+    return SubmissionRecord(submission.id, submission.title, submission.permalink, submission.created_utc,
+                            submission.subreddit.display_name, submission.url)
+
+
+# Holds the results of a cycle as a flat index of submission ID to the set of (email_recipient, search_name) search
+# targets it was found for, alongside the record of each submission
+class SearchResultIndex:
+
+    # Add a submission record to the index for each of the search targets
+    def add(self, search_targets, submission_record):
+        self._record_dict[submission_record.id] = submission_record
+        self._target_dict.setdefault(submission_record.id, set()).update(search_targets)
+
+    # Returns the set of all submission IDs in the index
+    def get_submission_ids(self):
+        return set(self._target_dict.keys())
+
+    # Remove the submissions with the given IDs from the index
+    def remove(self, submission_ids):
+        for submission_id in submission_ids:
+            self._record_dict.pop(submission_id, None)
+            self._target_dict.pop(submission_id, None)
+
+    # Returns the set of email recipients with at least one result
+    def get_email_recipients(self):
+        return set(email_recipient for search_targets in self._target_dict.values()
+                   for email_recipient, search_name in search_targets)
+
+    # Returns a dict of each search name with results to the set of submission IDs found for it
+    def get_submission_ids_by_search(self):
+        search_dict = {}
+        for submission_id, search_targets in self._target_dict.items():
+            for email_recipient, search_name in search_targets:
+                search_dict.setdefault(search_name, set()).add(submission_id)
+        return search_dict
+
+    # Returns the results grouped first by recipient email, then by search name, then by submission ID, with each
+    # search's submissions ordered newest first
+    def get_results_by_recipient(self):
+        result_dict = {}
+        for submission_record in sorted(self._record_dict.values(), key=lambda record: record.created_utc,
+                                        reverse=True):
+            for email_recipient, search_name in sorted(self._target_dict[submission_record.id]):
+                result_dict.setdefault(email_recipient, {}).setdefault(search_name, {})[submission_record.id] = \
+                    submission_record
+        return result_dict
+
+    def __len__(self):
+        return len(self._record_dict)
+
+    def __init__(self):
+        self._record_dict = {}
+        self._target_dict = {}